@@ -1,5 +1,6 @@
 import hail as hl
 from utils.elasticsearch_client import ElasticsearchClient
+from utils.elasticsearch_utils import child_table_for_array_field
 #import argparse
 
 '''
@@ -22,10 +23,76 @@ ds = hl.read_table(args.ht_url)
 print("\n=== Exporting to Elasticsearch ===")
 '''
 
-def export_ht_to_es(ht, host = '172.23.117.23', port = 9200, index_name = 'pcgc_chr20_test',index_type = 'variant',es_block_size = 200,num_shards = 1):
+def export_ht_to_es(
+		ht,
+		host='172.23.117.23',
+		port=9200,
+		index_name='pcgc_chr20_test',
+		index_type='variant',
+		es_block_size=200,
+		num_shards=1,
+		document_hashes_path=None,
+		reset_document_hashes=False,
+		id_field='variant_id',
+		export_progress_path=None,
+		resume_export=False,
+		optimize_mapping=False,
+		nested_fields=('sortedTranscriptConsequences',),
+		transcript_consequences_as_children=False,
+		split_by_contig=False,
+		sniff=False,
+):
 
-	es = ElasticsearchClient(host, port)
+	# host can be a comma-separated list of nodes. Clients with the same settings share one connection pool.
+	es = ElasticsearchClient(host, port, sniff=sniff)
+
+	# export each transcript consequence as a separate document in <index_name>_transcript_consequence, so that
+	# variant-level fields can be updated without re-indexing consequences
+	child_table = None
+	if transcript_consequences_as_children:
+		child_table = child_table_for_array_field(ht, 'sortedTranscriptConsequences', 'transcript_id', parent_id_field=id_field)
+		ht = ht.drop('sortedTranscriptConsequences')
+
+	# only send documents that changed since the export that wrote document_hashes_path. reset_document_hashes
+	# re-creates the index from the whole table instead, and starts a new set of hashes
+	if document_hashes_path:
+		es.export_table_to_elasticsearch_incremental(
+		    ht,
+		    document_hashes_path,
+		    index_name=index_name,
+		    ignore_previous_hashes=reset_document_hashes,
+		    index_type_name=index_type,
+		    id_field=id_field,
+		    block_size=es_block_size,
+		    num_shards=num_shards,
+		    optimize_mapping=optimize_mapping,
+		    nested_fields=nested_fields,
+		    child_table=child_table,
+		    export_globals_to_index_meta=True,
+		    verbose=True,
+		)
+		return
 	
+	# one index per contig behind an alias named index_name, loaded concurrently
+	if split_by_contig:
+		es.export_table_to_elasticsearch_by_contig(
+		    ht,
+		    alias_name=index_name,
+		    index_type_name=index_type,
+		    block_size=es_block_size,
+		    num_shards=num_shards,
+		    delete_index_before_exporting=True,
+		    elasticsearch_mapping_id=id_field,
+		    optimize_mapping=optimize_mapping,
+		    nested_fields=nested_fields,
+		    export_globals_to_index_meta=True,
+		    export_progress_path=export_progress_path,
+		    resume_export=resume_export,
+		    child_table=child_table,
+		    verbose=True,
+		)
+		return
+
 	es.export_table_to_elasticsearch(
 	    ht,
 	    index_name=index_name,
@@ -33,6 +100,13 @@ def export_ht_to_es(ht, host = '172.23.117.23', port = 9200, index_name = 'pcgc_
 	    block_size=es_block_size,
 	    num_shards=num_shards,
 	    delete_index_before_exporting=True,
+	    elasticsearch_mapping_id=id_field,
+	    optimize_mapping=optimize_mapping,
+	    nested_fields=nested_fields,
 	    export_globals_to_index_meta=True,
+	    export_progress_path=export_progress_path,
+	    resume_export=resume_export,
+	    child_table=child_table,
+	    child_index_type_name='transcript_consequence',
 	    verbose=True,
 	)
@@ -0,0 +1,34 @@
+import argparse
+import json
+import logging
+
+from utils.vep import get_slim_vep_config
+
+logger = logging.getLogger()
+
+
+def generate_slim_vep_config(config_path, output_path):
+    """Writes a copy of a VEP config that only asks VEP for the fields the pipeline uses"""
+
+    with open(config_path) as f:
+        config = json.load(f)
+
+    slim_config = get_slim_vep_config(config)
+
+    with open(output_path, "w") as f:
+        json.dump(slim_config, f, indent=4)
+        f.write("\n")
+
+    logger.info("==> wrote %s: %s", output_path, " ".join(slim_config["command"]))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Generate a slim VEP config from a full one, eg. vep85-loftee-cyan.json")
+    parser.add_argument("config", help="VEP config json")
+    parser.add_argument("-o", "--output", help="Output path. Defaults to the config path with a -slim suffix.")
+
+    args = parser.parse_args()
+
+    generate_slim_vep_config(args.config, args.output or args.config.replace(".json", "-slim.json"))
@@ -1,6 +1,10 @@
 import pprint
 import argparse
 
+from utils.reference_annotations import annotate_with_reference_tables
+from utils.reference_score_tables import annotate_with_reference_score_table
+from utils.vep import vep_with_cache
+
 from annotate_frequencies import *
 from generate_split_alleles import *
 from prepare_ht_export import *
@@ -8,6 +12,18 @@ from prepare_ht_for_es import *
 from export_ht_to_es import *
 
 
+def parse_score_table_arg(score_table):
+    """Parses a --score-table argument of the form name=path or name=path:field1,field2"""
+
+    name, path = score_table.split('=', 1)
+    fields = None
+    if ':' in path.split('/')[-1]:
+        path, fields = path.rsplit(':', 1)
+        fields = fields.split(',')
+
+    return name, path, fields
+
+
 def run_pipeline(args):
     hl.init(log='./hail_annotation_pipeline.log')
 
@@ -22,19 +38,36 @@ def run_pipeline(args):
     #Annotate Population frequencies for now
     meta_ht = hl.import_table(args.meta,delimiter='\t',key='ID')
     ht = annotate_frequencies(mt,meta_ht)
+
+    #Add fields from large reference tables prepared with prepare_reference_table.py (eg. gnomAD frequencies, CADD)
+    for score_table in args.score_table:
+        name, path, fields = parse_score_table_arg(score_table)
+        ht = annotate_with_reference_score_table(ht, hl.read_table(path), name, fields=fields)
     #pprint.pprint(ht.describe())
     #pprint.pprint(ht.show())
 
-    #VEP Annotate the Hail table (ie. sites-only)
+    #VEP Annotate the Hail table (ie. sites-only). Only variants that aren't in the VEP cache yet are sent to VEP.
     #ht = hl.vep(ht, 'vep85-loftee-local.json')
+    if args.vep_config:
+        ht = vep_with_cache(ht, args.vep_config, args.vep_cache, num_workers=args.vep_workers)
     #pprint.pprint(ht.describe())
     #pprint.pprint(ht.show())
 
+    #Join ClinVar, constraint and GTEx into the variant table, so a variant page is a single document
+    ht = annotate_with_reference_tables(
+        ht,
+        args.reference_cache,
+        clinvar_path=args.clinvar_ht,
+        constraint_path=args.constraint_ht,
+        gtex_path=args.gtex_ht,
+        vep_config_path=args.vep_config,
+    )
+
     ht = prepare_ht_export(ht)
     #pprint.pprint(ht.describe()) 
     #pprint.pprint(ht.show())
 
-    ht = prepare_ht_for_es(ht)
+    ht = prepare_ht_for_es(ht, sparse_frequencies=args.sparse_frequencies)
     #pprint.pprint(ht.describe())
     #pprint.pprint(ht.show())
 
@@ -50,6 +83,15 @@ if __name__ == '__main__':
 
     parser.add_argument('--vcf', '--input', '-i', help='bgzipped VCF file (.vcf.bgz)', required=True)
     parser.add_argument('--meta', '-m', help='Meta file containing sample population and sex', required=True)
+    parser.add_argument('--vep-config', help='VEP config json. If not set, VEP is skipped.')
+    parser.add_argument('--vep-cache', help='Directory for cached VEP results', default='vep_cache')
+    parser.add_argument('--vep-workers', help='Run VEP outside of spark with this many local processes', type=int)
+    parser.add_argument('--clinvar-ht', help='ClinVar table written by populate_clinvar.py. If set, ClinVar fields are added to each variant.')
+    parser.add_argument('--constraint-ht', help='gnomAD constraint table written by populate_gnomad_constraint.py')
+    parser.add_argument('--gtex-ht', help='GTEx table written by populate_gtex_table.py')
+    parser.add_argument('--score-table', help='Large reference table prepared with prepare_reference_table.py, as name=path or name=path:field1,field2. Can be repeated.', action='append', default=[])
+    parser.add_argument('--reference-cache', help='Directory for cached reference annotations', default='reference_cache')
+    parser.add_argument('--sparse-frequencies', help='Leave empty population entries out of the ES documents', action='store_true')
 
     args = parser.parse_args()
     run_pipeline(args)
@@ -0,0 +1,116 @@
+import argparse
+import logging
+from pprint import pformat
+
+from utils.elasticsearch_client_shared import ElasticsearchClient
+
+logger = logging.getLogger()
+
+# Examples:
+#   python manage_es_snapshots.py --host 10.0.0.1 --repository local_backups --location /mnt/es_snapshots create --index gnomad_exomes
+#   python manage_es_snapshots.py --host 10.0.0.1 --repository local_backups --location /mnt/es_snapshots move \
+#       --index gnomad_exomes --dest-host 10.0.0.2 --rename-pattern "(.+)" --rename-replacement "\$1_restored"
+#
+# For "fs" repositories, --location must be listed in the path.repo setting of every node in both clusters.
+
+
+def ensure_repository(client, args, readonly=False):
+    client.snapshot_manager.ensure_repository(
+        args.repository,
+        repository_type=args.repository_type,
+        location=args.location,
+        bucket=args.bucket,
+        base_path=args.base_path,
+        readonly=readonly,
+    )
+
+
+def restore(client, args, snapshot_name=None):
+    return client.snapshot_manager.restore_snapshot(
+        args.repository,
+        snapshot_name=snapshot_name or args.snapshot,
+        indices=args.index or None,
+        rename_pattern=args.rename_pattern,
+        rename_replacement=args.rename_replacement,
+        index_settings={"number_of_replicas": args.num_replicas} if args.num_replicas is not None else None,
+        wait=not args.no_wait,
+    )
+
+
+def run(args):
+    client = ElasticsearchClient(args.host, args.port)
+    client.snapshot_manager.poll_interval_seconds = args.poll_interval
+
+    if args.command == "create":
+        ensure_repository(client, args)
+        client.snapshot_manager.create_snapshot(
+            args.repository, args.index, snapshot_name=args.snapshot, wait=not args.no_wait)
+
+    elif args.command == "restore":
+        ensure_repository(client, args, readonly=True)
+        restore(client, args)
+
+    elif args.command == "move":
+        # snapshot on the source cluster, then restore on the destination cluster from the same repository
+        ensure_repository(client, args)
+        snapshot_name = client.snapshot_manager.create_snapshot(args.repository, args.index, snapshot_name=args.snapshot)
+
+        dest_client = ElasticsearchClient(args.dest_host, args.dest_port)
+        dest_client.snapshot_manager.poll_interval_seconds = args.poll_interval
+        ensure_repository(dest_client, args, readonly=True)
+        restore(dest_client, args, snapshot_name=snapshot_name)
+
+    elif args.command == "list":
+        for snapshot in client.snapshot_manager.list_snapshots(args.repository):
+            logger.info("%s  %s  %s  %s" % (
+                snapshot["snapshot"], snapshot["state"], snapshot.get("start_time"), ", ".join(snapshot["indices"])))
+
+    elif args.command == "prune":
+        deleted = client.snapshot_manager.prune_snapshots(
+            args.repository, keep_last=args.keep_last, max_age_days=args.max_age_days, name_prefix=args.name_prefix)
+        logger.info("==> deleted %d snapshots: %s" % (len(deleted), pformat(deleted)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--host', help='Elasticsearch host, or a comma-separated list of hosts', default='localhost')
+    parser.add_argument('--port', help='Elasticsearch port', default=9200, type=int)
+    parser.add_argument('--repository', help='Snapshot repository name', required=True)
+    parser.add_argument('--repository-type', help='Snapshot repository type', choices=['fs', 'gcs'], default='fs')
+    parser.add_argument('--location', help='Shared directory for fs repositories')
+    parser.add_argument('--bucket', help='GCS bucket for gcs repositories')
+    parser.add_argument('--base-path', help='Sub-directory inside the GCS bucket', default='')
+    parser.add_argument('--poll-interval', help='Seconds between progress checks', default=10, type=int)
+
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    create_parser = subparsers.add_parser('create', help='Snapshot one or more indices')
+    restore_parser = subparsers.add_parser('restore', help='Restore indices from a snapshot')
+    move_parser = subparsers.add_parser('move', help='Snapshot indices and restore them on another cluster')
+    subparsers.add_parser('list', help='List snapshots in the repository')
+    prune_parser = subparsers.add_parser('prune', help='Delete snapshots outside the retention policy')
+
+    for p in (create_parser, restore_parser, move_parser):
+        p.add_argument('--index', help='Index name or pattern. Can be specified more than once.', action='append',
+                       required=p is not restore_parser)
+        p.add_argument('--snapshot', help='Snapshot name. Restore defaults to the latest successful snapshot.')
+        p.add_argument('--no-wait', help="Don't wait for the operation to finish", action='store_true')
+
+    for p in (restore_parser, move_parser):
+        p.add_argument('--rename-pattern', help='Regular expression matching index names to rename, eg. "(.+)"')
+        p.add_argument('--rename-replacement', help='Replacement for --rename-pattern, eg. "$1_restored"')
+        p.add_argument('--num-replicas', help='Number of replicas for the restored indices', type=int)
+
+    move_parser.add_argument('--dest-host', help='Destination Elasticsearch host(s)', required=True)
+    move_parser.add_argument('--dest-port', help='Destination Elasticsearch port', default=9200, type=int)
+
+    prune_parser.add_argument('--keep-last', help='Always keep this many of the most recent snapshots', type=int)
+    prune_parser.add_argument('--max-age-days', help='Delete snapshots older than this', type=float)
+    prune_parser.add_argument('--name-prefix', help='Only prune snapshots whose names start with this prefix')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    run(args)
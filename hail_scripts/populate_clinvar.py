@@ -13,17 +13,21 @@ from utils import (
     get_expr_for_start_pos,
     get_expr_for_variant_id,
     get_expr_for_xpos,
+    get_expr_for_vep_consequence_dicts,
     get_expr_for_vep_consequence_terms_set,
-    get_expr_for_vep_gene_id_to_consequence_map,
     get_expr_for_vep_gene_ids_set,
     get_expr_for_vep_protein_domains_set,
     get_expr_for_vep_sorted_transcript_consequences_array,
-    get_expr_for_vep_transcript_id_to_consequence_map,
     get_expr_for_vep_transcript_ids_set,
     get_expr_for_worst_transcript_consequence_annotations_struct,
     get_expr_for_variant_ids,
+    select_vep_fields,
 )
 
+from utils.clinvar import CLINVAR_REFRESH_FULL, get_clinvar_refresh_mode
+from utils.elasticsearch_client import LATEST_DOCUMENT_HASHES_FILE
+from utils.vep import vep_with_cache
+
 from export_ht_to_es import *
 
 logger = logging.getLogger()
@@ -134,80 +138,184 @@ def import_vcf(
 
 
 
-def populate_clinvar():
-
-    #clinvar_release_date = _parse_clinvar_release_date('clinvar.vcf.gz')
-    #mt = import_vcf('clinvar.vcf.gz', "37", drop_samples=True, min_partitions=2000, skip_invalid_loci=True)
-    #mt = mt.annotate_globals(version=clinvar_release_date)
+def annotate_clinvar_variants(ht, include_consequence_json=False):
+    """Computes the fields of the ClinVar index from an imported ClinVar table that has a vep field"""
 
-
-    '''
-    print("\n=== Running VEP ===")
-    mt = hl.vep(mt, 'vep85-loftee-local.json', name="vep")
-
-    print("\n=== Processing ===")
-    mt = mt.annotate_rows(
-        sortedTranscriptConsequences=get_expr_for_vep_sorted_transcript_consequences_array(vep_root=mt.vep)
+    ht = ht.annotate(
+        sortedTranscriptConsequences=get_expr_for_vep_sorted_transcript_consequences_array(vep_root=ht.vep)
     )
 
-    mt = mt.annotate_rows(
+    ht = ht.annotate(
         main_transcript=get_expr_for_worst_transcript_consequence_annotations_struct(
-            vep_sorted_transcript_consequences_root=mt.sortedTranscriptConsequences
+            vep_sorted_transcript_consequences_root=ht.sortedTranscriptConsequences
         )
     )
 
-    mt = mt.annotate_rows(
+    ht = ht.annotate(
         gene_ids=get_expr_for_vep_gene_ids_set(
-            vep_transcript_consequences_root=mt.sortedTranscriptConsequences
+            vep_transcript_consequences_root=ht.sortedTranscriptConsequences
         ),
     )
 
-    review_status_str = hl.delimit(hl.sorted(hl.array(hl.set(mt.info.CLNREVSTAT)), key=lambda s: s.replace("^_", "z")))
-
-    mt = mt.select_rows(
-        allele_id=mt.info.ALLELEID,
-        alt=get_expr_for_alt_allele(mt),
-        chrom=get_expr_for_contig(mt.locus),
-        clinical_significance=hl.delimit(hl.sorted(hl.array(hl.set(mt.info.CLNSIG)), key=lambda s: s.replace("^_", "z"))),
-        domains=get_expr_for_vep_protein_domains_set(vep_transcript_consequences_root=mt.vep.transcript_consequences),
-        gene_ids=mt.gene_ids,
-        gene_id_to_consequence_json=get_expr_for_vep_gene_id_to_consequence_map(
-            vep_sorted_transcript_consequences_root=mt.sortedTranscriptConsequences,
-            gene_ids=mt.gene_ids
+    review_status_str = hl.delimit(hl.sorted(hl.array(hl.set(ht.info.CLNREVSTAT)), key=lambda s: s.replace("^_", "z")))
+
+    return ht.select(
+        allele_id=ht.info.ALLELEID,
+        alt=get_expr_for_alt_allele(ht),
+        chrom=get_expr_for_contig(ht.locus),
+        clinical_significance=hl.delimit(hl.sorted(hl.array(hl.set(ht.info.CLNSIG)), key=lambda s: s.replace("^_", "z"))),
+        domains=get_expr_for_vep_protein_domains_set(vep_transcript_consequences_root=ht.vep.transcript_consequences),
+        gene_ids=ht.gene_ids,
+        **get_expr_for_vep_consequence_dicts(
+            vep_sorted_transcript_consequences_root=ht.sortedTranscriptConsequences,
+            include_json=include_consequence_json,
         ),
         gold_stars=CLINVAR_GOLD_STARS_LOOKUP[review_status_str],
-        **{f"main_transcript_{field}": mt.main_transcript[field] for field in mt.main_transcript.dtype.fields},
-        pos=get_expr_for_start_pos(mt),
-        ref=get_expr_for_ref_allele(mt),
+        **{f"main_transcript_{field}": ht.main_transcript[field] for field in ht.main_transcript.dtype.fields},
+        pos=get_expr_for_start_pos(ht),
+        ref=get_expr_for_ref_allele(ht),
         review_status=review_status_str,
         transcript_consequence_terms=get_expr_for_vep_consequence_terms_set(
-            vep_transcript_consequences_root=mt.sortedTranscriptConsequences
+            vep_transcript_consequences_root=ht.sortedTranscriptConsequences
         ),
         transcript_ids=get_expr_for_vep_transcript_ids_set(
-            vep_transcript_consequences_root=mt.sortedTranscriptConsequences
+            vep_transcript_consequences_root=ht.sortedTranscriptConsequences
         ),
-        transcript_id_to_consequence_json=get_expr_for_vep_transcript_id_to_consequence_map(
-            vep_transcript_consequences_root=mt.sortedTranscriptConsequences
-        ),
-        variant_id=get_expr_for_variant_id(mt),
-        xpos=get_expr_for_xpos(mt.locus),
+        variant_id=get_expr_for_variant_id(ht),
+        xpos=get_expr_for_xpos(ht.locus),
     )
 
-    #print("\n=== Summary ===")
-    #hl.summarize_variants(mt)
 
+def populate_clinvar(
+        clinvar_vcf_path,
+        vep_config_path,
+        genome_version="37",
+        host="172.23.117.23",
+        port=9200,
+        index_name=None,
+        index_type="variant",
+        num_shards=1,
+        es_block_size=200,
+        output_path="clinvar.ht",
+        vep_cache="vep_cache",
+        document_hashes_path="clinvar_document_hashes",
+        include_consequence_json=False,
+        force=False):
+    """Refreshes the ClinVar index from a ClinVar release.
+
+    Nothing is done if the index _meta already has this release's date as its version. Otherwise only variants
+    that aren't in the VEP cache yet are sent to VEP, and only documents that were added, changed (eg. a new
+    allele_id or clinical significance) or removed since the previous export are pushed to elasticsearch. If there
+    are no document hashes for the index (eg. it was created before they were kept), the index is re-created
+    instead, since otherwise variants that were dropped from ClinVar would never be deleted.
+
+    Args:
+        clinvar_vcf_path (str): local path of the ClinVar release vcf (.vcf.gz)
+        vep_config_path (str): VEP config json
+        genome_version (str): "37" or "38"
+        host (str): elasticsearch host
+        port (int): elasticsearch port
+        index_name (str): elasticsearch index name. Defaults to clinvar_grch<genome_version>.
+        index_type (str): elasticsearch index type
+        num_shards (int): number of shards, if the index is created from scratch
+        es_block_size (int): number of documents per bulk request
+        output_path (str): where to write the annotated ClinVar table
+        vep_cache (str): VEP cache directory - see vep_with_cache(..)
+        document_hashes_path (str): document hashes of previous exports - see export_table_to_elasticsearch_incremental(..)
+        include_consequence_json (bool): also export the *_to_consequence_json string fields
+        force (bool): refresh even if the index already has this release
+    Returns:
+        bool: whether the index was refreshed
+    """
+
+    index_name = index_name or f"clinvar_grch{genome_version}"
+
+    clinvar_release_date = _parse_clinvar_release_date(clinvar_vcf_path)
+    if clinvar_release_date is None:
+        raise ValueError(f"Couldn't find ##fileDate in the header of {clinvar_vcf_path}")
+
+    es = ElasticsearchClient(host, port)
+    index_exists = es.es.indices.exists(index=index_name)
+    indexed_release_date = None
+    if index_exists:
+        indexed_release_date = es.get_index_meta(index_name).get("version")
+        logger.info(f"==> {index_name} has ClinVar release {indexed_release_date}. New release: {clinvar_release_date}")
+
+    has_document_hashes = hl.hadoop_exists(f"{document_hashes_path}/{LATEST_DOCUMENT_HASHES_FILE}")
+    refresh_mode = get_clinvar_refresh_mode(
+        index_exists, indexed_release_date, clinvar_release_date, has_document_hashes, force=force)
+    if refresh_mode is None:
+        logger.info(f"==> {index_name} is up to date")
+        return False
+
+    logger.info(f"==> refreshing {index_name}: {refresh_mode}")
+
+    print("\n=== Importing ClinVar ===")
+    mt = import_vcf(clinvar_vcf_path, genome_version, drop_samples=True, min_partitions=2000, skip_invalid_loci=True)
+    ht = mt.rows().annotate_globals(version=clinvar_release_date)
+
+    print("\n=== Running VEP ===")
+    # variants from earlier releases are taken from the VEP cache
+    ht = vep_with_cache(ht.select("info"), vep_config_path, vep_cache)
+
+    print("\n=== Processing ===")
+    ht = annotate_clinvar_variants(ht, include_consequence_json=include_consequence_json)
+    ht = ht.checkpoint(output_path, overwrite=True)
 
-    # Drop key columns for export
-    rows = mt.rows()
-    rows = rows.order_by(rows.variant_id).drop("locus", "alleles")
-    rows.write('clinvar.ht',overwrite=True)
-    '''
     print("\n=== Exporting to Elasticsearch ===")
-    rows = hl.read_table('clinvar.ht')
-    export_ht_to_es(rows, index_name = 'clinvar_grch37',index_type = 'variant')
+    # documents are diffed against the previous export by variant_id, so the table doesn't need to be sorted
+    export_ht_to_es(
+        ht.key_by().drop("locus", "alleles"),
+        host=host,
+        port=port,
+        index_name=index_name,
+        index_type=index_type,
+        es_block_size=es_block_size,
+        num_shards=num_shards,
+        document_hashes_path=document_hashes_path,
+        reset_document_hashes=refresh_mode == CLINVAR_REFRESH_FULL,
+        id_field="variant_id",
+    )
 
+    # the _meta is only rewritten when documents were upserted, so set the version in case none changed
+    _meta = es.get_index_meta(index_name)
+    _meta.update(dict(hl.eval(ht.globals)))
+    es.set_index_meta(index_name, index_type, _meta)
+
+    return True
 
 
 if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument("-i", "--input", help="ClinVar release vcf (.vcf.gz)", default="clinvar.vcf.gz")
+    p.add_argument("-g", "--genome-version", help="Genome build: 37 or 38", choices=["37", "38"], default="37")
+    p.add_argument("-H", "--host", help="Elasticsearch host or IP", default="172.23.117.23")
+    p.add_argument("-p", "--port", help="Elasticsearch port", default=9200, type=int)
+    p.add_argument("--index-name", help="Elasticsearch index name")
+    p.add_argument("-s", "--num-shards", help="Number of elasticsearch shards", default=1, type=int)
+    p.add_argument("-b", "--es-block-size", help="Elasticsearch block size to use when exporting", default=200, type=int)
+    p.add_argument("--vep-config", help="VEP config json", default="vep85-loftee-local.json")
+    p.add_argument("--vep-cache", help="Directory for cached VEP results", default="vep_cache")
+    p.add_argument("--output", help="Path to write the annotated ClinVar table to", default="clinvar.ht")
+    p.add_argument("--document-hashes", help="Document hashes of previous exports", default="clinvar_document_hashes")
+    p.add_argument("--consequence-json", action="store_true",
+                   help="Also export gene_id_to_consequence_json and transcript_id_to_consequence_json strings")
+    p.add_argument("--force", action="store_true", help="Refresh even if the index already has this ClinVar release")
+    args = p.parse_args()
+
     hl.init()
-    populate_clinvar()
+    populate_clinvar(
+        args.input,
+        args.vep_config,
+        genome_version=args.genome_version,
+        host=args.host,
+        port=args.port,
+        index_name=args.index_name,
+        num_shards=args.num_shards,
+        es_block_size=args.es_block_size,
+        output_path=args.output,
+        vep_cache=args.vep_cache,
+        document_hashes_path=args.document_hashes,
+        include_consequence_json=args.consequence_json,
+        force=args.force,
+    )
@@ -0,0 +1,34 @@
+import argparse
+
+import hail as hl
+
+from utils.gene_summary import get_gene_summary_table
+
+from prepare_ht_for_es import populations
+from export_ht_to_es import *
+
+
+def populate_gene_summary(args):
+    hl.init(log='./populate_gene_summary.log')
+
+    ht = hl.read_table(args.input)
+    genes = get_gene_summary_table(ht, populations)
+
+    # write the summaries first, so the export can be re-run without re-aggregating
+    genes.write(args.output, overwrite=True)
+    genes = hl.read_table(args.output)
+
+    export_ht_to_es(genes, host=args.host, port=args.port, index_name=args.index_name, index_type='gene', id_field='gene_id', nested_fields=())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build one summary document per gene from a prepared variant table')
+
+    parser.add_argument('--input', '-i', help='Prepared variant table (.ht), as written by hail_annotate_pipeline.py', required=True)
+    parser.add_argument('--output', '-o', help='Path to write the gene summary table to', default='gene_summary.ht')
+    parser.add_argument('--index-name', help='Elasticsearch index name', default='gene_summary')
+    parser.add_argument('--host', help='Elasticsearch host', default='172.23.117.23')
+    parser.add_argument('--port', help='Elasticsearch port', type=int, default=9200)
+
+    args = parser.parse_args()
+    populate_gene_summary(args)
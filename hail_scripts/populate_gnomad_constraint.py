@@ -2,6 +2,8 @@ import argparse
 import pprint
 import hail as hl
 
+from utils.reference_datasets import get_reference_dataset
+
 from export_ht_to_es import *
 
 #gsutil -m cp -r gs://gnomad-public/papers/2019-flagship-lof/v1.0/gnomad.v2.1.1.lof_metrics.by_transcript.ht .
@@ -11,10 +13,14 @@ def populate_constraint():
 
     #ds = hl.read_table('gnomad.v2.1.1.lof_metrics.by_transcript.ht')
     #ds = hl.import_table('constraint_final_standard.txt.bgz',delimiter='\t',key='transcript',impute=True)
-    ds = hl.import_table('constraint_final_cleaned.txt.bgz',delimiter='\t',key='transcript',impute=True)
+    # parsed with an explicit schema and cached as a hail table until the source file changes
+    ds = get_reference_dataset('gnomad_constraint')
 
     #ds = hl.import_table('missing_small.txt',delimiter='\t',key='transcript',impute=True)
 
+    # keyed by transcript, for the reference annotation stage of hail_annotate_pipeline.py
+    ds.write('gnomad_constraint.ht', overwrite=True)
+
     # The globals in the Hail table cause a serialization error during Elasticsearch export
     ds = ds.select_globals()
     pprint.pprint(ds.describe())
@@ -71,7 +77,7 @@ def populate_constraint():
     pprint.pprint(ds.describe())
     pprint.pprint(ds.show())
 
-    export_ht_to_es(ds, index_name = 'gnomad_constraint_2_1_1',index_type = 'constraint')
+    export_ht_to_es(ds, index_name = 'gnomad_constraint_2_1_1',index_type = 'constraint',id_field = 'transcript_id')
 
 
 
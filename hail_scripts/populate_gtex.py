@@ -1,5 +1,9 @@
+import argparse
+import os
+
 import hail as hl
 import pprint
+from utils.reference_datasets import GTEX_DATA_DIR_VARIABLE, get_data_dir, get_reference_dataset
 from export_ht_to_es import *
 
 tissue_abbr = {
@@ -60,9 +64,10 @@ tissue_abbr = {
 
 
 
-def populate_gtex():
-	meta_ht = hl.import_table('/home/ml2529/gtex_data/GTEx_v7_Annotations_SampleAttributesDS.txt',delimiter='\t',key='SAMPID')
-	mt = hl.import_matrix_table('/home/ml2529/gtex_data/ENSG00000177732.tsv', row_key='transcript_id', row_fields={'transcript_id': hl.tstr, 'gene_id': hl.tstr},entry_type=hl.tfloat32)
+def populate_gtex(gtex_data_dir=None):
+	gtex_data_dir = get_data_dir(GTEX_DATA_DIR_VARIABLE, gtex_data_dir)
+	meta_ht = get_reference_dataset('gtex_sample_attributes', data_dir=gtex_data_dir)
+	mt = hl.import_matrix_table(os.path.join(gtex_data_dir, 'ENSG00000177732.tsv'), row_key='transcript_id', row_fields={'transcript_id': hl.tstr, 'gene_id': hl.tstr},entry_type=hl.tfloat32)
 	#mt = hl.import_matrix_table('/home/ml2529/gtex_data/GTEx_Analysis_2016-01-15_v7_RSEMv1.2.22_transcript_tpm.txt.bgz', row_key='transcript_id', row_fields={'transcript_id': hl.tstr, 'gene_id': hl.tstr},entry_type=hl.tfloat32)
 
 	mt = mt.rename({'transcript_id': 'transcriptId', 'gene_id': 'geneId'})
@@ -98,7 +103,7 @@ def populate_gtex():
 
 	#ht.write('gtex_expression.ht',overwrite=True)
 
-	export_ht_to_es(ht, index_name = 'gtex_tissue_tpms_by_transcript',index_type = 'tissue_tpms')
+	export_ht_to_es(ht, index_name = 'gtex_tissue_tpms_by_transcript',index_type = 'tissue_tpms',id_field = 'transcriptId')
 
 	'''
 	sample_group_filters = [({}, True)]
@@ -140,5 +145,9 @@ def populate_gtex():
 
 
 if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--gtex-data-dir', help='Directory with the GTEx source files. Defaults to $%s' % GTEX_DATA_DIR_VARIABLE)
+	args = parser.parse_args()
+
 	hl.init()
-	populate_gtex()
+	populate_gtex(args.gtex_data_dir)
@@ -1,11 +1,15 @@
+import argparse
+
 import hail as hl
 import pprint
+from utils.reference_datasets import GTEX_DATA_DIR_VARIABLE, get_reference_dataset
 from export_ht_to_es import *
 
 
 
-def populate_gtex():
-	ht = hl.import_table('/home/ml2529/gtex_data/GTEx_Analysis_2016-01-15_v7_RSEMv1.2.22_transcript_tpm_medians_by_tissue_wo_versions.tsv.gz',delimiter='\t',key='transcript_id',force_bgz=True,impute=True)
+def populate_gtex(gtex_data_dir=None):
+	# parsed with an explicit schema and cached as a hail table until the source file changes
+	ht = get_reference_dataset('gtex_transcript_tpms', data_dir=gtex_data_dir)
 	#mt = hl.import_matrix_table('/home/ml2529/gtex_data/ENSG00000177732.tsv', row_key='transcript_id', row_fields={'transcript_id': hl.tstr, 'gene_id': hl.tstr},entry_type=hl.tfloat32)
 	#mt = hl.import_matrix_table('/home/ml2529/gtex_data/GTEx_Analysis_2016-01-15_v7_RSEMv1.2.22_transcript_tpm.txt.bgz', row_key='transcript_id', row_fields={'transcript_id': hl.tstr, 'gene_id': hl.tstr},entry_type=hl.tfloat32)
 
@@ -13,12 +17,17 @@ def populate_gtex():
 	#pprint.pprint(ht.describe())
 	#pprint.pprint(ht.show())
 	
-	#ht.write('gtex_expression.ht',overwrite=True)
+	# keyed by transcript, for the reference annotation stage of hail_annotate_pipeline.py
+	ht.write('gtex_expression.ht',overwrite=True)
 
-	export_ht_to_es(ht, index_name = 'gtex_tissue_tpms_by_transcript',index_type = 'tissue_tpms')
+	export_ht_to_es(ht, index_name = 'gtex_tissue_tpms_by_transcript',index_type = 'tissue_tpms',id_field = 'transcriptId')
 
 	
 
 if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--gtex-data-dir', help='Directory with the GTEx source files. Defaults to $%s' % GTEX_DATA_DIR_VARIABLE)
+	args = parser.parse_args()
+
 	hl.init()
-	populate_gtex()
+	populate_gtex(args.gtex_data_dir)
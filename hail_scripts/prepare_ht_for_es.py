@@ -301,7 +301,40 @@ def expr_for_field_with_subpopulations(row, field):
     )
 
 
-def reformat_freq_fields(ht):
+def sparsify_freq_fields(ht):
+    """Drops empty populations from the per-population frequency structs so they aren't written to elasticsearch.
+
+    Populations with AC=0 and AN=0 (or missing) are set to missing in every frequency struct, and the populations
+    that have data are listed in pops_present. Populations in pops_present keep all their values, including zeros.
+    Missing values aren't exported, so a singleton variant only carries the populations that were called. See
+    utils/sparse_frequencies.py for the decoder.
+
+    This relies on nulls not being written, so sparse tables can't be exported with the update or upsert write
+    operations, which write nulls explicitly to overwrite existing values.
+    """
+
+    pops = [pop for pop in populations if pop in ht.AC_adj.dtype.fields]
+
+    is_present = {
+        pop: (hl.or_else(ht.AC_adj[pop], 0) > 0) | (hl.or_else(ht.AN_adj[pop], 0) > 0)
+        for pop in pops
+    }
+
+    ht = ht.annotate(
+        pops_present=hl.array([hl.or_missing(is_present[pop], pop) for pop in pops]).filter(
+            lambda pop: hl.is_defined(pop))
+    )
+
+    return ht.annotate(**{
+        field: ht[field].annotate(**{
+            pop: hl.or_missing(is_present[pop], ht[field][pop])
+            for pop in ht[field].dtype.fields if pop in is_present
+        })
+        for field in fields_per_subpopulation
+    })
+
+
+def reformat_freq_fields(ht, sparse=False):
 
     #pprint.pprint(ht.describe())
     #x = ht.select(ht.info)
@@ -337,6 +370,10 @@ def reformat_freq_fields(ht):
     #)
 
     #pprint.pprint(ht.describe())
+
+    if sparse:
+        ht = sparsify_freq_fields(ht)
+
     return ht
 
 
@@ -428,9 +465,9 @@ def reformat_general_fields(ht):
     return ht
 
 
-def prepare_ht_for_es(ht):
+def prepare_ht_for_es(ht, sparse_frequencies=False):
     ht = reformat_general_fields(ht)
-    ht = reformat_freq_fields(ht)
+    ht = reformat_freq_fields(ht, sparse=sparse_frequencies)
     #ht = reformat_vep_fields(ht)
     
     #ht = ht.expand_types().drop("locus", "alleles", "vep")
@@ -0,0 +1,94 @@
+import argparse
+import logging
+
+import hail as hl
+
+from utils.reference_datasets import ReferenceDataset
+from utils.reference_score_tables import prepare_reference_table
+
+logger = logging.getLogger()
+
+
+def import_reference_vcf(vcf_path, reference_genome, fields=None):
+    """Imports a sites vcf such as gnomAD. Multi-allelic sites are split and the INFO fields are moved to the top
+    level, with per-allele (Number=A) fields reduced to the value for the split allele.
+    """
+
+    info_metadata = hl.get_vcf_metadata(vcf_path)['info']
+
+    mt = hl.import_vcf(vcf_path, reference_genome=reference_genome, force_bgz=True, drop_samples=True, skip_invalid_loci=True)
+    mt = hl.split_multi_hts(mt)
+
+    ht = mt.rows()
+    ht = ht.select(**{
+        field: ht.info[field][ht.a_index - 1] if info_metadata.get(field, {}).get('Number') == 'A' else ht.info[field]
+        for field in (fields or ht.info.dtype.fields)
+    })
+
+    return ht
+
+
+def import_reference_tsv(tsv_path, reference_genome, chrom_field, pos_field, ref_field, alt_field, fields=None, types=None):
+    """Imports a per-variant score file such as CADD's whole_genome_SNVs.tsv.gz.
+
+    Columns are parsed with explicit types instead of imputing them, which would take an extra pass over the file.
+    Score columns are float64 unless they're listed in types.
+    """
+
+    dataset = ReferenceDataset(
+        tsv_path,
+        tsv_path,
+        types=dict(types or {}, **{chrom_field: hl.tstr, pos_field: hl.tint32, ref_field: hl.tstr, alt_field: hl.tstr}),
+        key=[],
+        version=None,
+        default_type=hl.tfloat64,
+        import_args={'comment': '##', 'force_bgz': True, 'min_partitions': 1000},
+    )
+
+    ht = hl.import_table(tsv_path, types=dataset.get_types(), **dataset.import_args)
+    ht = ht.select(
+        locus=hl.locus(ht[chrom_field], ht[pos_field], reference_genome),
+        alleles=[ht[ref_field], ht[alt_field]],
+        **{field: ht[field] for field in (fields or ht.row.dtype.fields) if field not in (chrom_field, pos_field, ref_field, alt_field)}
+    )
+
+    return ht
+
+
+def run(args):
+    hl.init(log='./prepare_reference_table.log')
+
+    fields = args.fields.split(',') if args.fields else None
+
+    if args.vcf:
+        ht = import_reference_vcf(args.vcf, args.reference_genome, fields=fields)
+    else:
+        types = {field: hl.tstr for field in args.string_fields.split(',')} if args.string_fields else None
+        ht = import_reference_tsv(
+            args.tsv, args.reference_genome, args.chrom_field, args.pos_field, args.ref_field, args.alt_field,
+            fields=fields, types=types)
+
+    ht = prepare_reference_table(ht, args.output, n_partitions=args.n_partitions)
+    logger.info("==> wrote %s with %d partitions", args.output, ht.n_partitions())
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Convert a large reference source (eg. gnomAD sites or CADD scores) to a hail table keyed by locus and alleles')
+
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--vcf', help='Sites vcf, eg. gnomAD (.vcf.bgz)')
+    source.add_argument('--tsv', help='Per-variant score file, eg. CADD (.tsv.gz)')
+    parser.add_argument('--output', '-o', help='Path of the hail table to write', required=True)
+    parser.add_argument('--fields', help='Comma-separated list of INFO fields or columns to keep. Defaults to all.')
+    parser.add_argument('--reference-genome', help='Reference genome', default='GRCh37')
+    parser.add_argument('--n-partitions', help='Number of partitions to write', type=int)
+    parser.add_argument('--chrom-field', help='Chromosome column of the tsv', default='#Chrom')
+    parser.add_argument('--pos-field', help='Position column of the tsv', default='Pos')
+    parser.add_argument('--ref-field', help='Reference allele column of the tsv', default='Ref')
+    parser.add_argument('--alt-field', help='Alternate allele column of the tsv', default='Alt')
+    parser.add_argument('--string-fields', help='Comma-separated list of tsv columns that are strings. All other score columns are parsed as float64.')
+
+    args = parser.parse_args()
+    run(args)
@@ -1,3 +1,4 @@
+from .document_hash import *
 from .flags import *
 from .variant_id import *
 from .vep import *
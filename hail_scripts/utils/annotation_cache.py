@@ -0,0 +1,138 @@
+import hashlib
+import json
+import logging
+import time
+import uuid
+
+import hail as hl
+
+logger = logging.getLogger()
+
+
+def get_dict_hash(d):
+    """Returns the first 16 hex digits of the sha256 of a json-serializable dict, independent of key order"""
+
+    return hashlib.sha256(json.dumps(d, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def get_config_hash(config_path):
+    """Returns a short hash of a json config file that doesn't depend on key order or whitespace.
+
+    Args:
+        config_path (str): local, hdfs or gs:// path of the json config - eg. a VEP config with the VEP command,
+            cache version and plugin args
+    Returns:
+        str: first 16 hex digits of the sha256 of the normalized config
+    """
+
+    with hl.hadoop_open(config_path) as f:
+        config = json.load(f)
+
+    return get_dict_hash(config)
+
+
+class AnnotationCache:
+    """Persistent cache of an expensive per-key annotation (eg. VEP), stored as hail tables.
+
+    Each version (eg. a hash of the annotation config) gets its own directory "<cache_root>/<name>/<version>" so
+    results computed with different settings are never mixed. Newly annotated rows are written as append-only
+    parts under "<version>/parts/", and reads take the union of the parts listed in the "<version>/PARTS" manifest.
+    A part is only added to the manifest once it has been written completely. Only one writer should update a
+    cache at a time.
+    """
+
+    def __init__(self, cache_root, name, version):
+        """Constructor.
+
+        Args:
+            cache_root (str): directory to keep caches in (local, hdfs or gs://)
+            name (str): name of the annotation, eg. "vep"
+            version (str): identifies the settings the annotation was computed with, eg. get_config_hash(..)
+        """
+
+        self.path = "%s/%s/%s" % (cache_root.rstrip("/"), name, version)
+        self.parts_path = "%s/parts" % self.path
+        self.manifest_path = "%s/PARTS" % self.path
+
+    def part_paths(self):
+        """Returns the paths of all cached parts, oldest first"""
+
+        if not hl.hadoop_exists(self.manifest_path):
+            return []
+
+        with hl.hadoop_open(self.manifest_path) as f:
+            return [line.strip() for line in f if line.strip()]
+
+    def _write_manifest(self, part_paths):
+        with hl.hadoop_open(self.manifest_path, "w") as f:
+            f.write("".join("%s\n" % path for path in part_paths))
+
+    def read(self):
+        """Returns the union of all cached parts, or None if the cache is empty"""
+
+        part_paths = self.part_paths()
+        if not part_paths:
+            return None
+
+        parts = [hl.read_table(path) for path in part_paths]
+        return parts[0].union(*parts[1:]) if len(parts) > 1 else parts[0]
+
+    def _new_part_path(self, prefix):
+        # the random suffix keeps parts that are written within the same second apart
+        return "%s/%s-%s-%s.ht" % (
+            self.parts_path, prefix, time.strftime("%Y%m%d-%H%M%S", time.localtime()), uuid.uuid4().hex[:8])
+
+    def add_part(self, ht):
+        """Writes the rows of ht as a new part and returns the new part's path"""
+
+        part_path = self._new_part_path("part")
+        ht.write(part_path)
+        self._write_manifest(self.part_paths() + [part_path])
+
+        return part_path
+
+    def compact(self):
+        """Merges all parts into one, so that reads don't have to union many small tables. The old part
+        directories are no longer read and can be deleted.
+        """
+
+        part_paths = self.part_paths()
+        if len(part_paths) < 2:
+            return
+
+        compacted_part_path = self._new_part_path("compacted")
+        self.read().write(compacted_part_path)
+        self._write_manifest([compacted_part_path])
+
+        logger.info("==> compacted %d parts of %s into %s. These parts can now be deleted: %s",
+                    len(part_paths), self.path, compacted_part_path, ", ".join(part_paths))
+
+    def annotate(self, ht, annotation_field, annotate_func):
+        """Annotates ht with cached values, and only computes the annotation for keys that aren't in the cache yet.
+
+        Args:
+            ht (Table): table to annotate
+            annotation_field (str): name of the field that annotate_func adds
+            annotate_func (function): takes a table with the key fields of ht and returns it with annotation_field
+                added, eg. lambda t: hl.vep(t, config)
+        Returns:
+            Table: ht with annotation_field
+        """
+
+        keys = ht.select().distinct()
+
+        cached = self.read()
+        if cached is not None:
+            keys = keys.anti_join(cached)
+
+        num_new_keys = keys.count()
+        logger.info("==> %s: %d keys not in cache", self.path, num_new_keys)
+        if num_new_keys:
+            self.add_part(annotate_func(keys).select(annotation_field))
+            cached = self.read()
+
+        if cached is None:
+            # ht has no rows and nothing is cached yet, so annotate_func is only needed for the field's type
+            return ht.annotate(**{annotation_field: hl.null(annotate_func(keys)[annotation_field].dtype)})
+
+        return ht.annotate(**{annotation_field: cached[ht.key][annotation_field]})
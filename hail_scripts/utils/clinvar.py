@@ -0,0 +1,29 @@
+# How populate_clinvar.py brings an index up to date with a ClinVar release
+
+CLINVAR_REFRESH_INCREMENTAL = "incremental"
+CLINVAR_REFRESH_FULL = "full"
+
+
+def get_clinvar_refresh_mode(index_exists, indexed_release_date, clinvar_release_date, has_document_hashes, force=False):
+    """Decides how to refresh a ClinVar index.
+
+    Args:
+        index_exists (bool): whether the index exists
+        indexed_release_date (str): the "version" in the index _meta, ie. the release date of the indexed release
+        clinvar_release_date (str): release date of the new ClinVar release
+        has_document_hashes (bool): whether there are document hashes from a previous export
+        force (bool): refresh even if the index already has this release
+    Returns:
+        str: None if the index is already up to date, CLINVAR_REFRESH_INCREMENTAL to only send the documents that
+            changed since the previous export, or CLINVAR_REFRESH_FULL to re-create the index. Without document
+            hashes there's no way to tell which variants were dropped from ClinVar since the indexed release, so an
+            existing index is only refreshed incrementally if it has them.
+    """
+
+    if index_exists and indexed_release_date == clinvar_release_date and not force:
+        return None
+
+    if index_exists and has_document_hashes:
+        return CLINVAR_REFRESH_INCREMENTAL
+
+    return CLINVAR_REFRESH_FULL
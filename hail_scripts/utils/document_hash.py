@@ -0,0 +1,26 @@
+import hail as hl
+
+
+# 64-bit FNV-1a constants. The offset basis 0xcbf29ce484222325 doesn't fit in a signed int64, so it's stored as
+# the signed value with the same bits.
+FNV_64_OFFSET_BASIS = -3750763034362895579
+FNV_64_PRIME = 1099511628211
+
+# hail has no way to get a character's code point, so look it up. Anything outside of ASCII hashes to the same value.
+CHARACTER_CODE_LOOKUP = hl.dict({chr(code): code for code in range(1, 128)})
+
+
+def get_expr_for_document_hash(expr: hl.expr.Expression) -> hl.expr.Int64Expression:
+    """Content hash of an expression's value, computed as a 64-bit FNV-1a hash of its JSON encoding.
+
+    This is used to detect which elasticsearch documents changed between two exports, so it only needs to be
+    deterministic and well-spread - not cryptographically secure.
+    """
+    return hl.bind(
+        lambda json_str: hl.fold(
+            lambda h, i: hl.bit_xor(h, hl.int64(CHARACTER_CODE_LOOKUP.get(json_str[i], 255))) * FNV_64_PRIME,
+            hl.int64(FNV_64_OFFSET_BASIS),
+            hl.range(0, hl.len(json_str)),
+        ),
+        hl.json(expr),
+    )
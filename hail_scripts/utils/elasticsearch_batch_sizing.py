@@ -0,0 +1,140 @@
+import logging
+
+logger = logging.getLogger()
+
+
+class BulkBatchSizer:
+    """Picks elasticsearch bulk request sizes for successive export chunks.
+
+    Batches are sized to a byte budget rather than a fixed number of documents, so that small documents (eg. ClinVar)
+    are sent in large batches and large documents (eg. variants with nested transcript consequences) in small ones.
+    After each chunk, the budget is adjusted based on how long bulk requests took and whether elasticsearch rejected
+    any of them: it's halved (and the retry wait doubled) on rejections, shrunk when requests are slow, and grown
+    when they're fast.
+    """
+
+    def __init__(
+        self,
+        target_batch_bytes=5*2**20,
+        min_batch_bytes=2**20,
+        max_batch_bytes=50*2**20,
+        min_batch_entries=10,
+        max_batch_entries=20000,
+        target_request_seconds=2.0,
+        retry_count=10,
+        initial_retry_wait_seconds=10,
+        max_retry_wait_seconds=300,
+        http_retries=10,
+    ):
+        """Constructor.
+
+        Args:
+            target_batch_bytes (int): starting size of a bulk request, in bytes
+            min_batch_bytes (int): never shrink bulk requests below this many bytes
+            max_batch_bytes (int): never grow bulk requests beyond this many bytes
+            min_batch_entries (int): never send fewer documents than this in one bulk request
+            max_batch_entries (int): never send more documents than this in one bulk request
+            target_request_seconds (float): how long a single bulk request should take
+            retry_count (int): how many times to retry documents that elasticsearch rejected (es.batch.write.retry.count)
+            initial_retry_wait_seconds (int): starting wait between retries of rejected documents
+            max_retry_wait_seconds (int): the retry wait is doubled on every chunk with rejections, up to this limit
+            http_retries (int): how many times to retry a bulk request when the http connection fails (es.http.retries)
+        """
+
+        self.batch_bytes = target_batch_bytes
+        self.min_batch_bytes = min_batch_bytes
+        self.max_batch_bytes = max_batch_bytes
+        self.min_batch_entries = min_batch_entries
+        self.max_batch_entries = max_batch_entries
+        self.target_request_seconds = target_request_seconds
+        self.retry_count = retry_count
+        self.initial_retry_wait_seconds = initial_retry_wait_seconds
+        self.retry_wait_seconds = initial_retry_wait_seconds
+        self.max_retry_wait_seconds = max_retry_wait_seconds
+        self.http_retries = http_retries
+
+        self.avg_document_bytes = None
+        self.history = []
+
+    def set_avg_document_bytes(self, avg_document_bytes):
+        """Sets the average document size, which converts the byte budget into a number of documents per request"""
+        self.avg_document_bytes = max(1, int(avg_document_bytes))
+        logger.info("==> average document size: %d bytes. Starting bulk size: %d documents (%d bytes)" % (
+            self.avg_document_bytes, self.batch_entries, self.batch_bytes))
+
+    @property
+    def batch_entries(self):
+        if not self.avg_document_bytes:
+            return self.min_batch_entries
+
+        return max(self.min_batch_entries, min(self.max_batch_entries, self.batch_bytes // self.avg_document_bytes))
+
+    def elasticsearch_config(self):
+        """Returns the elasticsearch-hadoop settings for the next chunk.
+
+        See https://www.elastic.co/guide/en/elasticsearch/hadoop/current/configuration.html
+        """
+
+        return {
+            "es.batch.size.bytes": "%db" % self.batch_bytes,
+            "es.batch.size.entries": str(self.batch_entries),
+            # elasticsearch-hadoop retries documents rejected with 429 (too many requests) after this wait
+            "es.batch.write.retry.count": str(self.retry_count),
+            "es.batch.write.retry.wait": "%ds" % self.retry_wait_seconds,
+            "es.http.retries": str(self.http_retries),
+            # refresh is turned off during the load, so don't ask for one after every task
+            "es.batch.write.refresh": "false",
+        }
+
+    def slow_down(self):
+        """Halves the bulk request size, eg. when the cluster is under pressure"""
+        self.batch_bytes = max(self.min_batch_bytes, self.batch_bytes // 2)
+
+    def update(self, label, num_partitions, num_documents, elapsed_seconds, num_rejections):
+        """Records how a chunk went and adjusts the size of the next chunk's bulk requests.
+
+        Args:
+            label (str): description of the chunk, used for reporting (eg. "partitions 0-9")
+            num_partitions (int): number of partitions in the chunk. Partitions are written in parallel, each one
+                sending its bulk requests one at a time.
+            num_documents (int): number of documents written in this chunk
+            elapsed_seconds (float): how long the chunk took to export
+            num_rejections (int): number of bulk rejections elasticsearch reported during the chunk
+        Returns:
+            dict: the record that was added to self.history
+        """
+
+        num_requests_per_partition = max(1.0, float(num_documents) / max(num_partitions, 1) / self.batch_entries)
+        request_seconds = elapsed_seconds / num_requests_per_partition
+
+        record = {
+            "chunk": label,
+            "batch_entries": self.batch_entries,
+            "batch_bytes": self.batch_bytes,
+            "retry_wait_seconds": self.retry_wait_seconds,
+            "documents": num_documents,
+            "seconds": round(elapsed_seconds, 3),
+            "documents_per_second": round(num_documents / elapsed_seconds, 1) if elapsed_seconds > 0 else None,
+            "estimated_request_seconds": round(request_seconds, 3),
+            "rejections": num_rejections,
+        }
+        self.history.append(record)
+
+        if num_rejections > 0:
+            self.batch_bytes //= 2
+            self.retry_wait_seconds = min(2 * self.retry_wait_seconds, self.max_retry_wait_seconds)
+        elif request_seconds > 1.5 * self.target_request_seconds:
+            self.batch_bytes = int(self.batch_bytes * 0.75)
+        elif request_seconds < 0.5 * self.target_request_seconds:
+            self.batch_bytes = int(self.batch_bytes * 1.25)
+
+        if num_rejections == 0:
+            self.retry_wait_seconds = max(self.initial_retry_wait_seconds, self.retry_wait_seconds // 2)
+
+        self.batch_bytes = max(self.min_batch_bytes, min(self.max_batch_bytes, self.batch_bytes))
+
+        logger.info("%(chunk)s: %(documents)d docs in %(seconds)ss (%(documents_per_second)s docs/s) with "
+                    "%(batch_entries)d docs / %(batch_bytes)d bytes per bulk request, ~%(estimated_request_seconds)ss "
+                    "per request, %(rejections)d rejections" % record)
+
+        return record
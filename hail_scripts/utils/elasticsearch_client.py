@@ -1,5 +1,10 @@
+import concurrent.futures
+import json
 import logging
+import math
+import os
 import re
+import time
 from pprint import pformat
 
 import hail as hl
@@ -12,13 +17,50 @@ from utils.elasticsearch_utils_shared import (
     ELASTICSEARCH_UPSERT,
     ELASTICSEARCH_WRITE_OPERATIONS,
     _encode_field_name,
+    get_new_elasticsearch_fields,
 )
 
-from utils.elasticsearch_utils import elasticsearch_schema_for_table
+from utils.elasticsearch_utils import (
+    CHILD_DOCUMENT_ID_FIELD,
+    convert_table_for_elasticsearch_export,
+    elasticsearch_schema_for_table,
+    get_table_for_contig,
+)
+
+from utils.elasticsearch_batch_sizing import BulkBatchSizer
+from utils.elasticsearch_cluster_monitor import CLUSTER_SLOW_DOWN, DEFAULT_MAX_PAUSE_SECONDS, ClusterHealthMonitor
+from utils.elasticsearch_export_metrics import ElasticsearchExportMetrics
+from utils.elasticsearch_export_progress import ExportProgress
+
+from utils.document_hash import get_expr_for_document_hash
+from utils.sparse_frequencies import POPULATIONS_PRESENT_FIELD
 
 
 logger = logging.getLogger()
 
+# name of the file inside a document hashes directory that points at the most recent hashes table
+LATEST_DOCUMENT_HASHES_FILE = "LATEST"
+
+
+def _get_encoded_field_names(field_names, field_names_replace_dot_with="_"):
+    """Returns a dict that maps each field name that isn't a valid elasticsearch field name to its encoded form"""
+
+    rename_dict = {}
+    for field_name in field_names:
+        encoded_name = field_name
+
+        # optionally replace . with _ in a non-reversible way
+        if field_names_replace_dot_with is not None:
+            encoded_name = encoded_name.replace(".", field_names_replace_dot_with)
+
+        # replace all other special chars with an encoding that's uglier, but reversible
+        encoded_name = _encode_field_name(encoded_name)
+
+        if encoded_name != field_name:
+            rename_dict[field_name] = encoded_name
+
+    return rename_dict
+
 
 class ElasticsearchClient(BaseElasticsearchClient):
     def export_table_to_elasticsearch(
@@ -35,9 +77,32 @@ class ElasticsearchClient(BaseElasticsearchClient):
         field_name_to_elasticsearch_type_map=None,
         disable_doc_values_for_fields=(),
         disable_index_for_fields=(),
+        optimize_mapping=False,
+        mapping_field_hints=None,
+        nested_fields=(),
         field_names_replace_dot_with="_",
         func_to_run_after_index_exists=None,
         export_globals_to_index_meta=True,
+        only_new_mapping_fields=False,
+        num_replicas=0,
+        refresh_interval="1s",
+        force_merge_max_num_segments=1,
+        bulk_load_existing_index=False,
+        prewarm_queries=None,
+        alias_name=None,
+        export_progress_path=None,
+        resume_export=False,
+        partitions_per_chunk=10,
+        max_chunk_retries=2,
+        metrics_report_path=None,
+        prometheus_textfile_path=None,
+        monitor_cluster_health=True,
+        slow_down_seconds=30,
+        max_pause_seconds=DEFAULT_MAX_PAUSE_SECONDS,
+        elasticsearch_mapping_routing=None,
+        child_table=None,
+        child_index_name=None,
+        child_index_type_name="child",
         verbose=True,
     ):
         """Create a new elasticsearch index to store the records in this table, and then export all records to it.
@@ -46,7 +111,11 @@ class ElasticsearchClient(BaseElasticsearchClient):
             table (Table): hail Table
             index_name (string): elasticsearch index name
             index_type_name (string): elasticsearch index type
-            block_size (int): number of records to write in one bulk insert
+            block_size (int): number of records to write in one bulk insert. If None, the table is exported in chunks of
+                partitions_per_chunk partitions, and the bulk size of each chunk is picked by a BulkBatchSizer
+                based on document size, request latency and rejections during the previous chunks. Chunks run one
+                after another, so this caps parallelism at partitions_per_chunk tasks and recomputes the table for
+                each chunk unless it's read from disk.
             num_shards (int): number of shards to use for this index
                 (see https://www.elastic.co/guide/en/elasticsearch/guide/current/overallocation.html)
             delete_index_before_exporting (bool): Whether to drop and re-create the index before exporting.
@@ -77,6 +146,13 @@ class ElasticsearchClient(BaseElasticsearchClient):
             disable_index_for_fields (tuple): (optional) list of field names (the way they will be
                 named in the elasticsearch index) that shouldn't be indexed
                 (see https://www.elastic.co/guide/en/elasticsearch/reference/current/mapping-params.html)
+            optimize_mapping (bool): use compact types inferred from field names - scaled_float for AF fields, float
+                for other doubles, integer for counts, index: false for JSON strings and object instead of nested
+                for arrays of structs (see optimize_elasticsearch_schema)
+            mapping_field_hints (dict): (optional) field path regexps mapped to hints such as "frequency", "count",
+                "half_float", "display" or "object". These take precedence over inferred types.
+            nested_fields (tuple): (optional) arrays of structs that are searched with nested queries and should
+                stay "nested" when optimize_mapping is set
             field_names_replace_dot_with (string): since "." chars in field names are interpreted in
                 special ways by elasticsearch, set this arg to first go through and replace "." with
                 this string in all field names. This replacement is not reversible (or atleast not
@@ -85,10 +161,88 @@ class ElasticsearchClient(BaseElasticsearchClient):
             func_to_run_after_index_exists (function): optional function to run after creating the index, but before exporting any data.
             export_globals_to_index_meta (bool): whether to add table.globals object to the index _meta field:
                 (see https://www.elastic.co/guide/en/elasticsearch/reference/current/mapping-meta-field.html)
+            only_new_mapping_fields (bool): if the index exists, only put the fields that aren't in its mapping yet
+                instead of sending the full schema
+            num_replicas (int): number of replicas to set once the load is done. New indices are loaded without replicas.
+            refresh_interval (str): refresh interval to set once the load is done. Indices are loaded with refresh off.
+                When exporting into an existing index, the index gets back the refresh_interval it had before the load
+                instead, and keeps its replicas.
+            force_merge_max_num_segments (int): after loading into a new index, force-merge each shard down to this
+                many segments. Set to None to skip the force-merge.
+            bulk_load_existing_index (bool): also load an existing index without replicas, then force-merge it and
+                give it back the replicas it had. Only worth it when most of the index is re-written, since the live
+                index has no redundancy during the load and every shard is copied again afterwards.
+            prewarm_queries (list): (optional) query bodies to run against the index before it's exposed through the alias.
+            alias_name (str): (optional) alias to point at this index once it has been merged and pre-warmed.
+            export_progress_path (str): (optional) local file for recording which partitions have been exported. When set,
+                the table is exported in chunks of partitions_per_chunk partitions and each chunk is recorded once it
+                has been written. Requires elasticsearch_mapping_id so that re-exporting a chunk overwrites documents
+                instead of duplicating them. The table should be read from disk so that its partitioning is stable.
+            resume_export (bool): if True, skip the chunks that export_progress_path records as already exported, and
+                don't delete the index even if delete_index_before_exporting is True.
+            partitions_per_chunk (int): number of table partitions to export together when export_progress_path is set,
+                block_size is None or monitor_cluster_health is set
+            max_chunk_retries (int): how many times to re-export a chunk of partitions that failed. Only used when
+                elasticsearch_mapping_id is set, since otherwise a retry would create duplicate documents.
+            metrics_report_path (str): (optional) local path for a json report of export throughput, rejections,
+                retries and per-chunk timings. Sizes and request times are estimated per chunk, not measured per
+                partition or bulk request (see ElasticsearchExportMetrics). The summary is always logged and saved
+                with the index operation metadata.
+            prometheus_textfile_path (str): (optional) local path to also write the metrics to in prometheus text format
+            monitor_cluster_health (bool): sample node stats across the cluster in the background during the export.
+                Before each chunk, the export waits while any node is near the disk high watermark or out of heap, and
+                slows down when heap, write queues, write rejections, disk usage or merges cross softer thresholds.
+                This only acts between chunks, so the table is exported in chunks of partitions_per_chunk partitions
+                while monitoring. Chunks run one after another, so raise partitions_per_chunk for more parallelism.
+            slow_down_seconds (int): how long to wait before the next chunk when the cluster asks to slow down
+            max_pause_seconds (int): fail the export if the cluster stays past a pause threshold for longer than this
+            elasticsearch_mapping_routing (str): if specified, sets es.mapping.routing - the column whose value picks the
+                shard each document is stored on
             child_table (Table): if not None, records in this Table will be exported as children of records in the main Table.
+                They go to a separate index so that parent documents can be updated without re-indexing their children,
+                and are routed by the parent id so all children of a parent are on one shard. The child_table should
+                have a CHILD_DOCUMENT_ID_FIELD column and a column named elasticsearch_mapping_id with the parent's id -
+                see child_table_for_array_field(..). Children are exported before the parent index is finalized, so
+                the alias only points at parents whose children exist. Children that the exported parents had before
+                (eg. transcripts they no longer have) are deleted first.
+            child_index_name (str): index for child_table records. Defaults to "<index_name>_<child_index_type_name>".
+            child_index_type_name (str): elasticsearch index type for child_table records
             verbose (bool): whether to print schema and stats
         """
 
+        start_time = time.time()
+
+        if child_table is not None:
+            if elasticsearch_mapping_id is None:
+                raise ValueError("child_table requires elasticsearch_mapping_id to link children to their parents")
+
+            # the parent export below adjusts some of these based on the existing index and export progress
+            child_export_kwargs = dict(
+                index_name=child_index_name or "%s_%s" % (index_name, child_index_type_name),
+                index_type_name=child_index_type_name,
+                block_size=block_size,
+                num_shards=num_shards,
+                delete_index_before_exporting=delete_index_before_exporting,
+                elasticsearch_write_operation=elasticsearch_write_operation,
+                ignore_elasticsearch_write_errors=ignore_elasticsearch_write_errors,
+                elasticsearch_mapping_id=CHILD_DOCUMENT_ID_FIELD,
+                elasticsearch_mapping_routing=elasticsearch_mapping_id,
+                optimize_mapping=optimize_mapping,
+                mapping_field_hints=mapping_field_hints,
+                num_replicas=num_replicas,
+                refresh_interval=refresh_interval,
+                force_merge_max_num_segments=force_merge_max_num_segments,
+                bulk_load_existing_index=bulk_load_existing_index,
+                export_progress_path=export_progress_path + ".children" if export_progress_path else None,
+                resume_export=resume_export,
+                partitions_per_chunk=partitions_per_chunk,
+                max_chunk_retries=max_chunk_retries,
+                monitor_cluster_health=monitor_cluster_health,
+                slow_down_seconds=slow_down_seconds,
+                max_pause_seconds=max_pause_seconds,
+                verbose=verbose,
+            )
+
         elasticsearch_config = {}
         if (
             elasticsearch_write_operation is not None
@@ -102,6 +256,11 @@ class ElasticsearchClient(BaseElasticsearchClient):
             elasticsearch_config["es.write.operation"] = elasticsearch_write_operation
 
         if elasticsearch_write_operation in (ELASTICSEARCH_UPDATE, ELASTICSEARCH_UPSERT):
+            if POPULATIONS_PRESENT_FIELD in table.row.dtype.fields:
+                raise ValueError(
+                    "Tables with sparse frequencies can't be exported with the %s write operation: it writes nulls "
+                    "explicitly, so absent populations would take up space again" % elasticsearch_write_operation)
+
             # see https://www.elastic.co/guide/en/elasticsearch/hadoop/master/spark.html#spark-sql-write
             # "By default, elasticsearch-hadoop will ignore null values in favor of not writing any field at all.
             # If updating/upserting, then existing field values may need to be overwritten with nulls
@@ -110,26 +269,16 @@ class ElasticsearchClient(BaseElasticsearchClient):
         if elasticsearch_mapping_id is not None:
             elasticsearch_config["es.mapping.id"] = elasticsearch_mapping_id
 
+        if elasticsearch_mapping_routing is not None:
+            elasticsearch_config["es.mapping.routing"] = elasticsearch_mapping_routing
+
         if ignore_elasticsearch_write_errors:
             # see docs in https://www.elastic.co/guide/en/elasticsearch/hadoop/current/errorhandlers.html
             elasticsearch_config["es.write.rest.error.handlers"] = "log"
             elasticsearch_config["es.write.rest.error.handler.log.logger.name"] = "BulkErrors"
 
         # encode any special chars in column names
-        rename_dict = {}
-        for field_name in table.row_value.dtype.fields:
-            encoded_name = field_name
-
-            # optionally replace . with _ in a non-reversible way
-            if field_names_replace_dot_with is not None:
-                encoded_name = encoded_name.replace(".", field_names_replace_dot_with)
-
-            # replace all other special chars with an encoding that's uglier, but reversible
-            encoded_name = _encode_field_name(encoded_name)
-
-            if encoded_name != field_name:
-                rename_dict[field_name] = encoded_name
-
+        rename_dict = _get_encoded_field_names(table.row_value.dtype.fields, field_names_replace_dot_with)
         for original_name, encoded_name in rename_dict.items():
             logger.info("Encoding column name %s to %s", original_name, encoded_name)
 
@@ -143,6 +292,9 @@ class ElasticsearchClient(BaseElasticsearchClient):
             table,
             disable_doc_values_for_fields=disable_doc_values_for_fields,
             disable_index_for_fields=disable_index_for_fields,
+            optimize_mapping=optimize_mapping,
+            mapping_field_hints=mapping_field_hints,
+            nested_fields=nested_fields,
         )
 
         # override elasticsearch types
@@ -159,29 +311,138 @@ class ElasticsearchClient(BaseElasticsearchClient):
 
             elasticsearch_schema = modified_elasticsearch_schema
 
+        # the schema above is generated from the original types, so loci, intervals and dicts are only converted to
+        # their exported form now
+        table = convert_table_for_elasticsearch_export(table)
+
+        batch_sizer = None
+        if block_size is None:
+            batch_sizer = BulkBatchSizer()
+            batch_sizer.set_avg_document_bytes(self._estimate_document_bytes(table))
+
+        progress = None
+        if export_progress_path is not None:
+            if elasticsearch_mapping_id is None:
+                raise ValueError(
+                    "export_progress_path requires elasticsearch_mapping_id, otherwise re-exported chunks would create "
+                    "duplicate documents"
+                )
+
+            progress = ExportProgress(
+                export_progress_path, index_name, table.n_partitions(), partitions_per_chunk, resume=resume_export)
+
+            if progress.completed_chunks:
+                delete_index_before_exporting = False
+        elif batch_sizer is not None or monitor_cluster_health:
+            # bulk sizes are adjusted and cluster health is checked between chunks, but there's no need to record them
+            progress = ExportProgress(None, index_name, table.n_partitions(), partitions_per_chunk)
+
         # optionally delete the index before creating it
         if delete_index_before_exporting and self.es.indices.exists(index=index_name):
             self.es.indices.delete(index=index_name)
 
+        # new indices are created with bulk load settings. Existing ones are usually live, so they only get refresh
+        # turned off during the load, and keep their replicas and segments unless bulk_load_existing_index is set
+        if self.es.indices.exists(index=index_name):
+            previous_settings = self.apply_bulk_load_settings(index_name, drop_replicas=bulk_load_existing_index)
+            refresh_interval = previous_settings["refresh_interval"]
+            if bulk_load_existing_index:
+                num_replicas = previous_settings["number_of_replicas"]
+            else:
+                num_replicas = None
+                force_merge_max_num_segments = None
+
+        # a resumed export finds the index with the bulk load settings of the run that died, so it puts back the
+        # settings recorded by the first run instead
+        if progress is not None:
+            if progress.index_settings is None:
+                progress.set_index_settings({
+                    "refresh_interval": refresh_interval,
+                    "number_of_replicas": num_replicas,
+                    "force_merge_max_num_segments": force_merge_max_num_segments,
+                })
+            else:
+                logger.info("==> restoring %s with the settings recorded in %s: %s",
+                            index_name, export_progress_path, progress.index_settings)
+                refresh_interval = progress.index_settings["refresh_interval"]
+                num_replicas = progress.index_settings["number_of_replicas"]
+                force_merge_max_num_segments = progress.index_settings["force_merge_max_num_segments"]
+
         _meta = None
         if export_globals_to_index_meta:
             _meta = dict(hl.eval(table.globals))
 
         self.create_or_update_mapping(
-            index_name, index_type_name, elasticsearch_schema, num_shards=num_shards, _meta=_meta
+            index_name, index_type_name, elasticsearch_schema, num_shards=num_shards, _meta=_meta,
+            only_new_fields=only_new_mapping_fields,
         )
 
         if func_to_run_after_index_exists:
             func_to_run_after_index_exists()
 
         logger.info(
-            "==> exporting data to elasticsearch. Write mode: %s, blocksize: %d",
+            "==> exporting data to elasticsearch. Write mode: %s, blocksize: %s",
             elasticsearch_write_operation,
             block_size,
         )
 
-        hl.export_elasticsearch(
-            table, self._host, int(self._port), index_name, index_type_name, block_size, elasticsearch_config, verbose
+        metrics = ElasticsearchExportMetrics(
+            index_name,
+            avg_document_bytes=batch_sizer.avg_document_bytes if batch_sizer else None,
+        )
+
+        # re-exporting a chunk that failed part way through is only safe if documents have deterministic ids
+        max_retries = max_chunk_retries if elasticsearch_mapping_id is not None else 0
+
+        monitor = None
+        if monitor_cluster_health:
+            monitor = ClusterHealthMonitor(self.es)
+            monitor.start()
+
+        def wait_for_cluster():
+            if monitor is None:
+                return
+            if monitor.wait_until_healthy(max_pause_seconds=max_pause_seconds) == CLUSTER_SLOW_DOWN:
+                logger.info("Cluster is under pressure, waiting %d seconds: %s", slow_down_seconds, "; ".join(monitor.reasons))
+                if batch_sizer is not None:
+                    batch_sizer.slow_down()
+                time.sleep(slow_down_seconds)
+
+        exported = False
+        try:
+            self._export_chunks(
+                table, index_name, index_type_name, block_size, elasticsearch_config, progress, batch_sizer, metrics,
+                max_retries, wait_for_cluster, verbose,
+            )
+            exported = True
+        finally:
+            if monitor is not None:
+                monitor.stop()
+
+            # after a successful load, finalize_bulk_load(..) restores the settings once the index is force-merged.
+            # A failed load mustn't leave the index without replicas and refreshes.
+            if not exported:
+                self.restore_index_settings(index_name, refresh_interval=refresh_interval, num_replicas=num_replicas)
+
+        metrics.finish()
+        summary = metrics.summary(include_chunks=False)
+        logger.info("==> export metrics:\n" + pformat(summary))
+        if metrics_report_path:
+            metrics.write_json_report(metrics_report_path)
+        if prometheus_textfile_path:
+            metrics.write_prometheus_textfile(prometheus_textfile_path)
+
+        self.record_index_operation(
+            "export_table",
+            index_name,
+            start_time=start_time,
+            metrics=json.dumps(summary),
+            index_type_name=index_type_name,
+            block_size=block_size,
+            num_shards=num_shards,
+            elasticsearch_write_operation=elasticsearch_write_operation,
+            elasticsearch_mapping_id=elasticsearch_mapping_id,
+            export_progress_path=export_progress_path,
         )
 
         """
@@ -196,4 +457,407 @@ class ElasticsearchClient(BaseElasticsearchClient):
         es.batch.write.refresh // default true  (Whether to invoke an index refresh or not after a bulk update has been completed)
         """
 
-        self.es.indices.forcemerge(index=index_name)
+        if child_table is not None:
+            try:
+                self._export_child_table(table, elasticsearch_mapping_id, child_table, child_export_kwargs)
+            except Exception:
+                self.restore_index_settings(index_name, refresh_interval=refresh_interval, num_replicas=num_replicas)
+                raise
+
+        self.finalize_bulk_load(
+            index_name,
+            refresh_interval=refresh_interval,
+            num_replicas=num_replicas,
+            force_merge_max_num_segments=force_merge_max_num_segments,
+            prewarm_queries=prewarm_queries,
+            alias_name=alias_name,
+        )
+
+    def _export_child_table(self, table, parent_id_field, child_table, child_export_kwargs):
+        """Exports the children of the rows in table, replacing the children those parents had before.
+
+        Re-exported children overwrite the documents with the same id, but children that a parent no longer has would
+        be left behind, so all children of the exported parents are deleted first. That's skipped when the child index
+        is re-created anyway, or when resuming a child export that already started (the earlier run deleted them).
+        """
+
+        child_index_name = child_export_kwargs["index_name"]
+        child_progress_path = child_export_kwargs["export_progress_path"]
+        resuming = child_export_kwargs["resume_export"] and child_progress_path and os.path.isfile(child_progress_path)
+        if (
+            not child_export_kwargs["delete_index_before_exporting"]
+            and not resuming
+            and self.es.indices.exists(index=child_index_name)
+        ):
+            parent_ids = table.aggregate(hl.agg.collect_as_set(table[parent_id_field]))
+            logger.info("==> deleting the previous children of %d parents from %s", len(parent_ids), child_index_name)
+            self.delete_documents_by_field(child_index_name, parent_id_field, parent_ids)
+
+        logger.info("==> exporting child records to %s", child_index_name)
+        self.export_table_to_elasticsearch(child_table, **child_export_kwargs)
+
+    def _export_chunks(
+        self, table, index_name, index_type_name, block_size, elasticsearch_config, progress, batch_sizer, metrics,
+        max_retries, wait_for_cluster, verbose,
+    ):
+        """Exports the table in one go, or chunk by chunk if there's a progress tracker."""
+
+        if progress is None:
+            wait_for_cluster()
+            self._export_chunk(
+                table, "all partitions", table.n_partitions(), index_name, index_type_name, block_size,
+                elasticsearch_config, metrics, max_retries, verbose,
+            )
+            return
+
+        for chunk_index in progress.remaining_chunks():
+            partitions = progress.chunk_partitions(chunk_index)
+            logger.info(
+                "==> exporting chunk %d of %d (partitions %d to %d)",
+                chunk_index + 1, progress.num_chunks, partitions[0], partitions[-1],
+            )
+
+            wait_for_cluster()
+
+            chunk_block_size = block_size
+            chunk_elasticsearch_config = dict(elasticsearch_config)
+            if batch_sizer is not None:
+                chunk_block_size = batch_sizer.batch_entries
+                chunk_elasticsearch_config.update(batch_sizer.elasticsearch_config())
+
+            record = self._export_chunk(
+                table._filter_partitions(partitions), "partitions %d-%d" % (partitions[0], partitions[-1]),
+                len(partitions), index_name, index_type_name, chunk_block_size, chunk_elasticsearch_config,
+                metrics, max_retries, verbose,
+            )
+
+            if batch_sizer is not None:
+                batch_sizer.update(
+                    record["chunk"],
+                    num_partitions=len(partitions),
+                    num_documents=record["documents"],
+                    elapsed_seconds=record["seconds"],
+                    num_rejections=record["rejections"],
+                )
+
+            progress.mark_done(chunk_index)
+
+        if batch_sizer is not None:
+            logger.info("==> bulk sizes used per chunk:\n" + pformat(batch_sizer.history))
+
+    def _export_chunk(
+        self, table, label, num_partitions, index_name, index_type_name, block_size, elasticsearch_config, metrics,
+        max_retries, verbose,
+    ):
+        """Exports one chunk of partitions, retrying it up to max_retries times, and records its metrics."""
+
+        index_operations_before = self.get_index_operation_count(index_name)
+        rejections_before = self.get_write_rejection_count()
+        start_time = time.time()
+
+        for attempt in range(max_retries + 1):
+            try:
+                hl.export_elasticsearch(
+                    table, self._host, int(self._port), index_name, index_type_name, block_size,
+                    elasticsearch_config, verbose
+                )
+                break
+            except Exception as e:
+                if attempt == max_retries:
+                    raise
+                logger.warning("%s: export failed, retrying (attempt %d of %d): %s", label, attempt + 1, max_retries, e)
+
+        return metrics.record_chunk(
+            label,
+            num_partitions=num_partitions,
+            num_documents=self.get_index_operation_count(index_name) - index_operations_before,
+            elapsed_seconds=time.time() - start_time,
+            block_size=block_size,
+            num_rejections=self.get_write_rejection_count() - rejections_before,
+            num_retries=attempt,
+        )
+
+    def _estimate_document_bytes(self, table: hl.Table, sample_size: int = 1000) -> float:
+        """Estimates the average size of an exported document from the JSON encoding of the table's first rows"""
+
+        sample = table.head(sample_size)
+        avg_document_bytes = sample.aggregate(hl.agg.mean(hl.len(hl.json(sample.row))))
+        if avg_document_bytes is None or math.isnan(avg_document_bytes):
+            return 1000
+
+        return avg_document_bytes
+
+    def export_table_to_elasticsearch_incremental(
+        self,
+        table: hl.Table,
+        document_hashes_path: str,
+        index_name: str = "data",
+        index_type_name: str = "variant",
+        id_field: str = "variant_id",
+        delete_block_size: int = 1000,
+        ignore_previous_hashes: bool = False,
+        **export_kwargs,
+    ):
+        """Export only the records that were added, changed or removed since the last export to this index.
+
+        A content hash of every exported document is kept in a hail table under document_hashes_path (typically
+        next to the table that was exported). On the next export, the new table's hashes are compared to it:
+        new and changed documents are upserted by id, and documents that are no longer in the table are deleted.
+        Tables with sparse frequencies (see prepare_ht_for_es.sparsify_freq_fields(..)) replace changed documents
+        as a whole instead of upserting them, so fields that were added to them by other exports are dropped.
+        If there are no previous hashes, or ignore_previous_hashes is set, the whole table is exported into a fresh
+        index.
+
+        Args:
+            table (Table): hail Table, prepared for export
+            document_hashes_path (str): directory where document hashes from previous exports are stored
+            index_name (string): elasticsearch index name
+            index_type_name (string): elasticsearch index type
+            id_field (str): table field to use as the document id - for example "variant_id", or "transcript_id" for
+                constraint and GTEx tables. Must be unique.
+            delete_block_size (int): number of deletes to send in one bulk request. The ids of deleted documents are
+                written next to the new hashes and streamed from there.
+            ignore_previous_hashes (bool): re-create the index from the whole table even if there are previous
+                hashes, eg. because the index was deleted or wasn't exported with these hashes
+            export_kwargs: any other args are passed on to export_table_to_elasticsearch(..)
+        """
+
+        if export_kwargs.get("child_table") is not None:
+            # document hashes only cover the parent rows, so changes to child records wouldn't be detected
+            raise ValueError("child_table isn't supported by incremental exports")
+
+        table = table.key_by(id_field)
+
+        # documents with the same id would overwrite each other, and the diff against their hashes would upsert and
+        # delete them again on every export
+        num_documents = table.count()
+        num_ids = table.select().distinct().count()
+        if num_ids != num_documents:
+            raise ValueError("%s isn't unique: %d rows have %d distinct ids" % (id_field, num_documents, num_ids))
+
+        new_hashes = table.select(_document_hash=get_expr_for_document_hash(table.row))
+
+        latest_file_path = "%s/%s" % (document_hashes_path, LATEST_DOCUMENT_HASHES_FILE)
+        new_hashes_path = "%s/%s.ht" % (document_hashes_path, time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime()))
+        new_hashes = new_hashes.checkpoint(new_hashes_path)
+
+        if hl.hadoop_exists(latest_file_path) and not ignore_previous_hashes:
+            with hl.hadoop_open(latest_file_path) as f:
+                previous_hashes_path = f.read().strip()
+
+            previous_hashes = hl.read_table(previous_hashes_path)
+            previous_hashes = previous_hashes.rename({"_document_hash": "_previous_document_hash"})
+
+            diff = new_hashes.join(previous_hashes, how="outer")
+            is_inserted = hl.is_missing(diff._previous_document_hash)
+            is_deleted = hl.is_missing(diff._document_hash)
+            is_changed = ~is_inserted & ~is_deleted & (diff._document_hash != diff._previous_document_hash)
+
+            counts = diff.aggregate(hl.struct(
+                inserted=hl.agg.count_where(is_inserted),
+                changed=hl.agg.count_where(is_changed),
+                deleted=hl.agg.count_where(is_deleted),
+            ))
+            logger.info(
+                "==> %s: %d inserted, %d changed, %d deleted documents since %s",
+                index_name, counts.inserted, counts.changed, counts.deleted, previous_hashes_path,
+            )
+
+            # a handful of updated documents isn't worth force-merging the whole index for
+            export_kwargs.setdefault("force_merge_max_num_segments", None)
+
+            # upserts write nulls to clear fields that became missing, which would undo the sparse frequency
+            # encoding. Sparse documents are replaced as a whole instead.
+            write_operation = ELASTICSEARCH_UPSERT
+            if POPULATIONS_PRESENT_FIELD in table.row.dtype.fields:
+                write_operation = ELASTICSEARCH_INDEX
+
+            if counts.inserted or counts.changed:
+                self.export_table_to_elasticsearch(
+                    table.semi_join(diff.filter(is_inserted | is_changed)),
+                    index_name=index_name,
+                    index_type_name=index_type_name,
+                    delete_index_before_exporting=False,
+                    elasticsearch_write_operation=write_operation,
+                    elasticsearch_mapping_id=id_field,
+                    **export_kwargs,
+                )
+
+            if counts.deleted:
+                # a re-release can delete millions of documents, so their ids are streamed from a file instead of
+                # being collected on the driver
+                deleted = diff.filter(is_deleted).key_by()
+                deleted_ids_path = new_hashes_path[:-len(".ht")] + "_deleted_ids.tsv"
+                deleted.select(id_field).export(deleted_ids_path, header=False)
+                with hl.hadoop_open(deleted_ids_path) as f:
+                    self.delete_documents(
+                        index_name, index_type_name, (line.rstrip("\n") for line in f), chunk_size=delete_block_size)
+        else:
+            logger.info("==> no document hashes found in %s. Exporting all documents", document_hashes_path)
+            self.export_table_to_elasticsearch(
+                table,
+                index_name=index_name,
+                index_type_name=index_type_name,
+                delete_index_before_exporting=True,
+                elasticsearch_mapping_id=id_field,
+                **export_kwargs,
+            )
+
+        # only move the pointer once the export succeeded, so a failed export is retried against the old hashes
+        with hl.hadoop_open(latest_file_path, "w") as f:
+            f.write(new_hashes_path)
+
+    def export_new_columns_to_elasticsearch(
+        self,
+        table,
+        index_name,
+        index_type_name="variant",
+        id_field="variant_id",
+        columns=None,
+        field_names_replace_dot_with="_",
+        **export_kwargs
+    ):
+        """Adds columns to the documents of an existing index without re-exporting the columns it already has.
+
+        The table schema is diffed against the live mapping, only the new fields are added with put_mapping, and then
+        just the id and the new columns are sent as partial updates (ELASTICSEARCH_UPDATE) keyed by document id.
+
+        Args:
+            table (Table): hail Table with the same documents as the index, plus the new columns
+            index_name (str): existing elasticsearch index
+            index_type_name (str): elasticsearch index type
+            id_field (str): table field that holds the document id the index was exported with
+            columns (list): (optional) columns to export. Defaults to all top-level columns with fields that aren't
+                in the mapping yet. Listing a column that's already mapped re-exports its values.
+            field_names_replace_dot_with (str): must match the value used when the index was exported
+            export_kwargs: any other args are passed on to export_table_to_elasticsearch(..) - for example
+                ignore_elasticsearch_write_errors=True to skip rows that have no document in the index
+        Returns:
+            list: the exported columns
+        """
+
+        if not self.es.indices.exists(index=index_name):
+            raise ValueError("%s doesn't exist. Use export_table_to_elasticsearch(..) to create it." % index_name)
+
+        table = table.key_by()
+        rename_dict = _get_encoded_field_names(table.row_value.dtype.fields, field_names_replace_dot_with)
+
+        if columns is None:
+            new_properties = get_new_elasticsearch_fields(
+                self.get_index_properties(index_name, index_type_name),
+                elasticsearch_schema_for_table(table.rename(rename_dict)),
+            )
+            columns = [
+                field_name for field_name in table.row_value.dtype.fields
+                if rename_dict.get(field_name, field_name) in new_properties
+            ]
+
+        columns = [c for c in columns if c != id_field]
+        if not columns:
+            logger.info("==> %s already has all columns in the table", index_name)
+            return []
+
+        logger.info("==> exporting columns %s to %s", ", ".join(columns), index_name)
+
+        # a force merge after updating a fraction of each document's fields rewrites the whole index
+        export_kwargs.setdefault("force_merge_max_num_segments", None)
+        self.export_table_to_elasticsearch(
+            table.select(id_field, *columns),
+            index_name=index_name,
+            index_type_name=index_type_name,
+            delete_index_before_exporting=False,
+            elasticsearch_write_operation=ELASTICSEARCH_UPDATE,
+            elasticsearch_mapping_id=id_field,
+            field_names_replace_dot_with=field_names_replace_dot_with,
+            export_globals_to_index_meta=False,
+            only_new_mapping_fields=True,
+            **export_kwargs
+        )
+
+        return columns
+
+    def export_table_to_elasticsearch_by_contig(
+        self,
+        table,
+        alias_name,
+        index_type_name="variant",
+        contig_field="chrom",
+        contigs=None,
+        max_workers=4,
+        checkpoint_path=None,
+        **export_kwargs
+    ):
+        """Exports each contig into its own index ("<alias_name>__<contig>") and points alias_name at all of them.
+
+        Contigs are loaded concurrently, which spreads indexing across more shards and data nodes than a single index,
+        and a single contig can be rebuilt without touching the others. Every index records the contig -> index map
+        under "contig_indices" in its _meta, so region queries can go straight to one index.
+
+        Args:
+            table (Table): hail Table, prepared for export
+            alias_name (str): alias to put in front of the per-contig indices
+            index_type_name (str): elasticsearch index type
+            contig_field (str): field with the contig name. If the table is keyed by locus, the locus contig is used
+                instead. Otherwise the table is keyed by contig_field and checkpointed once, so that each contig is
+                read with filter_intervals rather than a full scan of the table.
+            contigs (list): (optional) only (re-)export these contigs. Indices for other contigs already behind the
+                alias are kept.
+            max_workers (int): max number of contigs to export at the same time
+            checkpoint_path (str): where to checkpoint the table keyed by contig_field if it isn't keyed by locus.
+                Defaults to a hail temp file.
+            export_kwargs: any other args are passed on to export_table_to_elasticsearch(..). Progress and metrics
+                paths get a ".<contig>" suffix.
+        Returns:
+            dict: contig -> index name for all indices behind the alias
+        """
+
+        if export_kwargs.get("child_table") is not None:
+            # the child table isn't split by contig, so each contig would export all of it
+            raise ValueError("child_table isn't supported by per-contig exports")
+
+        if len(table.key) > 0 and isinstance(table.key[0].dtype, hl.tlocus):
+            contig_expr = table.key[0].contig
+        else:
+            checkpoint_path = checkpoint_path or hl.utils.new_temp_file(prefix="export_by_contig", suffix="ht")
+            logger.info("==> keying the table by %s and checkpointing it to %s", contig_field, checkpoint_path)
+            table = table.key_by(contig_field).checkpoint(checkpoint_path, overwrite=True)
+            contig_expr = table[contig_field]
+
+        if contigs is None:
+            contigs = sorted(table.aggregate(hl.agg.collect_as_set(contig_expr)))
+
+        contig_indices = {}
+        if self.es.indices.exists_alias(name=alias_name):
+            existing_index_name = list(self.es.indices.get_alias(name=alias_name).keys())[0]
+            contig_indices.update(self.get_index_meta(existing_index_name).get("contig_indices", {}))
+
+        def export_contig(contig):
+            contig_table = get_table_for_contig(table, contig)
+
+            contig_export_kwargs = dict(export_kwargs)
+            for path_arg in ("export_progress_path", "metrics_report_path", "prometheus_textfile_path"):
+                if contig_export_kwargs.get(path_arg):
+                    contig_export_kwargs[path_arg] = "%s.%s" % (contig_export_kwargs[path_arg], contig)
+
+            index_name = ("%s__%s" % (alias_name, contig)).lower()
+            logger.info("==> exporting contig %s to %s", contig, index_name)
+            self.export_table_to_elasticsearch(
+                contig_table, index_name=index_name, index_type_name=index_type_name, alias_name=None,
+                **contig_export_kwargs)
+
+            return index_name
+
+        # spark schedules jobs submitted from different threads concurrently
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(export_contig, contig): contig for contig in contigs}
+            for future in concurrent.futures.as_completed(futures):
+                contig_indices[futures[future]] = future.result()
+
+        for index_name in contig_indices.values():
+            _meta = self.get_index_meta(index_name)
+            _meta["contig_indices"] = contig_indices
+            self.set_index_meta(index_name, index_type_name, _meta)
+
+        self.update_index_alias(alias_name, sorted(set(contig_indices.values())))
+
+        return contig_indices
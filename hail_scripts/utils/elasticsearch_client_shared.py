@@ -1,10 +1,16 @@
-import datetime
 import inspect
 import logging
+import threading
 import time
 from pprint import pformat
 
 import elasticsearch
+import elasticsearch.connection_pool
+import elasticsearch.helpers
+
+from utils.elasticsearch_snapshots import SnapshotManager
+from utils.elasticsearch_utils_shared import get_new_elasticsearch_fields
+from utils.index_operations_journal import DEFAULT_JOURNAL_PATH, get_index_operations_journal
 '''
 try:
     import elasticsearch
@@ -18,24 +24,90 @@ handlers = set(logging.root.handlers)
 logging.root.handlers = list(handlers)
 logger = logging.getLogger()
 
+# forcemerge, health and pre-warm requests can legitimately take much longer than the default 10s client timeout
+LONG_RUNNING_REQUEST_TIMEOUT = 60*60
+
+
+# one connection pool per cluster configuration, shared by all ElasticsearchClient instances in this process
+_CONNECTION_POOLS = {}
+_CONNECTION_POOLS_LOCK = threading.Lock()
+
+
+def _parse_hosts(host):
+    """Accepts a host name, a comma-separated string of host names, or a list of host names"""
+
+    if isinstance(host, str):
+        host = host.split(",")
+
+    return tuple(h.strip() for h in host if h.strip())
+
+
+def get_elasticsearch_connection(hosts, port=9200, sniff=False, maxsize=25, timeout=30, retry_on_timeout=True):
+    """Returns the pooled elasticsearch.Elasticsearch for this cluster configuration, creating it on first use.
+
+    Requests are spread round-robin over all known nodes, and each node keeps up to maxsize keep-alive connections.
+
+    Args:
+        hosts (tuple): one or more node host names or IPs
+        port (int): Elasticsearch port
+        sniff (bool): whether to discover the other nodes of the cluster on startup and after a connection fails
+        maxsize (int): max number of open connections per node
+        timeout (int): default request timeout in seconds
+        retry_on_timeout (bool): whether to re-send requests that time out to another node
+    Returns:
+        elasticsearch.Elasticsearch: the shared client
+    """
+
+    key = (tuple(hosts), int(port), sniff, maxsize, timeout, retry_on_timeout)
+    with _CONNECTION_POOLS_LOCK:
+        if key not in _CONNECTION_POOLS:
+            es = elasticsearch.Elasticsearch(
+                [{"host": host, "port": int(port)} for host in hosts],
+                selector_class=elasticsearch.connection_pool.RoundRobinSelector,
+                sniff_on_start=sniff,
+                sniff_on_connection_fail=sniff,
+                sniffer_timeout=60 if sniff else None,
+                maxsize=maxsize,
+                timeout=timeout,
+                retry_on_timeout=retry_on_timeout,
+                headers={"Connection": "keep-alive"},
+            )
+
+            # check connection
+            logger.info(pformat(es.info()))
+
+            _CONNECTION_POOLS[key] = es
+
+        return _CONNECTION_POOLS[key]
+
 
 class ElasticsearchClient:
 
-    def __init__(self, host="localhost", port="9200"):
+    def __init__(self, host="localhost", port="9200", sniff=False, maxsize=25, timeout=30, journal_path=None):
         """Constructor.
 
+        Clients with the same settings share one connection pool, so creating them is cheap.
+
         Args:
-            host (str): Elasticsearch server host
+            host (str): Elasticsearch server host, or a comma-separated string or list of hosts to round-robin over
             port (str): Elasticsearch server port
+            sniff (bool): whether to discover and use the other nodes in the cluster
+            maxsize (int): max number of open connections per node
+            timeout (int): default request timeout in seconds
+            journal_path (str): local index operations journal. Defaults to $INDEX_OPERATIONS_JOURNAL or
+                ~/.index_operations_journal.jsonl
         """
 
-        self._host = host
+        self._hosts = _parse_hosts(host)
+        self._host = ",".join(self._hosts)  # es-hadoop accepts a comma-separated list of nodes
         self._port = port
 
-        self.es = elasticsearch.Elasticsearch(host, port=port)
+        self._connection_settings = {"sniff": sniff, "maxsize": maxsize, "timeout": timeout}
 
-        # check connection
-        logger.info(pformat(self.es.info()))
+        self.es = get_elasticsearch_connection(self._hosts, port=port, **self._connection_settings)
+        self.journal = get_index_operations_journal(journal_path or DEFAULT_JOURNAL_PATH)
+        self.journal.flush_at_exit(self.es)
+        self.snapshot_manager = SnapshotManager(self.es, journal=self.journal)
 
     def print_elasticsearch_stats(self):
         """Prints elastic search index stats."""
@@ -43,32 +115,33 @@ class ElasticsearchClient:
         logger.info("==> elasticsearch stats:")
 
         node_stats = self.es.nodes.stats(level="node")
-        node_id = node_stats["nodes"].keys()[0]
 
         logger.info("\n" + str(self.es.cat.indices(
             v=True,
             s="creation.date",
             h="creation.date.string,health,index,pri,docs.count,store.size")))
 
-        logger.info("Indices: %s total docs" % node_stats["nodes"][node_id]["indices"]["docs"]["count"])
-        logger.info("Free Memory: %0.1f%% (%d Gb out of %d Gb)" % (
-            node_stats["nodes"][node_id]["os"]["mem"]["free_percent"],
-            node_stats["nodes"][node_id]["os"]["mem"]["free_in_bytes"]/10**9,
-            node_stats["nodes"][node_id]["os"]["mem"]["total_in_bytes"]/10**9,
-        ))
-        logger.info("Free Disk Space: %0.1f%% (%d Gb out of %d Gb)" % (
-            (100*node_stats["nodes"][node_id]["fs"]["total"]["free_in_bytes"]/node_stats["nodes"][node_id]["fs"]["total"]["total_in_bytes"]),
-            node_stats["nodes"][node_id]["fs"]["total"]["free_in_bytes"]/10**9,
-            node_stats["nodes"][node_id]["fs"]["total"]["total_in_bytes"]/10**9,
-        ))
-
-        logger.info("CPU load: %s" % str(node_stats["nodes"][node_id]["os"]["cpu"]["load_average"]))
-        logger.info("Swap: %s (bytes used)" % str(node_stats["nodes"][node_id]["os"]["swap"]["used_in_bytes"]))
-        logger.info("Disk type: " + ("Regular" if node_stats["nodes"][node_id]["fs"]["total"].get("spins") else "SSD"))
+        for node_id, node in node_stats["nodes"].items():
+            logger.info("==> node %s (%s)" % (node.get("name", node_id), node_id))
+            logger.info("Indices: %s total docs" % node["indices"]["docs"]["count"])
+            logger.info("Free Memory: %0.1f%% (%d Gb out of %d Gb)" % (
+                node["os"]["mem"]["free_percent"],
+                node["os"]["mem"]["free_in_bytes"]/10**9,
+                node["os"]["mem"]["total_in_bytes"]/10**9,
+            ))
+            logger.info("Free Disk Space: %0.1f%% (%d Gb out of %d Gb)" % (
+                (100*node["fs"]["total"]["free_in_bytes"]/node["fs"]["total"]["total_in_bytes"]),
+                node["fs"]["total"]["free_in_bytes"]/10**9,
+                node["fs"]["total"]["total_in_bytes"]/10**9,
+            ))
+
+            logger.info("CPU load: %s" % str(node["os"]["cpu"]["load_average"]))
+            logger.info("Swap: %s (bytes used)" % str(node["os"]["swap"]["used_in_bytes"]))
+            logger.info("Disk type: " + ("Regular" if node["fs"]["total"].get("spins") else "SSD"))
 
         # other potentially interesting fields:
         """
-        logger.info("Current HTTP Connections: %s open" % node_stats["nodes"][node_id]["http"]["current_open"])
+        logger.info("Current HTTP Connections: %s open" % node["http"]["current_open"])
         [
             u'thread_pool',
             u'transport_address',
@@ -98,6 +171,7 @@ class ElasticsearchClient:
         elasticsearch_schema={},
         num_shards=1,
         _meta=None,
+        only_new_fields=False,
     ):
         """Calls es.indices.create or es.indices.put_mapping to create or update an elasticsearch index mapping.
 
@@ -108,8 +182,17 @@ class ElasticsearchClient:
             num_shards (int): how many shards the index will contain
             _meta (dict): optional _meta info for this index
                 (see https://www.elastic.co/guide/en/elasticsearch/reference/current/mapping-meta-field.html)
+            only_new_fields (bool): when the index already exists, diff the schema against the live mapping and only
+                put the fields that aren't mapped yet
         """
 
+        if only_new_fields and self.es.indices.exists(index=index_name):
+            elasticsearch_schema = get_new_elasticsearch_fields(
+                self.get_index_properties(index_name, index_type_name), elasticsearch_schema)
+            if not elasticsearch_schema and not _meta:
+                logger.info("==> %s/%s mapping already has all fields" % (index_name, index_type_name))
+                return
+
         index_mapping = {
             #"_size": {"enabled": "true" },   <--- needs mapper-size plugin to be installed in elasticsearch
             "_all": {"enabled": "false"},
@@ -156,135 +239,386 @@ class ElasticsearchClient:
             #logger.info("==> New elasticsearch %s schema: %s" % (index_name, pformat(new_mapping)))
 
 
-    def create_elasticsearch_snapshot(self, index_name, bucket, base_path, snapshot_repo):
-        """Creates an elasticsearch snapshot in the given GCS bucket repository.
+    def get_index_properties(self, index_name, index_type_name):
+        """Returns the "properties" of the live mapping of the given index and type"""
 
-        NOTE: Elasticsearch must have the GCP snapshot plugin installed - see:
-        https://www.elastic.co/guide/en/elasticsearch/plugins/master/repository-gcs.html
+        mappings = self.es.indices.get_mapping(index=index_name, doc_type=index_type_name)
+        return mappings[index_name]["mappings"].get(index_type_name, {}).get("properties", {})
+
+    def apply_bulk_load_settings(self, index_name, drop_replicas=False):
+        """Turns off refresh on an existing index so a bulk load doesn't pay for it.
+
+        Indices created by create_or_update_mapping already start out with refresh and replicas off. Replicas of an
+        existing index are only dropped when asked to, since that leaves a live index without redundancy and has to
+        copy every shard again once they're restored.
 
         Args:
-            index_name (str): snapshot will be created for this index
-            bucket (str): GCS bucket name (eg. "my-datasets")
-            base_path (str): sub-directory inside the bucket where snapshots are stored
-            snapshot_repo (str): the snapshot repository name
+            index_name (str): elasticsearch index name
+            drop_replicas (bool): whether to also set number_of_replicas to 0 for the load
+        Returns:
+            dict: the index's refresh_interval and number_of_replicas before they were changed, so they can
+                be passed back to restore_index_settings(..) after the load.
+        """
+
+        settings = self.es.indices.get_settings(index=index_name)[index_name]["settings"]["index"]
+        previous_settings = {
+            "refresh_interval": settings.get("refresh_interval", "1s"),
+            "number_of_replicas": int(settings.get("number_of_replicas", 0)),
+        }
+
+        bulk_load_settings = {"index.refresh_interval": -1}
+        if drop_replicas:
+            bulk_load_settings["index.number_of_replicas"] = 0
 
+        logger.info("==> applying bulk load settings %s to %s (previous settings: %s)" % (
+            bulk_load_settings, index_name, previous_settings))
+        self.es.indices.put_settings(index=index_name, body=bulk_load_settings)
+
+        return previous_settings
+
+    def restore_index_settings(self, index_name, refresh_interval="1s", num_replicas=0, wait_for_status=None):
+        """Restores query-time refresh and replica settings after a bulk load.
+
+        Args:
+            index_name (str): elasticsearch index name
+            refresh_interval (str): refresh interval to restore (eg. "1s"). None leaves it unchanged.
+            num_replicas (int): number of replicas to restore. None leaves it unchanged.
+            wait_for_status (str): optionally wait until the index reaches this health ("yellow" or "green"),
+                which is when new replicas have finished copying the primaries.
         """
 
-        logger.info("==> check if snapshot repo already exists: %s" % snapshot_repo)
-        try:
-            repo_info = self.es.snapshot.get_repository(repository=snapshot_repo)
-            logger.info(pformat(repo_info))
-        except elasticsearch.exceptions.NotFoundError:
-            # register repository
-            self.create_elasticsearch_snapshot_repository(bucket, base_path, snapshot_repo)
-
-        # check that index exists
-        matching_indices = self.es.indices.get(index=index_name).keys()
-        if not matching_indices:
-            all_indices = self.es.indices.get(index="*").keys()
-            raise ValueError("%s index not found. Existing indices are: %s" % (index_name, all_indices))
-
-        # see https://www.elastic.co/guide/en/elasticsearch/reference/current/modules-snapshots.html
-        snapshot_name = "snapshot_%s__%s" % (index_name.replace("*", "").lower(), time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime()))
-
-        logger.info("==> creating snapshot in gs://%s/%s/%s" % (bucket, base_path, index_name))
-        other_snapshots_running = True
-        while other_snapshots_running:
+        settings = {}
+        if refresh_interval is not None:
+            settings["index.refresh_interval"] = refresh_interval
+        if num_replicas is not None:
+            settings["index.number_of_replicas"] = num_replicas
+
+        if settings:
+            logger.info("==> restoring settings on %s: %s" % (index_name, settings))
+            self.es.indices.put_settings(index=index_name, body=settings)
+
+        if wait_for_status:
+            logger.info("==> waiting for %s to become %s" % (index_name, wait_for_status))
+            self.es.cluster.health(
+                index=index_name, wait_for_status=wait_for_status, request_timeout=LONG_RUNNING_REQUEST_TIMEOUT)
+
+    def get_index_segment_count(self, index_name):
+        """Returns the number of lucene segments across all primary shards of the given index."""
+
+        stats = self.es.indices.stats(index=index_name, metric="segments")
+        return stats["indices"][index_name]["primaries"]["segments"]["count"]
+
+    def _is_force_merge_running(self, index_name):
+        tasks = self.es.tasks.list(actions="indices:admin/forcemerge*", detailed=True)
+        for node in tasks.get("nodes", {}).values():
+            for task in node.get("tasks", {}).values():
+                if index_name in task.get("description", ""):
+                    return True
+
+        return False
+
+    def force_merge_index(self, index_name, max_num_segments=1, poll_interval=30):
+        """Force-merges an index down to max_num_segments per shard without blocking on a single http request.
+
+        The forcemerge request is sent from a background thread, and this method polls the index's segment
+        count and the cluster's task list, logging progress until the merge finishes. If the http request times out,
+        the merge keeps running on the server and polling continues until the task is gone.
+
+        Args:
+            index_name (str): elasticsearch index name
+            max_num_segments (int): target number of segments per shard
+            poll_interval (int): seconds between progress checks
+        """
+
+        num_shards = int(
+            self.es.indices.get_settings(index=index_name)[index_name]["settings"]["index"]["number_of_shards"])
+        target_segment_count = max_num_segments * num_shards
+        initial_segment_count = self.get_index_segment_count(index_name)
+
+        logger.info("==> force-merging %s from %d to %d segments" % (
+            index_name, initial_segment_count, target_segment_count))
+
+        # a forcemerge that times out is still running on the server, so it's sent over a connection that doesn't
+        # retry on timeout. Otherwise the client would start the same merge again on another node.
+        es = get_elasticsearch_connection(self._hosts, port=self._port, retry_on_timeout=False, **self._connection_settings)
+
+        errors = []
+
+        def run_force_merge():
             try:
-                logger.info(pformat(
-                    self.es.snapshot.create(
-                        repository=snapshot_repo,
-                        snapshot=snapshot_name,
-                        wait_for_completion=False,  # setting this to True wasn't working as expected
-                        body={
-                            "indices": index_name
-                        })
-                ))
-            except elasticsearch.exceptions.TransportError as e:
-                if "concurrent_snapshot_execution_exception" in str(e):
-                    logger.info("Wait for other snapshots to complete: " + pformat(
-                        self.es.snapshot.status(repository=snapshot_repo)
-                    ))
-                    time.sleep(3)
-                    continue
-
-            other_snapshots_running = False
-
-        logger.info("==> getting snapshot status for: " + snapshot_name)
-        logger.info(pformat(
-            self.es.snapshot.status(repository=snapshot_repo)
-        ))
-
-    def restore_elasticsearch_snapshot(self, bucket, base_path, snapshot_repo):
-        """Restores an Elasticsearch snapshot from the given GCS bucket repository.
+                es.indices.forcemerge(
+                    index=index_name, max_num_segments=max_num_segments, request_timeout=LONG_RUNNING_REQUEST_TIMEOUT)
+            except elasticsearch.exceptions.ConnectionTimeout:
+                logger.info("forcemerge request timed out - the merge is still running on the server")
+            except Exception as e:
+                errors.append(e)
+
+        merge_thread = threading.Thread(target=run_force_merge, name="forcemerge-%s" % index_name, daemon=True)
+        merge_thread.start()
+
+        start_time = time.time()
+        while True:
+            merge_thread.join(timeout=poll_interval)
+            if errors:
+                raise errors[0]
+
+            segment_count = self.get_index_segment_count(index_name)
+            merged = initial_segment_count - segment_count
+            to_merge = max(initial_segment_count - target_segment_count, 1)
+            logger.info("force-merge %s: %d segments left (target %d), %0.1f%% done, %d seconds elapsed" % (
+                index_name, segment_count, target_segment_count,
+                min(100.0, 100.0 * merged / to_merge), time.time() - start_time))
+
+            if not merge_thread.is_alive() and not self._is_force_merge_running(index_name):
+                break
+
+        logger.info("==> force-merge of %s finished in %d seconds" % (index_name, time.time() - start_time))
+
+    def prewarm_index(self, index_name, queries=None):
+        """Refreshes an index and runs some queries against it so the first user queries don't hit cold caches.
+
+        Args:
+            index_name (str): elasticsearch index name
+            queries (list): (optional) list of query bodies to run. By default, a match_all query is run.
+        """
+
+        logger.info("==> pre-warming %s" % index_name)
+        self.es.indices.refresh(index=index_name)
+
+        for query in (queries or [{"size": 0, "query": {"match_all": {}}}]):
+            response = self.es.search(index=index_name, body=query, request_timeout=LONG_RUNNING_REQUEST_TIMEOUT)
+            logger.info("pre-warm query took %s ms" % response.get("took"))
+
+    def update_index_alias(self, alias_name, index_names):
+        """Atomically points an alias at the given indices, removing it from any other indices.
+
+        Args:
+            alias_name (str): alias name
+            index_names (list): one or more index names the alias should point to
+        """
+
+        if isinstance(index_names, str):
+            index_names = [index_names]
+
+        actions = []
+        if self.es.indices.exists_alias(name=alias_name):
+            for existing_index_name in self.es.indices.get_alias(name=alias_name).keys():
+                if existing_index_name not in index_names:
+                    actions.append({"remove": {"index": existing_index_name, "alias": alias_name}})
+
+        actions.extend([{"add": {"index": index_name, "alias": alias_name}} for index_name in index_names])
+
+        logger.info("==> updating alias %s: %s" % (alias_name, pformat(actions)))
+        self.es.indices.update_aliases(body={"actions": actions})
+
+        self.record_index_operation("update_alias", alias_name, actions=actions)
+
+    def finalize_bulk_load(
+        self,
+        index_name,
+        refresh_interval="1s",
+        num_replicas=0,
+        force_merge_max_num_segments=1,
+        force_merge_poll_interval=30,
+        prewarm_queries=None,
+        alias_name=None,
+    ):
+        """Prepares an index for queries after a bulk load.
+
+        Force-merges while there are still no replicas (so merged segments don't have to be copied twice),
+        then restores the refresh interval and replicas, pre-warms the index, and finally flips the alias.
 
         Args:
+            index_name (str): elasticsearch index name
+            refresh_interval (str): refresh interval to restore after the load
+            num_replicas (int): number of replicas to restore after the load
+            force_merge_max_num_segments (int): target segments per shard. None skips the force-merge.
+            force_merge_poll_interval (int): seconds between force-merge progress checks
+            prewarm_queries (list): (optional) query bodies to run before the alias is flipped
+            alias_name (str): (optional) alias to point at this index once it's ready
+        """
+
+        if force_merge_max_num_segments is not None:
+            self.force_merge_index(
+                index_name, max_num_segments=force_merge_max_num_segments, poll_interval=force_merge_poll_interval)
+
+        self.restore_index_settings(
+            index_name,
+            refresh_interval=refresh_interval,
+            num_replicas=num_replicas,
+            wait_for_status="green" if num_replicas else "yellow",
+        )
+
+        self.prewarm_index(index_name, queries=prewarm_queries)
+
+        if alias_name:
+            self.update_index_alias(alias_name, index_name)
+
+    def get_write_rejection_count(self):
+        """Returns the total number of rejected bulk/write requests across all nodes since they started."""
+
+        node_stats = self.es.nodes.stats(metric="thread_pool")
+        total = 0
+        for node in node_stats["nodes"].values():
+            # the "bulk" thread pool was renamed to "write" in elasticsearch 6.3
+            thread_pool = node["thread_pool"].get("write") or node["thread_pool"].get("bulk") or {}
+            total += thread_pool.get("rejected", 0)
+
+        return total
+
+    def get_index_operation_count(self, index_name):
+        """Returns the number of index operations performed on the primary shards of the given index."""
+
+        stats = self.es.indices.stats(index=index_name, metric="indexing")
+        return stats["indices"][index_name]["primaries"]["indexing"]["index_total"]
+
+    def delete_documents(self, index_name, index_type_name, doc_ids, chunk_size=1000):
+        """Deletes documents by id using bulk requests. Ids that don't exist in the index are ignored.
+
+        Args:
+            index_name (str): elasticsearch index name
+            index_type_name (str): elasticsearch type
+            doc_ids (iterable): ids of the documents to delete. Read lazily, so it can be a generator over ids that
+                don't fit in memory.
+            chunk_size (int): number of deletes to send in one bulk request
+        Returns:
+            int: the number of documents that were deleted
+        """
+
+        actions = (
+            {"_op_type": "delete", "_index": index_name, "_type": index_type_name, "_id": doc_id}
+            for doc_id in doc_ids
+        )
+
+        num_deleted = 0
+        for ok, item in elasticsearch.helpers.streaming_bulk(
+            self.es, actions, chunk_size=chunk_size, raise_on_error=False, raise_on_exception=True,
+        ):
+            if ok:
+                num_deleted += 1
+            elif item.get("delete", {}).get("status") != 404:
+                raise ValueError("Failed to delete document: %s" % pformat(item))
+
+        logger.info("==> deleted %d documents from %s" % (num_deleted, index_name))
+
+        return num_deleted
+
+    def delete_documents_by_field(self, index_name, field, values, chunk_size=1000):
+        """Deletes all documents whose field has one of the given values, eg. the children of some parent documents.
+
+        Args:
+            index_name (str): elasticsearch index name
+            field (str): keyword field to match, eg. "variant_id"
+            values (list): values of field to delete documents for
+            chunk_size (int): number of values to send in one delete-by-query request
+        Returns:
+            int: the number of documents that were deleted
+        """
+
+        values = list(values)
+        num_deleted = 0
+        for i in range(0, len(values), chunk_size):
+            response = self.es.delete_by_query(
+                index=index_name,
+                body={"query": {"terms": {field: values[i:i+chunk_size]}}},
+                conflicts="proceed",
+                request_timeout=LONG_RUNNING_REQUEST_TIMEOUT,
+            )
+            if response.get("failures"):
+                raise ValueError("Failed to delete documents: %s" % pformat(response["failures"]))
+            num_deleted += response["deleted"]
+
+        logger.info("==> deleted %d documents from %s" % (num_deleted, index_name))
+
+        return num_deleted
+
+    def create_elasticsearch_snapshot(self, index_name, bucket, base_path, snapshot_repo, repository_type="gcs",
+                                      location=None, wait=True):
+        """Creates an elasticsearch snapshot in the given repository.
+
+        NOTE: for "gcs" repositories, Elasticsearch must have the GCP snapshot plugin installed - see:
+        https://www.elastic.co/guide/en/elasticsearch/plugins/master/repository-gcs.html
+
+        Args:
+            index_name (str): snapshot will be created for this index
             bucket (str): GCS bucket name (eg. "my-datasets")
             base_path (str): sub-directory inside the bucket where snapshots are stored
             snapshot_repo (str): the snapshot repository name
+            repository_type (str): "gcs" or "fs"
+            location (str): for "fs" repositories, the shared directory to store snapshots in
+            wait (bool): whether to poll the snapshot until it completes
+        Returns:
+            str: the snapshot name
         """
 
-        # see https://www.elastic.co/guide/en/elasticsearch/plugins/current/repository-gcs-repository.html
-        logger.info("==> check if snapshot repo exists: %s" % snapshot_repo)
-        try:
-            repo_info = self.es.snapshot.get_repository(repository=snapshot_repo)
-            logger.info(pformat(repo_info))
-        except elasticsearch.exceptions.NotFoundError:
-            # register repository
-            self.create_elasticsearch_snapshot_repository(bucket, base_path, snapshot_repo)
-
-        # see https://www.elastic.co/guide/en/elasticsearch/reference/current/modules-snapshots.html
-        #response = requests.get("http://%s:%s/_snapshot/%s/_all" % (args.host, args.port, snapshot_repo))
-        #all_snapshots = json.loads(response.content).get("snapshots", [])
-
-        all_snapshots = self.es.snapshot.get(snapshot_repo, "_all").get("snapshots")
-        all_snapshots.sort(key=lambda s: s["start_time_in_millis"])
-
-        latest_snapshot = all_snapshots[-1]
-
-        snapshot_name = latest_snapshot["snapshot"]
-
-        # http://elasticsearch-py.readthedocs.io/en/master/api.html#elasticsearch.client.SnapshotClient.restore
-        logger.info("==> restoring snapshot: " + snapshot_name)
-        logger.info(pformat(
-            self.es.snapshot.restore(
-                repository=snapshot_repo,
-                snapshot=snapshot_name,
-                wait_for_completion=False,  # setting this to True wasn't working as expected
-            )
-        ))
+        self.create_elasticsearch_snapshot_repository(
+            bucket, base_path, snapshot_repo, repository_type=repository_type, location=location)
 
-        logger.info("==> getting snapshot status for: " + snapshot_name)
-        logger.info(pformat(
-            self.es.snapshot.status(repository=snapshot_repo)
-        ))
+        return self.snapshot_manager.create_snapshot(snapshot_repo, index_name, wait=wait)
 
-    def create_elasticsearch_snapshot_repository(self, bucket, base_path, snapshot_repo):
-        """Kick off snapshot creation process."""
+    def restore_elasticsearch_snapshot(self, bucket, base_path, snapshot_repo, repository_type="gcs", location=None,
+                                       snapshot_name=None, indices=None, rename_pattern=None, rename_replacement=None,
+                                       wait=True):
+        """Restores an Elasticsearch snapshot from the given repository.
 
-        logger.info("==> creating GCS repository %s" % (snapshot_repo, ))
+        Args:
+            bucket (str): GCS bucket name (eg. "my-datasets")
+            base_path (str): sub-directory inside the bucket where snapshots are stored
+            snapshot_repo (str): the snapshot repository name
+            repository_type (str): "gcs" or "fs"
+            location (str): for "fs" repositories, the shared directory to store snapshots in
+            snapshot_name (str): snapshot to restore. Defaults to the most recent successful snapshot.
+            indices (list): index names or patterns to restore. Defaults to all indices in the snapshot.
+            rename_pattern (str): regular expression that matches the index names to rename, eg. "(.+)"
+            rename_replacement (str): replacement for rename_pattern, eg. "restored_$1"
+            wait (bool): whether to poll the restore until all shards are recovered
+        Returns:
+            list: names of the restored indices
+        """
 
-        logger.info("==> create GCS repository %s" % (snapshot_repo, ))
-        body = {
-            "type": "gcs",
-            "settings": {
-                "bucket": bucket,
-                "base_path": base_path,
-                "compress": True,
-            }
-        }
+        self.create_elasticsearch_snapshot_repository(
+            bucket, base_path, snapshot_repo, repository_type=repository_type, location=location)
 
-        logger.info(pformat(body))
+        return self.snapshot_manager.restore_snapshot(
+            snapshot_repo,
+            snapshot_name=snapshot_name,
+            indices=indices,
+            rename_pattern=rename_pattern,
+            rename_replacement=rename_replacement,
+            wait=wait)
 
-        logger.info(pformat(
-            self.es.snapshot.create_repository(repository=snapshot_repo, body=body)
-        ))
+    def create_elasticsearch_snapshot_repository(self, bucket, base_path, snapshot_repo, repository_type="gcs",
+                                                 location=None):
+        """Registers the snapshot repository if it doesn't exist yet."""
+
+        self.snapshot_manager.ensure_repository(
+            snapshot_repo, repository_type=repository_type, location=location, bucket=bucket, base_path=base_path)
 
     def get_elasticsearch_snapshot_status(self, snapshot_repo):
         """Get status of any snapshots being created"""
 
         return self.es.snapshot.status(repository=snapshot_repo)
 
+    def record_index_operation(self, operation, index_name=None, **kwargs):
+        """Appends an operation to the local journal, and sends the journal to elasticsearch once a batch of
+        operations has built up. See IndexOperationsJournal.record(..) for args.
+        """
+
+        entry = self.journal.record(operation, index_name=index_name, **kwargs)
+        self.flush_index_operations_journal(force=False)
+
+        return entry
+
+    def flush_index_operations_journal(self, force=True):
+        """Sends journal entries to the index_operations_log index. Failures are logged, and the entries are kept
+        locally to be sent by the next flush.
+        """
+
+        try:
+            self.journal.flush(self.es, force=force)
+        except elasticsearch.exceptions.ElasticsearchException as e:
+            logger.warning("Couldn't flush index operations journal %s: %s", self.journal.path, e)
+
     def save_index_operation_metadata(
         self,
         source_file,
@@ -302,30 +636,27 @@ class ElasticsearchClient:
         username=None,
         operation="create_index",
         status=None,
+        metrics=None,
+        start_time=None,
     ):
-        """Records metadata about the operation"""
-
-        # use inspection to get all arg names and values
-        arg_names, _, _, _ = inspect.getargspec(self.save_index_operation_metadata)
-        arg_names = arg_names[1:]  # get all except 'self'
+        """Records metadata about the operation in the index operations journal
 
-        INDEX_OPERATIONS_LOG = "index_operations_log"
-        DOC_TYPE = "log"
-
-        schema = {arg_name: {"type": "keyword"} for arg_name in arg_names}
-        schema["timestamp"] = {"type": "keyword"}
-
-        self.create_or_update_mapping(INDEX_OPERATIONS_LOG, DOC_TYPE, elasticsearch_schema=schema)
+        Args:
+            metrics (str): optional json summary of the operation, eg. export throughput
+            start_time (float): optional time.time() when the operation started, used to record its duration
+        """
 
+        # use inspection to get all arg names and values
         values = locals()
-        body = {key: values.get(key) for key in arg_names}
-
-        body["timestamp"] = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-
-        self.es.index(index=INDEX_OPERATIONS_LOG, doc_type=DOC_TYPE, op_type="index", body=body)
+        params = {
+            arg_name: values[arg_name]
+            for arg_name in inspect.signature(self.save_index_operation_metadata).parameters
+            if arg_name not in ("index_name", "operation", "status", "metrics", "start_time")
+            and values[arg_name] is not None
+        }
 
-        logger.info("Saved index operation metadata:")
-        logger.info(pformat(body))
+        self.record_index_operation(
+            operation, index_name=index_name, status=status, start_time=start_time, metrics=metrics, **params)
 
     def get_index_meta(self, index_name, index_type_name="*"):
         _meta = {}
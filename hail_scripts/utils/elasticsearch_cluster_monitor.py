@@ -0,0 +1,227 @@
+import logging
+import re
+import threading
+import time
+
+logger = logging.getLogger()
+
+
+CLUSTER_OK = "ok"
+CLUSTER_SLOW_DOWN = "slow_down"
+CLUSTER_PAUSE = "pause"
+
+# a cluster that stays past a pause threshold this long (eg. because its disks are simply too full) fails the load
+DEFAULT_MAX_PAUSE_SECONDS = 2*60*60
+
+# defaults used when the cluster settings don't specify disk watermarks
+# (see https://www.elastic.co/guide/en/elasticsearch/reference/current/disk-allocator.html)
+DEFAULT_DISK_WATERMARKS = {
+    "low": "85%",
+    "high": "90%",
+    "flood_stage": "95%",
+}
+
+
+def _parse_disk_watermark(value):
+    """Parses a disk watermark setting.
+
+    Returns:
+        tuple: ("percent", <max disk used percent>) for settings like "90%" or "0.9", or
+            ("bytes", <min free bytes>) for settings like "500gb"
+    """
+
+    value = str(value).strip().lower()
+    if value.endswith("%"):
+        return "percent", float(value[:-1])
+
+    match = re.match(r"^([0-9.]+)\s*(b|kb|mb|gb|tb|pb)$", value)
+    if match:
+        units = {"b": 0, "kb": 1, "mb": 2, "gb": 3, "tb": 4, "pb": 5}
+        return "bytes", float(match.group(1)) * 1024**units[match.group(2)]
+
+    return "percent", 100 * float(value)
+
+
+def _is_past_disk_watermark(fs_total, watermark, margin_percent=0):
+    kind, limit = _parse_disk_watermark(watermark)
+    if kind == "percent":
+        used_percent = 100.0 * (fs_total["total_in_bytes"] - fs_total["available_in_bytes"]) / fs_total["total_in_bytes"]
+        return used_percent >= limit - margin_percent
+
+    return fs_total["available_in_bytes"] <= limit * (1 + margin_percent / 100.0)
+
+
+def evaluate_node_stats(
+    node_stats,
+    previous_node_stats=None,
+    disk_watermarks=DEFAULT_DISK_WATERMARKS,
+    disk_watermark_margin_percent=2,
+    max_heap_used_percent=85,
+    pause_heap_used_percent=95,
+    max_write_queue=200,
+    max_current_merges=10,
+):
+    """Decides whether a bulk load should continue, slow down, or pause, based on a nodes stats response.
+
+    Args:
+        node_stats (dict): es.nodes.stats(..) response including jvm, thread_pool, fs and indices.merge stats
+        previous_node_stats (dict): the previous response, used to detect new write rejections
+        disk_watermarks (dict): the cluster's "low", "high" and "flood_stage" disk watermark settings
+        disk_watermark_margin_percent (float): act this many percentage points before a watermark is actually reached
+        max_heap_used_percent (int): slow down when any node's heap is fuller than this
+        pause_heap_used_percent (int): pause when any node's heap is fuller than this
+        max_write_queue (int): slow down when any node has more than this many queued write requests
+        max_current_merges (int): slow down when any node is running more than this many merges
+    Returns:
+        tuple: (status, reasons) where status is one of CLUSTER_OK, CLUSTER_SLOW_DOWN or CLUSTER_PAUSE,
+            and reasons is a list of strings describing which thresholds were crossed.
+    """
+
+    pause_reasons = []
+    slow_down_reasons = []
+    previous_nodes = (previous_node_stats or {}).get("nodes", {})
+
+    for node_id, node in node_stats["nodes"].items():
+        node_name = node.get("name", node_id)
+
+        fs_total = node.get("fs", {}).get("total")
+        if fs_total and fs_total.get("total_in_bytes"):
+            if _is_past_disk_watermark(fs_total, disk_watermarks["high"], disk_watermark_margin_percent):
+                pause_reasons.append("%s: disk is near the high watermark (%s)" % (node_name, disk_watermarks["high"]))
+            elif _is_past_disk_watermark(fs_total, disk_watermarks["low"], disk_watermark_margin_percent):
+                slow_down_reasons.append("%s: disk is near the low watermark (%s)" % (node_name, disk_watermarks["low"]))
+
+        heap_used_percent = node.get("jvm", {}).get("mem", {}).get("heap_used_percent", 0)
+        if heap_used_percent >= pause_heap_used_percent:
+            pause_reasons.append("%s: heap is %d%% full" % (node_name, heap_used_percent))
+        elif heap_used_percent >= max_heap_used_percent:
+            slow_down_reasons.append("%s: heap is %d%% full" % (node_name, heap_used_percent))
+
+        # the "bulk" thread pool was renamed to "write" in elasticsearch 6.3
+        thread_pools = node.get("thread_pool", {})
+        write_pool = thread_pools.get("write") or thread_pools.get("bulk") or {}
+        if write_pool.get("queue", 0) > max_write_queue:
+            slow_down_reasons.append("%s: %d queued write requests" % (node_name, write_pool["queue"]))
+
+        previous_thread_pools = previous_nodes.get(node_id, {}).get("thread_pool", {})
+        previous_write_pool = previous_thread_pools.get("write") or previous_thread_pools.get("bulk")
+        if previous_write_pool is not None:
+            new_rejections = write_pool.get("rejected", 0) - previous_write_pool.get("rejected", 0)
+            if new_rejections > 0:
+                slow_down_reasons.append("%s: %d new write rejections" % (node_name, new_rejections))
+
+        current_merges = node.get("indices", {}).get("merges", {}).get("current", 0)
+        if current_merges > max_current_merges:
+            slow_down_reasons.append("%s: %d merges running" % (node_name, current_merges))
+
+    if pause_reasons:
+        return CLUSTER_PAUSE, pause_reasons + slow_down_reasons
+    if slow_down_reasons:
+        return CLUSTER_SLOW_DOWN, slow_down_reasons
+
+    return CLUSTER_OK, []
+
+
+class ClusterHealthMonitor(threading.Thread):
+    """Background thread that samples node stats across the cluster while data is being loaded.
+
+    The loader calls wait_until_healthy() between chunks: it blocks while any node is past a pause threshold
+    (eg. close to the disk high watermark, where elasticsearch would start making indices read-only), and returns
+    the current status so the loader can slow down when softer thresholds are crossed.
+
+    Throttling only acts between chunks. A chunk that is already being written isn't paused or slowed down, so
+    monitored exports are split into chunks (see ElasticsearchClient.export_table_to_elasticsearch(..)).
+    """
+
+    def __init__(self, es, sample_interval_seconds=10, **thresholds):
+        """Constructor.
+
+        Args:
+            es (Elasticsearch): elasticsearch client
+            sample_interval_seconds (int): how often to sample node stats
+            thresholds: passed on to evaluate_node_stats(..)
+        """
+
+        super(ClusterHealthMonitor, self).__init__(name="es-cluster-health-monitor", daemon=True)
+
+        self.es = es
+        self.sample_interval_seconds = sample_interval_seconds
+        self.thresholds = thresholds
+        self.status = CLUSTER_OK
+        self.reasons = []
+        self.last_node_stats = None
+
+        self._stopped = threading.Event()
+        self._sampled = threading.Event()
+        self._lock = threading.Lock()
+
+        if "disk_watermarks" not in self.thresholds:
+            self.thresholds["disk_watermarks"] = self._get_disk_watermarks()
+
+    def _get_disk_watermarks(self):
+        settings = self.es.cluster.get_settings(include_defaults=True, flat_settings=True)
+        disk_watermarks = dict(DEFAULT_DISK_WATERMARKS)
+        for level in disk_watermarks:
+            key = "cluster.routing.allocation.disk.watermark.%s" % level
+            for scope in ("transient", "persistent", "defaults"):
+                if key in settings.get(scope, {}):
+                    disk_watermarks[level] = settings[scope][key]
+                    break
+
+        return disk_watermarks
+
+    def sample(self):
+        """Samples node stats once and updates the status"""
+
+        node_stats = self.es.nodes.stats(metric="jvm,thread_pool,fs,indices", index_metric="merge")
+        status, reasons = evaluate_node_stats(node_stats, self.last_node_stats, **self.thresholds)
+
+        with self._lock:
+            if status != self.status:
+                logger.info("==> cluster status changed from %s to %s: %s" % (self.status, status, "; ".join(reasons)))
+            self.status = status
+            self.reasons = reasons
+            self.last_node_stats = node_stats
+
+        self._sampled.set()
+
+        return status
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                logger.warning("Failed to sample elasticsearch node stats: %s" % e)
+            self._stopped.wait(self.sample_interval_seconds)
+
+    def stop(self):
+        self._stopped.set()
+
+    def wait_until_healthy(self, poll_interval_seconds=10, max_pause_seconds=DEFAULT_MAX_PAUSE_SECONDS):
+        """Blocks while the cluster status is CLUSTER_PAUSE.
+
+        Args:
+            poll_interval_seconds (int): how often to check the status while paused
+            max_pause_seconds (int): raise a RuntimeError if the cluster is still paused after this long. None waits
+                indefinitely.
+        Returns:
+            str: the cluster status once loading can continue - CLUSTER_OK or CLUSTER_SLOW_DOWN
+        """
+
+        self._sampled.wait(timeout=self.sample_interval_seconds * 3)
+
+        pause_start_time = None
+        while self.status == CLUSTER_PAUSE:
+            if pause_start_time is None:
+                pause_start_time = time.time()
+            if max_pause_seconds is not None and time.time() - pause_start_time > max_pause_seconds:
+                raise RuntimeError("Loading was paused for more than %d seconds: %s" % (
+                    max_pause_seconds, "; ".join(self.reasons)))
+            logger.info("Loading paused for %d seconds: %s" % (time.time() - pause_start_time, "; ".join(self.reasons)))
+            time.sleep(poll_interval_seconds)
+
+        if pause_start_time is not None:
+            logger.info("==> resuming load after %d seconds" % (time.time() - pause_start_time))
+
+        return self.status
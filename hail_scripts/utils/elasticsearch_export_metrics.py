@@ -0,0 +1,178 @@
+import json
+import logging
+import math
+import os
+import time
+
+logger = logging.getLogger()
+
+
+def _percentile(values, percentile):
+    """Returns the given percentile of a list of numbers, interpolating between the closest ranks"""
+
+    if not values:
+        return None
+
+    values = sorted(values)
+    rank = (len(values) - 1) * percentile / 100.0
+    lower = int(math.floor(rank))
+    upper = int(math.ceil(rank))
+
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+class ElasticsearchExportMetrics:
+    """Collects throughput metrics while a table is exported to elasticsearch.
+
+    Everything is measured per chunk of partitions, not per partition or per bulk request: elasticsearch-hadoop writes
+    a chunk in one call and doesn't expose the size or latency of the partitions and bulk requests within it.
+
+    Per chunk, documents come from the index's indexing stats and rejections from the cluster's write thread pool
+    stats. The other figures are derived, and named for it:
+        estimated_bytes: documents times the average document size
+        estimated_bulk_requests: documents divided by block_size, rounded up per partition
+        avg_partition_documents: documents divided by the number of partitions in the chunk
+        avg_estimated_request_seconds: the chunk's duration divided by the bulk requests each partition sent. This is
+            an average over the whole chunk, includes the time spent computing it, and is not a measured latency.
+    The summary reports the min, median and max of avg_estimated_request_seconds across chunks, not latency
+    percentiles.
+    """
+
+    def __init__(self, index_name, avg_document_bytes=None):
+        """Constructor.
+
+        Args:
+            index_name (str): elasticsearch index being exported to
+            avg_document_bytes (float): average document size, used to estimate bytes sent. If None, estimated_bytes
+                isn't reported.
+        """
+
+        self.index_name = index_name
+        self.avg_document_bytes = avg_document_bytes
+        self.start_time = time.time()
+        self.end_time = None
+        self.chunks = []
+
+    def record_chunk(self, label, num_partitions, num_documents, elapsed_seconds, block_size, num_rejections, num_retries=0):
+        """Records the outcome of exporting one chunk of partitions.
+
+        Args:
+            label (str): description of the chunk (eg. "partitions 0-9")
+            num_partitions (int): number of partitions in the chunk
+            num_documents (int): number of documents written
+            elapsed_seconds (float): how long the chunk took, including retries
+            block_size (int): number of documents per bulk request
+            num_rejections (int): bulk rejections reported by the cluster while the chunk was exported
+            num_retries (int): how many times the chunk had to be re-exported after a failure
+        Returns:
+            dict: the chunk record
+        """
+
+        num_bytes = int(num_documents * self.avg_document_bytes) if self.avg_document_bytes else None
+        avg_partition_documents = float(num_documents) / max(num_partitions, 1)
+        num_requests_per_partition = max(1.0, avg_partition_documents / max(block_size or 1, 1))
+
+        record = {
+            "chunk": label,
+            "partitions": num_partitions,
+            "documents": num_documents,
+            "estimated_bytes": num_bytes,
+            "seconds": round(elapsed_seconds, 3),
+            "block_size": block_size,
+            "estimated_bulk_requests": int(math.ceil(num_requests_per_partition * num_partitions)),
+            "avg_partition_documents": round(avg_partition_documents, 1),
+            "avg_estimated_request_seconds": elapsed_seconds / num_requests_per_partition,
+            "rejections": num_rejections,
+            "retries": num_retries,
+        }
+        self.chunks.append(record)
+
+        return record
+
+    def finish(self):
+        self.end_time = time.time()
+
+    def summary(self, include_chunks=True):
+        """Returns a dict with totals, rates and the range of the chunks' average request time estimates for the
+        export so far
+        """
+
+        elapsed_seconds = (self.end_time or time.time()) - self.start_time
+        num_documents = sum(chunk["documents"] for chunk in self.chunks)
+        num_bytes = sum(chunk["estimated_bytes"] or 0 for chunk in self.chunks) if self.avg_document_bytes else None
+        estimated_request_seconds = [chunk["avg_estimated_request_seconds"] for chunk in self.chunks]
+
+        summary = {
+            "index_name": self.index_name,
+            "start_time": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.start_time)),
+            "seconds": round(elapsed_seconds, 3),
+            "documents": num_documents,
+            "estimated_bytes": num_bytes,
+            "documents_per_second": round(num_documents / elapsed_seconds, 1) if elapsed_seconds > 0 else None,
+            "estimated_bytes_per_second": (
+                round(num_bytes / elapsed_seconds, 1) if num_bytes is not None and elapsed_seconds > 0 else None),
+            "estimated_bulk_requests": sum(chunk["estimated_bulk_requests"] for chunk in self.chunks),
+            "avg_estimated_request_seconds_across_chunks": {
+                "min": min(estimated_request_seconds) if estimated_request_seconds else None,
+                "median": _percentile(estimated_request_seconds, 50),
+                "max": max(estimated_request_seconds) if estimated_request_seconds else None,
+            },
+            "rejections": sum(chunk["rejections"] for chunk in self.chunks),
+            "retries": sum(chunk["retries"] for chunk in self.chunks),
+        }
+
+        if include_chunks:
+            summary["chunks"] = self.chunks
+
+        return summary
+
+    def write_json_report(self, path):
+        """Writes the summary, including the per-chunk records, as json to a local file"""
+
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+        logger.info("==> wrote export metrics to %s" % path)
+
+    def write_prometheus_textfile(self, path):
+        """Writes the summary in the prometheus text format, eg. for the node_exporter textfile collector.
+
+        The file is written to a temp file and renamed, so the collector never reads a partial file.
+        """
+
+        summary = self.summary(include_chunks=False)
+        labels = 'index="%s"' % self.index_name
+
+        lines = []
+
+        def add_metric(name, metric_type, description, values):
+            lines.append("# HELP %s %s" % (name, description))
+            lines.append("# TYPE %s %s" % (name, metric_type))
+            for metric_labels, value in values:
+                if value is not None:
+                    lines.append("%s{%s} %s" % (name, metric_labels, value))
+
+        add_metric("es_export_documents", "gauge", "Documents written by the last export", [(labels, summary["documents"])])
+        add_metric("es_export_estimated_bytes", "gauge", "Estimated bytes sent by the last export",
+                   [(labels, summary["estimated_bytes"])])
+        add_metric("es_export_duration_seconds", "gauge", "Duration of the last export", [(labels, summary["seconds"])])
+        add_metric("es_export_documents_per_second", "gauge", "Documents written per second",
+                   [(labels, summary["documents_per_second"])])
+        add_metric("es_export_estimated_bytes_per_second", "gauge", "Estimated bytes sent per second",
+                   [(labels, summary["estimated_bytes_per_second"])])
+        add_metric("es_export_rejections", "gauge", "Bulk rejections during the last export", [(labels, summary["rejections"])])
+        add_metric("es_export_retries", "gauge", "Chunk retries during the last export", [(labels, summary["retries"])])
+        add_metric("es_export_chunk_seconds", "gauge", "Duration of each chunk of partitions", [
+            ('%s,chunk="%s"' % (labels, chunk["chunk"]), chunk["seconds"]) for chunk in self.chunks
+        ])
+        add_metric("es_export_chunk_avg_estimated_request_seconds", "gauge",
+                   "Chunk duration divided by the bulk requests each partition sent (a chunk average, not a measured latency)", [
+            ('%s,chunk="%s"' % (labels, chunk["chunk"]), chunk["avg_estimated_request_seconds"]) for chunk in self.chunks
+        ])
+
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp_path, path)
+
+        logger.info("==> wrote prometheus metrics to %s" % path)
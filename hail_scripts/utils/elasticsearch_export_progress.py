@@ -0,0 +1,97 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger()
+
+
+class ExportProgress:
+    """Keeps track of which partition chunks of a table have been exported to elasticsearch.
+
+    Progress is stored as a small json file on the local file system, and is rewritten after every chunk so that an
+    export that dies part way through can be resumed from the first chunk that wasn't confirmed. This is only safe
+    when documents have deterministic ids (es.mapping.id), since a partially written chunk is exported again.
+
+    The progress file also records the index settings to put back after the load (see set_index_settings(..)), since a
+    resumed export finds the index with the bulk load settings of the run that died.
+    """
+
+    def __init__(self, path, index_name, num_partitions, partitions_per_chunk, resume=False):
+        """Constructor.
+
+        Args:
+            path (str): local path of the progress file. If None, progress is only kept in memory.
+            index_name (str): elasticsearch index being exported to
+            num_partitions (int): number of partitions in the table being exported
+            partitions_per_chunk (int): number of partitions exported together in one chunk
+            resume (bool): if True, previously completed chunks are loaded from the progress file. Otherwise the
+                progress file is reset.
+        """
+
+        self.path = path
+        self.index_name = index_name
+        self.num_partitions = num_partitions
+        self.partitions_per_chunk = partitions_per_chunk
+        self.completed_chunks = set()
+        self.index_settings = None
+
+        if resume and path and os.path.isfile(path):
+            with open(path) as f:
+                progress = json.load(f)
+
+            for key in ("index_name", "num_partitions", "partitions_per_chunk"):
+                if progress.get(key) != getattr(self, key):
+                    raise ValueError("Can't resume export: %s is %s in %s, but %s now" % (
+                        key, progress.get(key), path, getattr(self, key)))
+
+            self.completed_chunks = set(progress["completed_chunks"])
+            self.index_settings = progress.get("index_settings")
+            logger.info("==> resuming export to %s: %d out of %d chunks already done" % (
+                index_name, len(self.completed_chunks), self.num_chunks))
+        else:
+            self._save()
+
+    @property
+    def num_chunks(self):
+        return (self.num_partitions + self.partitions_per_chunk - 1) // self.partitions_per_chunk
+
+    def chunk_partitions(self, chunk_index):
+        """Returns the list of partition indices in the given chunk"""
+        start = chunk_index * self.partitions_per_chunk
+        return list(range(start, min(start + self.partitions_per_chunk, self.num_partitions)))
+
+    def remaining_chunks(self):
+        """Returns the indices of chunks that haven't been confirmed yet, in order"""
+        return [i for i in range(self.num_chunks) if i not in self.completed_chunks]
+
+    def is_done(self):
+        return len(self.completed_chunks) == self.num_chunks
+
+    def mark_done(self, chunk_index):
+        self.completed_chunks.add(chunk_index)
+        self._save()
+
+    def set_index_settings(self, index_settings):
+        """Records the settings the index should get once the load is done, eg. its refresh_interval and
+        number_of_replicas from before the first run changed them.
+        """
+        self.index_settings = index_settings
+        self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+
+        progress = {
+            "index_name": self.index_name,
+            "num_partitions": self.num_partitions,
+            "partitions_per_chunk": self.partitions_per_chunk,
+            "completed_chunks": sorted(self.completed_chunks),
+            "index_settings": self.index_settings,
+        }
+
+        # write to a temp file and rename it, so an interrupted write can't corrupt the progress file
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(progress, f)
+        os.replace(temp_path, self.path)
@@ -0,0 +1,355 @@
+import fnmatch
+import logging
+import re
+import time
+from pprint import pformat
+
+import elasticsearch
+
+logger = logging.getLogger()
+
+
+SNAPSHOT_REPOSITORY_TYPES = ("fs", "gcs")
+
+
+def _estimate_seconds_remaining(done, total, elapsed_seconds):
+    """Linear estimate of how long it'll take to process the rest of total, or None if there's nothing to go on"""
+    if not done or not total or elapsed_seconds <= 0:
+        return None
+
+    return elapsed_seconds * (total - done) / float(done)
+
+
+def _format_progress(label, done_bytes, total_bytes, elapsed_seconds):
+    eta = _estimate_seconds_remaining(done_bytes, total_bytes, elapsed_seconds)
+    return "%s: %0.1f%% (%0.1f Gb out of %0.1f Gb), %d seconds elapsed, ETA: %s" % (
+        label,
+        100.0 * done_bytes / total_bytes if total_bytes else 0,
+        done_bytes / 10**9,
+        total_bytes / 10**9,
+        elapsed_seconds,
+        "%d seconds" % eta if eta is not None else "unknown",
+    )
+
+
+def _snapshot_status_bytes(snapshot_status):
+    """Returns (processed bytes, total bytes) from an entry in a snapshot status response.
+
+    The format of these stats changed in elasticsearch 6.4.
+    """
+
+    stats = snapshot_status.get("stats", {})
+    if "total" in stats:
+        return stats.get("processed", {}).get("size_in_bytes", 0), stats["total"].get("size_in_bytes", 0)
+
+    return stats.get("processed_size_in_bytes", 0), stats.get("total_size_in_bytes", 0)
+
+
+def _select_snapshots_to_prune(snapshots, keep_last=None, max_age_days=None, name_prefix=None, now_millis=None):
+    """Picks which snapshots to delete under a retention policy.
+
+    Args:
+        snapshots (list): snapshot descriptions as returned by es.snapshot.get(..)
+        keep_last (int): always keep this many of the most recent snapshots
+        max_age_days (float): delete snapshots older than this. If not set, only keep_last applies.
+        name_prefix (str): only consider snapshots whose names start with this prefix
+        now_millis (int): current time in milliseconds, for testing
+    Returns:
+        list: names of snapshots to delete
+    """
+
+    now_millis = now_millis if now_millis is not None else int(time.time() * 1000)
+
+    candidates = [
+        s for s in snapshots
+        if s.get("state") != "IN_PROGRESS" and (not name_prefix or s["snapshot"].startswith(name_prefix))
+    ]
+    candidates.sort(key=lambda s: s["start_time_in_millis"], reverse=True)
+
+    if keep_last:
+        candidates = candidates[keep_last:]
+
+    if max_age_days is not None:
+        max_age_millis = max_age_days * 24 * 60 * 60 * 1000
+        candidates = [s for s in candidates if now_millis - s["start_time_in_millis"] > max_age_millis]
+    elif not keep_last:
+        return []
+
+    return [s["snapshot"] for s in candidates]
+
+
+class SnapshotManager:
+    """Creates, restores and prunes elasticsearch snapshots without blocking on long-running requests.
+
+    Supports "fs" repositories (a directory listed in the path.repo setting of every node - useful for testing
+    against a local elasticsearch) and "gcs" repositories (needs the repository-gcs plugin - see
+    https://www.elastic.co/guide/en/elasticsearch/plugins/master/repository-gcs.html).
+    """
+
+    def __init__(self, es, poll_interval_seconds=10, journal=None):
+        """Constructor.
+
+        Args:
+            es (Elasticsearch): elasticsearch client
+            poll_interval_seconds (int): how often to check on snapshots and restores that are in progress
+            journal (IndexOperationsJournal): (optional) journal to record snapshot operations in
+        """
+
+        self.es = es
+        self.poll_interval_seconds = poll_interval_seconds
+        self.journal = journal
+
+    def _record_operation(self, operation, snapshot_name, **kwargs):
+        if self.journal is None:
+            return
+
+        self.journal.record(operation, index_name=snapshot_name, **kwargs)
+        try:
+            self.journal.flush(self.es)
+        except elasticsearch.exceptions.ElasticsearchException as e:
+            logger.warning("Couldn't flush index operations journal %s: %s", self.journal.path, e)
+
+    def ensure_repository(self, repository, repository_type="fs", location=None, bucket=None, base_path=None,
+                          readonly=False):
+        """Registers a snapshot repository unless one with this name already exists.
+
+        Args:
+            repository (str): snapshot repository name
+            repository_type (str): "fs" or "gcs"
+            location (str): for "fs" repositories, the shared directory to store snapshots in
+            bucket (str): for "gcs" repositories, the GCS bucket name (eg. "my-datasets")
+            base_path (str): for "gcs" repositories, sub-directory inside the bucket where snapshots are stored
+            readonly (bool): register the repository as read-only, eg. on a cluster that only restores from it
+        """
+
+        try:
+            logger.info(pformat(self.es.snapshot.get_repository(repository=repository)))
+            return
+        except elasticsearch.exceptions.NotFoundError:
+            pass
+
+        if repository_type == "fs":
+            if not location:
+                raise ValueError("location is required for fs snapshot repositories")
+            settings = {"location": location, "compress": True}
+        elif repository_type == "gcs":
+            if not bucket:
+                raise ValueError("bucket is required for gcs snapshot repositories")
+            settings = {"bucket": bucket, "base_path": base_path or "", "compress": True}
+        else:
+            raise ValueError("Unexpected repository_type: %s. Should be one of %s" % (
+                repository_type, ", ".join(SNAPSHOT_REPOSITORY_TYPES)))
+
+        if readonly:
+            settings["readonly"] = True
+
+        body = {"type": repository_type, "settings": settings}
+        logger.info("==> creating %s snapshot repository %s: %s" % (repository_type, repository, pformat(body)))
+        self.es.snapshot.create_repository(repository=repository, body=body)
+
+    def list_snapshots(self, repository):
+        """Returns all snapshots in the repository, oldest first"""
+
+        snapshots = self.es.snapshot.get(repository=repository, snapshot="_all").get("snapshots", [])
+        snapshots.sort(key=lambda s: s["start_time_in_millis"])
+
+        return snapshots
+
+    def _wait_for_running_snapshots(self, repository):
+        """Waits until there are no snapshots in progress in the repository - elasticsearch only runs one at a time"""
+
+        while True:
+            running = self.es.snapshot.status(repository=repository).get("snapshots", [])
+            if not running:
+                return
+
+            logger.info("Waiting for other snapshots to complete: %s" % ", ".join(s["snapshot"] for s in running))
+            time.sleep(self.poll_interval_seconds)
+
+    def create_snapshot(self, repository, indices, snapshot_name=None, wait=True):
+        """Starts a snapshot of the given indices and (optionally) polls it until it's done.
+
+        Args:
+            repository (str): snapshot repository name
+            indices (list): index names or patterns to include
+            snapshot_name (str): (optional) snapshot name. By default it's generated from the index names and time.
+            wait (bool): whether to poll the snapshot, logging progress and ETA, until it completes
+        Returns:
+            str: the snapshot name
+        """
+
+        if isinstance(indices, str):
+            indices = [indices]
+
+        # check that the indices exist
+        matching_indices = self.es.indices.get(index=",".join(indices)).keys()
+        if not matching_indices:
+            all_indices = self.es.indices.get(index="*").keys()
+            raise ValueError("%s not found. Existing indices are: %s" % (", ".join(indices), ", ".join(all_indices)))
+
+        start_time = time.time()
+        if snapshot_name is None:
+            snapshot_name = "snapshot_%s__%s" % (
+                "_".join(indices).replace("*", "").lower(), time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime()))
+
+        while True:
+            self._wait_for_running_snapshots(repository)
+            try:
+                logger.info("==> creating snapshot %s of %s" % (snapshot_name, ", ".join(matching_indices)))
+                self.es.snapshot.create(
+                    repository=repository,
+                    snapshot=snapshot_name,
+                    wait_for_completion=False,
+                    body={"indices": ",".join(indices), "include_global_state": False},
+                )
+                break
+            except elasticsearch.exceptions.TransportError as e:
+                # another snapshot may have started between the status check and the create request
+                if "concurrent_snapshot_execution_exception" not in str(e):
+                    raise
+
+        if wait:
+            self.wait_for_snapshot(repository, snapshot_name)
+
+        self._record_operation(
+            "create_snapshot", snapshot_name, status="success" if wait else "started", start_time=start_time,
+            repository=repository, indices=list(matching_indices))
+
+        return snapshot_name
+
+    def wait_for_snapshot(self, repository, snapshot_name):
+        """Polls a snapshot until it's done, logging progress and ETA. Raises an error if the snapshot failed."""
+
+        start_time = time.time()
+        while True:
+            snapshot = self.es.snapshot.get(repository=repository, snapshot=snapshot_name)["snapshots"][0]
+            if snapshot["state"] != "IN_PROGRESS":
+                break
+
+            statuses = self.es.snapshot.status(repository=repository, snapshot=snapshot_name).get("snapshots", [])
+            if statuses:
+                done_bytes, total_bytes = _snapshot_status_bytes(statuses[0])
+                shards = statuses[0].get("shards_stats", {})
+                logger.info(_format_progress(
+                    "snapshot %s (%s of %s shards done)" % (snapshot_name, shards.get("done"), shards.get("total")),
+                    done_bytes, total_bytes, time.time() - start_time))
+
+            time.sleep(self.poll_interval_seconds)
+
+        if snapshot["state"] != "SUCCESS":
+            raise ValueError("Snapshot %s finished with state %s: %s" % (
+                snapshot_name, snapshot["state"], pformat(snapshot.get("failures"))))
+
+        logger.info("==> snapshot %s finished in %d seconds" % (snapshot_name, time.time() - start_time))
+
+    def restore_snapshot(self, repository, snapshot_name=None, indices=None, rename_pattern=None,
+                         rename_replacement=None, index_settings=None, wait=True):
+        """Restores selected indices from a snapshot, optionally renaming them.
+
+        The shards of all selected indices are restored in parallel by the cluster. Restored indices must not
+        already exist (or must be closed) unless they're renamed.
+
+        Args:
+            repository (str): snapshot repository name
+            snapshot_name (str): snapshot to restore. Defaults to the most recent successful snapshot.
+            indices (list): index names or patterns to restore. Defaults to all indices in the snapshot.
+            rename_pattern (str): regular expression that matches the index names to rename, eg. "(.+)"
+            rename_replacement (str): replacement for rename_pattern, using elasticsearch syntax, eg. "restored_$1".
+                Must be given together with rename_pattern.
+            index_settings (dict): (optional) settings to override on the restored indices, eg. number_of_replicas
+            wait (bool): whether to poll the restore, logging progress and ETA, until all shards are recovered
+        Returns:
+            list: names of the restored indices
+        """
+
+        if bool(rename_pattern) != bool(rename_replacement):
+            raise ValueError("rename_pattern and rename_replacement must be given together")
+
+        start_time = time.time()
+        if snapshot_name is None:
+            successful_snapshots = [s for s in self.list_snapshots(repository) if s["state"] == "SUCCESS"]
+            if not successful_snapshots:
+                raise ValueError("No successful snapshots found in %s" % repository)
+            snapshot_name = successful_snapshots[-1]["snapshot"]
+
+        snapshot = self.es.snapshot.get(repository=repository, snapshot=snapshot_name)["snapshots"][0]
+        snapshot_indices = snapshot["indices"]
+        if indices:
+            if isinstance(indices, str):
+                indices = [indices]
+            snapshot_indices = [i for i in snapshot_indices if any(fnmatch.fnmatch(i, pattern) for pattern in indices)]
+            if not snapshot_indices:
+                raise ValueError("None of %s found in snapshot %s, which contains: %s" % (
+                    ", ".join(indices), snapshot_name, ", ".join(snapshot["indices"])))
+
+        restored_indices = snapshot_indices
+        body = {"indices": ",".join(snapshot_indices), "include_global_state": False}
+        if rename_pattern:
+            body["rename_pattern"] = rename_pattern
+            body["rename_replacement"] = rename_replacement
+            python_replacement = re.sub(r"\$(\d+)", r"\\\1", rename_replacement)
+            restored_indices = [re.sub(rename_pattern, python_replacement, i) for i in snapshot_indices]
+        if index_settings:
+            body["index_settings"] = index_settings
+
+        logger.info("==> restoring %s from snapshot %s as %s" % (
+            ", ".join(snapshot_indices), snapshot_name, ", ".join(restored_indices)))
+        self.es.snapshot.restore(repository=repository, snapshot=snapshot_name, wait_for_completion=False, body=body)
+
+        if wait:
+            self.wait_for_recovery(restored_indices)
+
+        self._record_operation(
+            "restore_snapshot", snapshot_name, status="success" if wait else "started", start_time=start_time,
+            repository=repository, indices=snapshot_indices, restored_indices=restored_indices)
+
+        return restored_indices
+
+    def wait_for_recovery(self, indices):
+        """Polls the recovery of the given indices until all their shards are done, logging progress and ETA"""
+
+        start_time = time.time()
+        while True:
+            recovery = self.es.indices.recovery(index=",".join(indices))
+
+            done_bytes = total_bytes = 0
+            num_shards = num_shards_done = 0
+            for index_recovery in recovery.values():
+                for shard in index_recovery.get("shards", []):
+                    num_shards += 1
+                    num_shards_done += shard["stage"] == "DONE"
+                    size = shard.get("index", {}).get("size", {})
+                    done_bytes += size.get("recovered_in_bytes", 0)
+                    total_bytes += size.get("total_in_bytes", 0)
+
+            if num_shards and num_shards_done == num_shards:
+                break
+
+            logger.info(_format_progress(
+                "restore (%d of %d shards done)" % (num_shards_done, num_shards),
+                done_bytes, total_bytes, time.time() - start_time))
+            time.sleep(self.poll_interval_seconds)
+
+        logger.info("==> restore of %s finished in %d seconds" % (", ".join(indices), time.time() - start_time))
+
+    def prune_snapshots(self, repository, keep_last=None, max_age_days=None, name_prefix=None):
+        """Deletes snapshots that fall outside the retention policy.
+
+        Args:
+            repository (str): snapshot repository name
+            keep_last (int): always keep this many of the most recent snapshots
+            max_age_days (float): delete snapshots older than this
+            name_prefix (str): only consider snapshots whose names start with this prefix
+        Returns:
+            list: names of the deleted snapshots
+        """
+
+        to_delete = _select_snapshots_to_prune(
+            self.list_snapshots(repository), keep_last=keep_last, max_age_days=max_age_days, name_prefix=name_prefix)
+
+        for snapshot_name in to_delete:
+            logger.info("==> deleting snapshot %s" % snapshot_name)
+            self.es.snapshot.delete(repository=repository, snapshot=snapshot_name, request_timeout=600)
+            self._record_operation("delete_snapshot", snapshot_name, repository=repository)
+
+        return to_delete
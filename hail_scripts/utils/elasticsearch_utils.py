@@ -1,6 +1,9 @@
 import hail as hl
 import logging
 
+from utils.elasticsearch_utils_shared import optimize_elasticsearch_schema
+from utils.variant_id import get_expr_for_xpos
+
 logger = logging.getLogger()
 
 
@@ -15,6 +18,21 @@ HAIL_TYPE_TO_ES_TYPE_MAPPING = {
     hl.tbool: "boolean",
 }
 
+# range types for intervals, by the type of the interval end points (loci are exported as xpos)
+HAIL_TYPE_TO_ES_RANGE_TYPE_MAPPING = {
+    hl.tint32: "integer_range",
+    hl.tint64: "long_range",
+    hl.tfloat32: "float_range",
+    hl.tfloat64: "double_range",
+}
+
+# id field of documents exported from a child table - see child_table_for_array_field(..)
+CHILD_DOCUMENT_ID_FIELD = "child_id"
+
+
+def _interval_point_type(dtype):
+    return hl.tint64 if isinstance(dtype.point_type, hl.tlocus) else dtype.point_type
+
 
 # https://hail.is/docs/devel/types.html
 # https://www.elastic.co/guide/en/elasticsearch/reference/current/mapping-types.html
@@ -26,14 +44,93 @@ def _elasticsearch_mapping_for_type(dtype):
         if isinstance(dtype.element_type, hl.tstruct):
             element_mapping["type"] = "nested"
         return element_mapping
+    if isinstance(dtype, hl.tdict):
+        # exported as an array of {key, value} objects - see get_expr_for_elasticsearch_export(..). These are
+        # nested so that a nested query can look up the value for a given key (eg. a gene id's consequence).
+        return {"type": "nested", "properties": {
+            "key": _elasticsearch_mapping_for_type(dtype.key_type),
+            "value": _elasticsearch_mapping_for_type(dtype.value_type),
+        }}
+    if isinstance(dtype, hl.tlocus):
+        # exported as xpos
+        return {"type": "long"}
+    if isinstance(dtype, hl.tinterval) and _interval_point_type(dtype) in HAIL_TYPE_TO_ES_RANGE_TYPE_MAPPING:
+        return {"type": HAIL_TYPE_TO_ES_RANGE_TYPE_MAPPING[_interval_point_type(dtype)]}
     if dtype in HAIL_TYPE_TO_ES_TYPE_MAPPING:
         return {"type": HAIL_TYPE_TO_ES_TYPE_MAPPING[dtype]}
 
-    # tdict, ttuple, tlocus, tinterval, tcall
+    # ttuple, tcall
     raise NotImplementedError
 
 
-def elasticsearch_schema_for_table(table, disable_doc_values_for_fields=(), disable_index_for_fields=()):
+def _needs_export_conversion(dtype):
+    if isinstance(dtype, (hl.tlocus, hl.tinterval, hl.tdict)):
+        return True
+    if isinstance(dtype, hl.tstruct):
+        return any(_needs_export_conversion(dtype[field]) for field in dtype.fields)
+    if isinstance(dtype, (hl.tarray, hl.tset)):
+        return _needs_export_conversion(dtype.element_type)
+
+    return False
+
+
+def get_expr_for_elasticsearch_export(expr):
+    """Converts an expression into the form that matches its _elasticsearch_mapping_for_type(..) mapping:
+    loci become xpos, intervals become {gte, lte} range objects, and dicts become arrays of {key, value} structs.
+    Expressions that don't contain any of these types are returned as is.
+
+    Intervals with open integer or locus end points are converted to the equivalent closed range. Open
+    floating-point end points are treated as closed.
+    """
+
+    dtype = expr.dtype
+    if not _needs_export_conversion(dtype):
+        return expr
+
+    if isinstance(dtype, hl.tlocus):
+        return get_expr_for_xpos(expr)
+    if isinstance(dtype, hl.tinterval):
+        start = get_expr_for_elasticsearch_export(expr.start)
+        end = get_expr_for_elasticsearch_export(expr.end)
+        if _interval_point_type(dtype) in (hl.tint32, hl.tint64):
+            start = hl.cond(expr.includes_start, start, start + 1)
+            end = hl.cond(expr.includes_end, end, end - 1)
+        return hl.struct(gte=start, lte=end)
+    if isinstance(dtype, hl.tdict):
+        return hl.array(expr).map(lambda item: hl.struct(
+            key=get_expr_for_elasticsearch_export(item[0]), value=get_expr_for_elasticsearch_export(item[1])))
+    if isinstance(dtype, hl.tstruct):
+        return hl.struct(**{field: get_expr_for_elasticsearch_export(expr[field]) for field in dtype.fields})
+
+    # tarray or tset
+    return hl.array(expr).map(get_expr_for_elasticsearch_export)
+
+
+def convert_table_for_elasticsearch_export(table):
+    """Converts all row fields with locus, interval or dict types (see get_expr_for_elasticsearch_export(..)).
+    The elasticsearch schema should be generated from the original table.
+    """
+
+    converted_fields = {
+        field: get_expr_for_elasticsearch_export(table[field])
+        for field in table.row_value.dtype.fields
+        if _needs_export_conversion(table[field].dtype)
+    }
+    if converted_fields:
+        logger.info("==> converting %s for export", ", ".join(converted_fields))
+        table = table.annotate(**converted_fields)
+
+    return table
+
+
+def elasticsearch_schema_for_table(
+    table,
+    disable_doc_values_for_fields=(),
+    disable_index_for_fields=(),
+    optimize_mapping=False,
+    mapping_field_hints=None,
+    nested_fields=(),
+):
     """
     Converts the type of a table's row values into a dictionary that can be plugged in to
     an elasticsearch mapping definition.
@@ -46,12 +143,20 @@ def elasticsearch_schema_for_table(table, disable_doc_values_for_fields=(), disa
         disable_index_for_fields: (optional) list of field names (the way they will be
             named in the elasticsearch index) that shouldn't be indexed
             (see https://www.elastic.co/guide/en/elasticsearch/reference/current/mapping-params.html)
+        optimize_mapping: (optional) whether to replace default types with compact ones - see
+            optimize_elasticsearch_schema(..)
+        mapping_field_hints: (optional) dict of field path regexps to mapping hints for optimize_elasticsearch_schema(..)
+        nested_fields: (optional) paths of arrays of structs that need to stay "nested" when optimizing
     Returns:
         A dict that can be plugged in to an elasticsearch mapping as the value for "properties".
         (see https://www.elastic.co/guide/en/elasticsearch/guide/current/root-object.html)
     """
     properties = _elasticsearch_mapping_for_type(table.row_value.dtype)["properties"]
 
+    if optimize_mapping or mapping_field_hints:
+        properties = optimize_elasticsearch_schema(
+            properties, field_hints=mapping_field_hints, infer_hints=optimize_mapping, nested_fields=nested_fields)
+
     if disable_doc_values_for_fields:
         logger.info("==> will disable doc values for %s", ", ".join(disable_doc_values_for_fields))
         for es_field_name in disable_doc_values_for_fields:
@@ -73,3 +178,54 @@ def elasticsearch_schema_for_table(table, disable_doc_values_for_fields=(), disa
             properties[es_field_name]["index"] = False
 
     return properties
+
+
+def child_table_for_array_field(table, array_field, child_key_field, parent_id_field="variant_id"):
+    """Turns each element of an array of structs into a separate row, so that it can be exported as a child document
+    instead of a nested object (see the child_table arg of ElasticsearchClient.export_table_to_elasticsearch).
+
+    Args:
+        table (hail.Table): the parent table
+        array_field (str): name of an array<struct> field in table, eg. "sortedTranscriptConsequences"
+        child_key_field (str): field that identifies an element within its array, eg. "transcript_id". Child ids
+            don't depend on the order of the array, so a re-exported child replaces the same document.
+        parent_id_field (str): field that identifies the parent document. It's copied to every child row.
+    Returns:
+        hail.Table: unkeyed table with the fields of the array elements, parent_id_field and CHILD_DOCUMENT_ID_FIELD
+            (the parent id followed by the element's child_key_field)
+    """
+
+    children = table.key_by()
+    children = children.select(parent_id_field, _child=children[array_field])
+    children = children.explode("_child")
+
+    child = children._child
+    child_fields = {field: child[field] for field in child.dtype.fields}
+    child_fields[parent_id_field] = children[parent_id_field]
+    child_fields[CHILD_DOCUMENT_ID_FIELD] = children[parent_id_field] + "-" + hl.str(child[child_key_field])
+
+    return children.select(**child_fields)
+
+
+def get_table_for_contig(table, contig):
+    """Returns the rows of one contig with filter_intervals(..), so that only the partitions with that contig are read.
+
+    Args:
+        table (hail.Table): table keyed by locus, or by a contig name field
+        contig (str): contig name, eg. "1" or "X"
+    Returns:
+        hail.Table: the rows of table on contig
+    """
+
+    key_field = table.key[0]
+    if isinstance(key_field.dtype, hl.tlocus):
+        reference_genome = key_field.dtype.reference_genome
+        interval = hl.interval(
+            hl.locus(contig, 1, reference_genome),
+            hl.locus(contig, reference_genome.lengths[contig], reference_genome),
+            includes_end=True,
+        )
+    else:
+        interval = hl.interval(contig, contig, includes_end=True)
+
+    return hl.filter_intervals(table, [interval])
@@ -1,3 +1,5 @@
+import logging
+import re
 import sys
 
 if sys.version_info[0] < 3:
@@ -5,6 +7,8 @@ if sys.version_info[0] < 3:
 else:
     from io import StringIO
 
+logger = logging.getLogger()
+
 
 # Elastic search write operations.
 # See https://www.elastic.co/guide/en/elasticsearch/hadoop/current/configuration.html#_operation
@@ -83,3 +87,141 @@ def _decode_field_name(field_name):
                 i += 1
 
     return original_string.getvalue()
+
+
+# Compact mapping types. Allele frequencies are stored as longs scaled by this factor, which keeps ~0.1% relative
+# precision down to AF = 1e-5 while compressing much better than doubles.
+AF_SCALING_FACTOR = 10**8
+
+ES_MAPPING_HINTS = {
+    "frequency": {"type": "scaled_float", "scaling_factor": AF_SCALING_FACTOR},
+    "float": {"type": "float"},
+    "half_float": {"type": "half_float"},
+    "count": {"type": "integer"},
+    "display": {"type": "keyword", "index": False},
+}
+
+# field names used to infer hints when none are given. Each regexp is matched against every part of a field's path,
+# so AF_adj.afr is a frequency and AC_adj.afr is a count.
+AF_FIELD_NAME_REGEXP = r"^(AF|faf\d*)(_|$)"
+COUNT_FIELD_NAME_REGEXP = r"^(AC|AN|nhomalt|Hom|Hemi)(_|$)|^(n|num)_|_count$"
+DISPLAY_FIELD_NAME_REGEXP = r"(?i).*json$"
+
+
+def _infer_mapping_hint(field_path, field_spec):
+    """Guesses a compact mapping hint for a leaf field from its name and default elasticsearch type"""
+
+    field_type = field_spec.get("type")
+    path_parts = field_path.split(".")
+    if field_type in ("double", "float"):
+        if any(re.match(AF_FIELD_NAME_REGEXP, part) for part in path_parts):
+            return "frequency"
+        return "float"
+    if field_type == "long" and any(re.match(COUNT_FIELD_NAME_REGEXP, part) for part in path_parts):
+        return "count"
+    if field_type == "keyword" and re.match(DISPLAY_FIELD_NAME_REGEXP, path_parts[-1]):
+        return "display"
+
+    return None
+
+
+def _is_dict_mapping(field_spec):
+    """Whether a mapping is for a hail dict, which is exported as a nested array of {key, value} objects"""
+
+    return field_spec.get("type") == "nested" and set(field_spec.get("properties", {})) == {"key", "value"}
+
+
+def optimize_elasticsearch_schema(properties, field_hints=None, infer_hints=True, nested_fields=()):
+    """Replaces default mapping types with more compact ones to shrink the index and speed up ingest and aggregations.
+
+    This is lossy: doubles that aren't AF fields are stored as 32-bit floats, whatever their precision. Arrays of
+    {key, value} objects exported from dicts always stay "nested", since as "object" the keys and values of different
+    entries would match each other.
+
+    Args:
+        properties (dict): elasticsearch "properties" as returned by elasticsearch_schema_for_table(..)
+        field_hints (dict): (optional) maps field path regexps (eg. "AF_adj\\..*" - nested fields are separated by
+            ".") to either a key in ES_MAPPING_HINTS, "object" or "nested" for arrays of structs, "keep" to leave the
+            field as is, or a dict with an explicit field spec. Hints take precedence over inferred types, but not over
+            dict mappings.
+        infer_hints (bool): whether to guess hints for fields without one - scaled_float for AF fields, float for
+            other doubles, integer for long counts and index: false for serialized JSON strings. Arrays of structs
+            become "object" unless they're listed in nested_fields.
+        nested_fields (list): paths of arrays of structs that are queried with nested queries and must stay "nested"
+    Returns:
+        dict: the optimized copy of properties
+    """
+
+    field_hints = field_hints or {}
+
+    def get_hint(field_path, field_spec):
+        if _is_dict_mapping(field_spec):
+            return "nested"
+
+        for field_path_regexp, hint in field_hints.items():
+            if re.match(field_path_regexp + "$", field_path):
+                return hint
+
+        if field_path in nested_fields:
+            return "nested"
+
+        if not infer_hints:
+            return None
+
+        if field_spec.get("type") == "nested":
+            return "object"
+
+        return _infer_mapping_hint(field_path, field_spec)
+
+    def optimize(properties, path_prefix):
+        optimized_properties = {}
+        for field_name, field_spec in properties.items():
+            field_path = path_prefix + field_name
+            field_spec = dict(field_spec)
+            hint = get_hint(field_path, field_spec)
+
+            if "properties" in field_spec:
+                field_spec["properties"] = optimize(field_spec["properties"], field_path + ".")
+                if hint == "nested":
+                    field_spec["type"] = "nested"
+                elif hint == "object":
+                    field_spec.pop("type", None)
+            elif isinstance(hint, dict):
+                field_spec = hint
+            elif hint in ES_MAPPING_HINTS:
+                field_spec.update(ES_MAPPING_HINTS[hint])
+            elif hint not in (None, "keep"):
+                raise ValueError("Unexpected mapping hint for %s: %s" % (field_path, hint))
+
+            if field_spec != properties[field_name] and "properties" not in field_spec:
+                logger.info("Mapping %s as %s", field_path, field_spec)
+
+            optimized_properties[field_name] = field_spec
+
+        return optimized_properties
+
+    return optimize(properties, "")
+
+
+def get_new_elasticsearch_fields(existing_properties, properties):
+    """Returns the part of an elasticsearch "properties" dict that isn't in the existing mapping yet.
+
+    Args:
+        existing_properties (dict): "properties" of the live mapping
+        properties (dict): "properties" generated for the data that's about to be exported
+    Returns:
+        dict: "properties" with only the new fields. Objects that gained new sub-fields are included with just those
+            sub-fields, along with their other settings (eg. "type": "nested") so put_mapping accepts them.
+    """
+
+    new_properties = {}
+    for field_name, field_spec in properties.items():
+        if field_name not in existing_properties:
+            new_properties[field_name] = field_spec
+        elif "properties" in field_spec:
+            new_sub_properties = get_new_elasticsearch_fields(
+                existing_properties[field_name].get("properties", {}), field_spec["properties"])
+            if new_sub_properties:
+                new_properties[field_name] = dict(field_spec, properties=new_sub_properties)
+
+    return new_properties
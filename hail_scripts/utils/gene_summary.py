@@ -0,0 +1,78 @@
+import hail as hl
+
+from utils.flags import get_expr_for_consequence_lc_lof_flag, get_expr_for_consequence_loftee_flag_flag
+from utils.vep import get_expr_for_vep_sorted_transcript_consequences_array, get_expr_for_vep_worst_consequence_per_gene
+
+
+CONSEQUENCE_CATEGORIES = ["lof", "missense", "synonymous", "other"]
+
+
+def get_expr_for_plof_consequence(csq):
+    """A transcript consequence is counted as pLoF if it's in the "lof" category and LOFTEE didn't mark it as low
+    confidence or flag it.
+    """
+
+    return (
+        (csq.category == "lof")
+        & ~get_expr_for_consequence_lc_lof_flag(csq)
+        & ~get_expr_for_consequence_loftee_flag_flag(csq)
+    )
+
+
+def get_gene_summary_table(ht, populations, af_field="AF_adj"):
+    """Groups a prepared variant table by gene, so that a gene page can fetch one summary document instead of
+    aggregating over all the gene's variant documents.
+
+    Each variant is counted once per gene, with the consequence of its worst transcript in that gene.
+
+    Args:
+        ht (Table): variant table with variant_id, xpos, a per-population AF struct and either
+            sortedTranscriptConsequences or vep
+        populations (list): populations to compute cumulative pLoF AF for
+        af_field (str): name of the struct with per-population allele frequencies
+    Returns:
+        Table: keyed by gene_id, with
+            gene_symbol
+            n_variants: number of variants in the gene
+            n_variants_by_category: struct of counts for each of CONSEQUENCE_CATEGORIES
+            n_lof_variants_by_flag: struct with counts of lof-category variants that are pLoF, lc_lof or lof_flag
+            plof_caf: struct of cumulative allele frequencies of pLoF variants by population
+            variant_ids: ids of the gene's variants, sorted by position
+    """
+
+    if "sortedTranscriptConsequences" in ht.row.dtype.fields:
+        sorted_transcript_consequences = ht.sortedTranscriptConsequences
+    else:
+        sorted_transcript_consequences = get_expr_for_vep_sorted_transcript_consequences_array(vep_root=ht.vep)
+
+    populations = [pop for pop in populations if pop in ht[af_field].dtype.fields]
+
+    variants = ht.select(
+        variant_id=ht.variant_id,
+        xpos=ht.xpos,
+        pop_af=ht[af_field].select(*populations),
+        gene_csq=get_expr_for_vep_worst_consequence_per_gene(sorted_transcript_consequences),
+    )
+    variants = variants.explode(variants.gene_csq)
+
+    is_plof = get_expr_for_plof_consequence(variants.gene_csq)
+    is_lof_category = variants.gene_csq.category == "lof"
+
+    genes = variants.group_by(gene_id=variants.gene_csq.gene_id).aggregate(
+        gene_symbol=hl.agg.take(variants.gene_csq.gene_symbol, 1)[0],
+        n_variants=hl.agg.count(),
+        n_variants_by_category=hl.struct(**{
+            category: hl.agg.count_where(variants.gene_csq.category == category) for category in CONSEQUENCE_CATEGORIES
+        }),
+        n_lof_variants_by_flag=hl.struct(
+            plof=hl.agg.count_where(is_plof),
+            lc_lof=hl.agg.count_where(is_lof_category & get_expr_for_consequence_lc_lof_flag(variants.gene_csq)),
+            lof_flag=hl.agg.count_where(is_lof_category & get_expr_for_consequence_loftee_flag_flag(variants.gene_csq)),
+        ),
+        plof_caf=hl.struct(**{
+            pop: hl.agg.filter(is_plof, hl.agg.sum(hl.or_else(variants.pop_af[pop], 0.0))) for pop in populations
+        }),
+        variant_ids=hl.agg.collect(hl.tuple([variants.xpos, variants.variant_id])),
+    )
+
+    return genes.annotate(variant_ids=hl.sorted(genes.variant_ids).map(lambda xpos_and_id: xpos_and_id[1]))
@@ -0,0 +1,221 @@
+import atexit
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import elasticsearch.helpers
+
+logger = logging.getLogger()
+
+
+INDEX_OPERATIONS_LOG = "index_operations_log"
+INDEX_OPERATIONS_LOG_DOC_TYPE = "log"
+
+DEFAULT_JOURNAL_PATH = os.environ.get(
+    "INDEX_OPERATIONS_JOURNAL", os.path.join(os.path.expanduser("~"), ".index_operations_journal.jsonl"))
+
+INDEX_OPERATIONS_LOG_SCHEMA = {
+    "operation_id": {"type": "keyword"},
+    "timestamp": {"type": "keyword"},
+    "operation": {"type": "keyword"},
+    "index_name": {"type": "keyword"},
+    "status": {"type": "keyword"},
+    "duration_seconds": {"type": "float"},
+    "params": {"type": "object", "enabled": False},  # only for display
+    "metrics": {"type": "keyword", "index": False, "doc_values": False},  # json summary, only for display
+}
+
+
+class IndexOperationsJournal:
+    """Append-only local log of index operations (exports, snapshots, alias changes, ..) that's flushed to the
+    index_operations_log index in batches.
+
+    Entries are written as one json object per line, so the journal can be queried offline with entries(..) or
+    tools like jq even if they never made it to elasticsearch. The number of bytes that have been flushed is kept
+    in a "<path>.flushed" file next to the journal, so entries left over from a run that couldn't reach the cluster
+    are sent by the next flush.
+    """
+
+    def __init__(self, path=DEFAULT_JOURNAL_PATH, flush_batch_size=50):
+        """Constructor.
+
+        Args:
+            path (str): local path of the journal file
+            flush_batch_size (int): flush(..) only sends entries once at least this many are waiting, unless forced
+        """
+
+        self.path = path
+        self.flushed_offset_path = path + ".flushed"
+        self.flush_batch_size = flush_batch_size
+        self._lock = threading.Lock()
+        self._mapping_checked = False
+        self._exit_es = None
+        self._num_unflushed = len(self._read_unflushed_entries()[0])
+
+    def record(self, operation, index_name=None, status="success", start_time=None, metrics=None, **params):
+        """Appends an operation to the journal.
+
+        Args:
+            operation (str): operation name, eg. "export_table" or "create_snapshot"
+            index_name (str): index (or snapshot, or alias) the operation was applied to
+            status (str): operation status
+            start_time (float): (optional) time.time() when the operation started, used to record its duration
+            metrics (str): (optional) json summary of the operation, eg. export throughput
+            params: any other parameters of the operation. Values must be json-serializable.
+        Returns:
+            dict: the recorded entry
+        """
+
+        entry = {
+            "operation_id": uuid.uuid4().hex,
+            "timestamp": datetime.datetime.now().strftime("%Y%m%d-%H%M%S"),
+            "operation": operation,
+            "index_name": index_name,
+            "status": status,
+            "duration_seconds": round(time.time() - start_time, 3) if start_time is not None else None,
+            "params": params,
+            "metrics": metrics,
+        }
+
+        line = json.dumps(entry, sort_keys=True, default=str) + "\n"
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(line)
+            self._num_unflushed += 1
+
+        logger.info("Recorded index operation: " + line.strip())
+
+        return entry
+
+    def entries(self, operation=None, index_name=None, status=None, since=None):
+        """Reads entries from the local journal, oldest first.
+
+        Args:
+            operation (str): only return entries for this operation
+            index_name (str): only return entries for this index
+            status (str): only return entries with this status
+            since (str): only return entries with a timestamp >= this "%Y%m%d-%H%M%S" string
+        Returns:
+            list: matching entries
+        """
+
+        if not os.path.isfile(self.path):
+            return []
+
+        with open(self.path) as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+
+        return [
+            e for e in entries
+            if (operation is None or e["operation"] == operation)
+            and (index_name is None or e["index_name"] == index_name)
+            and (status is None or e["status"] == status)
+            and (since is None or e["timestamp"] >= since)
+        ]
+
+    def flush_at_exit(self, es):
+        """Flushes any remaining entries through this client when the process exits"""
+
+        if self._exit_es is None:
+            atexit.register(self._flush_at_exit)
+        self._exit_es = es
+
+    def _flush_at_exit(self):
+        try:
+            self.flush(self._exit_es, force=True)
+        except Exception as e:
+            logger.warning("Couldn't flush index operations journal %s, will retry next time: %s", self.path, e)
+
+    @property
+    def num_unflushed(self):
+        return self._num_unflushed
+
+    def _read_unflushed_entries(self):
+        """Returns the entries that haven't been flushed yet, and the journal offset just after them"""
+
+        flushed_offset = 0
+        if os.path.isfile(self.flushed_offset_path):
+            with open(self.flushed_offset_path) as f:
+                flushed_offset = int(f.read().strip() or 0)
+
+        if not os.path.isfile(self.path):
+            return [], flushed_offset
+
+        with open(self.path) as f:
+            f.seek(flushed_offset)
+            data = f.read()
+
+        # ignore a trailing partial line from a concurrent writer
+        complete_data = data[:data.rfind("\n") + 1]
+        entries = [json.loads(line) for line in complete_data.splitlines() if line.strip()]
+
+        return entries, flushed_offset + len(complete_data.encode("utf-8"))
+
+    def _mark_flushed(self, offset):
+        temp_path = self.flushed_offset_path + ".tmp"
+        with open(temp_path, "w") as f:
+            f.write(str(offset))
+        os.replace(temp_path, self.flushed_offset_path)
+
+    def flush(self, es, force=False):
+        """Sends unflushed entries to the index_operations_log index in one bulk request.
+
+        The mapping is only created or updated by the first flush. Entries are indexed by their operation_id, so
+        re-sending them after a failed flush doesn't create duplicates.
+
+        Args:
+            es (Elasticsearch): elasticsearch client
+            force (bool): flush even if there are fewer than flush_batch_size entries waiting
+        Returns:
+            int: number of entries sent
+        """
+
+        with self._lock:
+            if not self._num_unflushed or (not force and self._num_unflushed < self.flush_batch_size):
+                return 0
+
+            entries, offset = self._read_unflushed_entries()
+
+            if not self._mapping_checked:
+                index_mapping = {"properties": INDEX_OPERATIONS_LOG_SCHEMA}
+                if not es.indices.exists(index=INDEX_OPERATIONS_LOG):
+                    es.indices.create(
+                        index=INDEX_OPERATIONS_LOG, body={"mappings": {INDEX_OPERATIONS_LOG_DOC_TYPE: index_mapping}})
+                else:
+                    es.indices.put_mapping(
+                        index=INDEX_OPERATIONS_LOG, doc_type=INDEX_OPERATIONS_LOG_DOC_TYPE, body=index_mapping)
+                self._mapping_checked = True
+
+            elasticsearch.helpers.bulk(es, [{
+                "_index": INDEX_OPERATIONS_LOG,
+                "_type": INDEX_OPERATIONS_LOG_DOC_TYPE,
+                "_id": entry["operation_id"],
+                "_source": entry,
+            } for entry in entries])
+
+            self._mark_flushed(offset)
+            self._num_unflushed = 0
+
+        logger.info("==> flushed %d index operations to %s" % (len(entries), INDEX_OPERATIONS_LOG))
+
+        return len(entries)
+
+
+# one journal per path, so that clients in the same process don't flush the same entries twice
+_JOURNALS = {}
+_JOURNALS_LOCK = threading.Lock()
+
+
+def get_index_operations_journal(path=DEFAULT_JOURNAL_PATH):
+    """Returns the shared IndexOperationsJournal for the given path"""
+
+    path = os.path.abspath(path)
+    with _JOURNALS_LOCK:
+        if path not in _JOURNALS:
+            _JOURNALS[path] = IndexOperationsJournal(path)
+
+        return _JOURNALS[path]
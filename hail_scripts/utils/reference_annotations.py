@@ -0,0 +1,197 @@
+import logging
+
+import hail as hl
+
+from utils.annotation_cache import AnnotationCache, get_config_hash, get_dict_hash
+
+logger = logging.getLogger()
+
+
+# reference tables with up to this many rows are collected and sent to every worker as a literal dict instead of
+# being joined, so annotating a variant is a local lookup instead of a shuffle
+BROADCAST_MAX_ROWS = 100000
+
+CLINVAR_FIELDS = ["allele_id", "clinical_significance", "gold_stars", "review_status"]
+
+CONSTRAINT_FIELDS = ["pLI", "oe_lof", "oe_lof_upper", "oe_mis", "oe_syn", "lof_z", "mis_z", "syn_z"]
+
+
+def get_reference_table_version(ht_path):
+    """Returns the version global of a reference table, or the modification time of the table if it doesn't have one"""
+
+    ht = hl.read_table(ht_path)
+    if "version" in ht.globals.dtype.fields:
+        return str(hl.eval(ht.globals.version))
+
+    return str(hl.hadoop_stat("%s/metadata.json.gz" % ht_path)["modification_time"])
+
+
+def _select_reference_fields(ref_ht, fields):
+    if fields is None:
+        return ref_ht.select(*[field for field in ref_ht.row_value.dtype.fields])
+
+    return ref_ht.select(*[field for field in fields if field in ref_ht.row_value.dtype.fields])
+
+
+def _get_broadcast_dict(ref_ht):
+    """Collects a table with a single key field into a literal dict of key to row value"""
+
+    key_field = list(ref_ht.key)[0]
+    rows = ref_ht.collect()
+    row_value_fields = list(ref_ht.row_value.dtype.fields)
+
+    return hl.literal(
+        {row[key_field]: hl.Struct(**{field: row[field] for field in row_value_fields}) for row in rows},
+        dtype=hl.tdict(ref_ht.key.dtype[key_field], ref_ht.row_value.dtype),
+    )
+
+
+def get_expr_for_variant_reference_annotation(ht, ref_ht, fields=None, broadcast_max_rows=BROADCAST_MAX_ROWS):
+    """Looks up each variant of ht in a reference table keyed by the same fields (eg. ClinVar by locus and alleles).
+
+    Args:
+        ht (Table): variant table
+        ref_ht (Table): reference table with the same key as ht
+        fields (list): reference fields to keep. Defaults to all.
+        broadcast_max_rows (int): broadcast the reference table if it has at most this many rows
+    Returns:
+        StructExpression: the reference fields, or missing if the variant isn't in the reference table
+    """
+
+    ref_ht = _select_reference_fields(ref_ht, fields)
+
+    if len(ref_ht.key) == 1 and ref_ht.count() <= broadcast_max_rows:
+        return _get_broadcast_dict(ref_ht).get(ht[list(ht.key)[0]])
+
+    return ref_ht[ht.key]
+
+
+def annotate_with_transcript_reference_table(
+    ht, annotation_field, transcript_ids, ref_ht, fields=None, broadcast_max_rows=BROADCAST_MAX_ROWS,
+):
+    """Adds an array with the rows of ref_ht (eg. gnomAD constraint or GTEx) for each of a variant's transcripts.
+
+    Args:
+        ht (Table): variant table
+        annotation_field (str): name of the array field to add
+        transcript_ids (SetExpression): the variant's transcript ids, eg. from its VEP transcript consequences
+        ref_ht (Table): reference table keyed by transcript id
+        fields (list): reference fields to keep. Defaults to all.
+        broadcast_max_rows (int): broadcast the reference table if it has at most this many rows. Bigger tables are
+            joined by exploding the transcripts and collecting them back per variant.
+    Returns:
+        Table: ht with annotation_field - an array of the reference rows, each with a transcript_id field
+    """
+
+    ref_ht = _select_reference_fields(ref_ht, fields)
+    ref_ht = ref_ht.drop(*[field for field in ["transcript_id"] if field in ref_ht.row_value.dtype.fields])
+
+    if ref_ht.count() <= broadcast_max_rows:
+        ref_dict = _get_broadcast_dict(ref_ht)
+        return ht.annotate(**{annotation_field: hl.array(transcript_ids).filter(
+            lambda transcript_id: ref_dict.contains(transcript_id)
+        ).map(
+            lambda transcript_id: ref_dict[transcript_id].annotate(transcript_id=transcript_id)
+        )})
+
+    logger.info("==> %s: reference table is too big to broadcast. Joining by transcript instead", annotation_field)
+
+    transcripts = ht.select(transcript_id=hl.array(transcript_ids)).explode("transcript_id")
+    transcripts = transcripts.annotate(ref=ref_ht[transcripts.transcript_id])
+    transcripts = transcripts.filter(hl.is_defined(transcripts.ref))
+    transcripts = transcripts.group_by(*ht.key).aggregate(
+        values=hl.agg.collect(transcripts.ref.annotate(transcript_id=transcripts.transcript_id))
+    )
+
+    return ht.annotate(**{annotation_field: hl.or_else(
+        transcripts[ht.key].values, hl.empty_array(transcripts.values.dtype.element_type)
+    )})
+
+
+def annotate_with_reference_tables(
+    ht,
+    cache_root,
+    clinvar_path=None,
+    constraint_path=None,
+    gtex_path=None,
+    vep_config_path=None,
+    broadcast_max_rows=BROADCAST_MAX_ROWS,
+):
+    """Denormalizes ClinVar, gnomAD constraint and GTEx into the variant table, so a variant page can be served
+    from a single document.
+
+    Adds these fields for the reference tables that are given:
+        clinvar: CLINVAR_FIELDS of the ClinVar record with the same locus and alleles
+        transcript_constraint: CONSTRAINT_FIELDS for each of the variant's VEP transcripts
+        transcript_gtex: GTEx median TPMs by tissue for each of the variant's VEP transcripts
+
+    Results are cached by variant under a hash of the reference table versions (see get_reference_table_version(..))
+    and, for the transcript annotations, of the VEP config that produced the transcripts. So only variants that
+    weren't annotated with the same reference versions and VEP config before are looked up.
+
+    Args:
+        ht (Table): variant table keyed by locus and alleles, with a vep field if constraint_path or gtex_path are set
+        cache_root (str): directory where annotation caches are kept
+        clinvar_path (str): ClinVar table keyed by locus and alleles, as written by populate_clinvar.py
+        constraint_path (str): gnomAD constraint table keyed by transcript id
+        gtex_path (str): GTEx table keyed by transcript id
+        vep_config_path (str): VEP config that ht's vep field was computed with. Required with constraint_path or
+            gtex_path.
+        broadcast_max_rows (int): reference tables with at most this many rows are broadcast instead of joined
+    Returns:
+        Table: ht with the reference annotation fields
+    """
+
+    reference_paths = {"clinvar": clinvar_path, "constraint": constraint_path, "gtex": gtex_path}
+    reference_paths = {name: path for name, path in reference_paths.items() if path}
+    if not reference_paths:
+        return ht
+
+    has_transcript_annotations = "constraint" in reference_paths or "gtex" in reference_paths
+    if has_transcript_annotations:
+        if "vep" not in ht.row.dtype.fields:
+            raise ValueError("Constraint and GTEx annotations are joined by VEP transcript id, but ht has no vep field")
+        if not vep_config_path:
+            raise ValueError("Constraint and GTEx annotations depend on the VEP transcripts, so vep_config_path is "
+                             "needed to tell when the cached annotations are out of date")
+
+    reference_versions = {
+        name: {"path": path, "version": get_reference_table_version(path)} for name, path in reference_paths.items()
+    }
+
+    # a different VEP config can give a variant different transcripts
+    if has_transcript_annotations:
+        reference_versions["vep"] = {"path": vep_config_path, "version": get_config_hash(vep_config_path)}
+    logger.info("==> reference table versions: %s", reference_versions)
+
+    cache = AnnotationCache(cache_root, "reference_annotations", get_dict_hash(reference_versions))
+
+    def annotate_func(variants):
+        annotations = []
+
+        if "clinvar" in reference_paths:
+            variants = variants.annotate(clinvar=get_expr_for_variant_reference_annotation(
+                variants, hl.read_table(clinvar_path), fields=CLINVAR_FIELDS, broadcast_max_rows=broadcast_max_rows))
+            annotations.append("clinvar")
+
+        if "constraint" in reference_paths or "gtex" in reference_paths:
+            variants = variants.annotate(transcript_ids=hl.set(
+                ht[variants.key].vep.transcript_consequences.map(lambda c: c.transcript_id)))
+
+        if "constraint" in reference_paths:
+            variants = annotate_with_transcript_reference_table(
+                variants, "transcript_constraint", variants.transcript_ids, hl.read_table(constraint_path),
+                fields=CONSTRAINT_FIELDS, broadcast_max_rows=broadcast_max_rows)
+            annotations.append("transcript_constraint")
+
+        if "gtex" in reference_paths:
+            variants = annotate_with_transcript_reference_table(
+                variants, "transcript_gtex", variants.transcript_ids, hl.read_table(gtex_path),
+                broadcast_max_rows=broadcast_max_rows)
+            annotations.append("transcript_gtex")
+
+        return variants.select(reference_annotations=hl.struct(**{field: variants[field] for field in annotations}))
+
+    ht = cache.annotate(ht, "reference_annotations", annotate_func)
+
+    return ht.annotate(**ht.reference_annotations).drop("reference_annotations")
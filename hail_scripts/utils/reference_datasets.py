@@ -0,0 +1,205 @@
+import gzip
+import logging
+import os
+import re
+
+import hail as hl
+
+from utils.annotation_cache import get_dict_hash
+
+logger = logging.getLogger()
+
+
+# environment variable with the directory of the GTEx source files
+GTEX_DATA_DIR_VARIABLE = "GTEX_DATA_DIR"
+
+DEFAULT_CACHE_ROOT = os.environ.get("REFERENCE_DATASETS_CACHE", "reference_datasets")
+
+
+class ReferenceDataset:
+    """A reference text file (eg. gnomAD constraint or GTEx expression) with an explicit schema.
+
+    Columns that aren't listed in types get default_type, so files with many similar columns (eg. one per GTEx
+    tissue) only need their special columns declared. Nothing is imputed.
+    """
+
+    def __init__(self, name, path, types, key, version, default_type=hl.tstr, import_args=None, data_dir_variable=None):
+        """Constructor.
+
+        Args:
+            name (str): registry name
+            path (str): path of the source file
+            types (dict): column name to hail type
+            key (list): key fields of the converted table
+            version (str): version of the dataset, eg. "2.1.1". Recorded as the version global of the converted table.
+            default_type (HailType): type of columns that aren't in types
+            import_args (dict): other hl.import_table(..) args, eg. {"force_bgz": True}
+            data_dir_variable (str): (optional) environment variable with the directory that path is relative to.
+                See get_data_dir(..).
+        """
+
+        self.name = name
+        self.path = path
+        self.types = types
+        self.key = key
+        self.version = version
+        self.default_type = default_type
+        self.import_args = import_args or {}
+        self.data_dir_variable = data_dir_variable
+
+    def _is_comment(self, line):
+        comments = self.import_args.get("comment", [])
+        if isinstance(comments, str):
+            comments = [comments]
+
+        # like hl.import_table(..), single characters are prefixes and longer strings are regexps
+        return any(line.startswith(c) if len(c) == 1 else re.match(c, line) for c in comments)
+
+    def _read_header(self):
+        with hl.hadoop_open(self.path, "rb") as f:
+            # depending on the filesystem, compressed files may or may not already be decompressed
+            if f.peek(2)[:2] == b"\x1f\x8b":
+                f = gzip.GzipFile(fileobj=f)
+            for line in f:
+                line = line.decode("utf-8").rstrip("\r\n")
+                if not self._is_comment(line):
+                    return line.split(self.import_args.get("delimiter", "\t"))
+
+        raise ValueError("%s has no header line" % self.path)
+
+    def get_types(self):
+        """Returns the type of every column in the source file, based on its header line"""
+
+        return {column: self.types.get(column, self.default_type) for column in self._read_header()}
+
+    def get_fingerprint(self):
+        """Returns a hash of the source file's size and modification time and of this dataset's definition, which
+        changes whenever the converted table would be different.
+        """
+
+        source_stat = hl.hadoop_stat(self.path)
+
+        return get_dict_hash({
+            "path": self.path,
+            "size_bytes": source_stat["size_bytes"],
+            "modification_time": str(source_stat["modification_time"]),
+            "types": {column: str(dtype) for column, dtype in self.types.items()},
+            "default_type": str(self.default_type),
+            "key": self.key,
+            "version": self.version,
+            "import_args": self.import_args,
+        })
+
+    def import_table(self):
+        """Parses the source file with the declared schema"""
+
+        ht = hl.import_table(self.path, types=self.get_types(), key=self.key, **self.import_args)
+
+        return ht.annotate_globals(version=self.version)
+
+
+GNOMAD_CONSTRAINT_FLOAT_COLUMNS = [
+    "exp_lof", "exp_mis", "exp_syn",
+    "oe_lof", "oe_lof_lower", "oe_lof_upper",
+    "oe_mis", "oe_mis_lower", "oe_mis_upper",
+    "oe_syn", "oe_syn_lower", "oe_syn_upper",
+    "lof_z", "mis_z", "syn_z",
+    "pLI", "pNull", "pRec",
+]
+
+GNOMAD_CONSTRAINT_INT_COLUMNS = ["obs_lof", "obs_mis", "obs_syn"]
+
+REFERENCE_DATASETS = {
+    dataset.name: dataset for dataset in [
+        ReferenceDataset(
+            "gnomad_constraint",
+            "constraint_final_cleaned.txt.bgz",
+            types={
+                "gene": hl.tstr,
+                "transcript": hl.tstr,
+                **{column: hl.tfloat64 for column in GNOMAD_CONSTRAINT_FLOAT_COLUMNS},
+                **{column: hl.tint32 for column in GNOMAD_CONSTRAINT_INT_COLUMNS},
+            },
+            key=["transcript"],
+            version="2.1.1",
+            import_args={"delimiter": "\t"},
+        ),
+        ReferenceDataset(
+            "gtex_transcript_tpms",
+            "GTEx_Analysis_2016-01-15_v7_RSEMv1.2.22_transcript_tpm_medians_by_tissue_wo_versions.tsv.gz",
+            types={"transcript_id": hl.tstr, "gene_id": hl.tstr},
+            default_type=hl.tfloat64,
+            key=["transcript_id"],
+            version="v7",
+            import_args={"delimiter": "\t", "force_bgz": True},
+            data_dir_variable=GTEX_DATA_DIR_VARIABLE,
+        ),
+        ReferenceDataset(
+            "gtex_sample_attributes",
+            "GTEx_v7_Annotations_SampleAttributesDS.txt",
+            types={"SAMPID": hl.tstr, "SMTSD": hl.tstr},
+            key=["SAMPID"],
+            version="v7",
+            import_args={"delimiter": "\t"},
+            data_dir_variable=GTEX_DATA_DIR_VARIABLE,
+        ),
+    ]
+}
+
+
+def get_data_dir(variable, data_dir=None):
+    """Returns the directory of a dataset's source files.
+
+    Args:
+        variable (str): environment variable with the directory, eg. GTEX_DATA_DIR_VARIABLE
+        data_dir (str): (optional) directory to use instead of the environment variable, eg. from a command line arg
+    Returns:
+        str: the directory
+    """
+
+    data_dir = data_dir or os.environ.get(variable)
+    if not data_dir:
+        raise ValueError(
+            "The %s environment variable isn't set. Set it, or pass the directory with the source files as an argument"
+            % variable)
+
+    return data_dir
+
+
+def get_reference_dataset(name, path=None, data_dir=None, cache_root=DEFAULT_CACHE_ROOT):
+    """Returns a reference dataset as a native hail table.
+
+    The source is parsed once and written to "<cache_root>/<name>/<fingerprint>.ht". Later calls read that table
+    until the source file or the dataset definition changes (see ReferenceDataset.get_fingerprint()).
+
+    Args:
+        name (str): one of REFERENCE_DATASETS
+        path (str): (optional) source path to use instead of the registered one
+        data_dir (str): (optional) directory of the registered source file, for datasets whose directory is otherwise
+            taken from an environment variable (see get_data_dir(..))
+        cache_root (str): directory for converted tables (local, hdfs or gs://)
+    Returns:
+        Table: keyed by the dataset's key fields, with a version global
+    """
+
+    if name not in REFERENCE_DATASETS:
+        raise ValueError("Unknown reference dataset: %s. Expected one of: %s" % (name, ", ".join(REFERENCE_DATASETS)))
+
+    dataset = REFERENCE_DATASETS[name]
+    if not path and dataset.data_dir_variable:
+        path = os.path.join(get_data_dir(dataset.data_dir_variable, data_dir), dataset.path)
+    if path:
+        dataset = ReferenceDataset(
+            dataset.name, path, dataset.types, dataset.key, dataset.version,
+            default_type=dataset.default_type, import_args=dataset.import_args)
+
+    ht_path = "%s/%s/%s.ht" % (cache_root.rstrip("/"), name, dataset.get_fingerprint())
+
+    # _SUCCESS is written last, so a partially written table is converted again
+    if hl.hadoop_exists("%s/_SUCCESS" % ht_path):
+        logger.info("==> reading %s %s from %s", name, dataset.version, ht_path)
+    else:
+        logger.info("==> converting %s %s from %s to %s", name, dataset.version, dataset.path, ht_path)
+        dataset.import_table().write(ht_path, overwrite=True)
+
+    return hl.read_table(ht_path)
@@ -0,0 +1,110 @@
+import logging
+
+import hail as hl
+
+logger = logging.getLogger()
+
+
+# size of the genomic windows used to find the parts of a reference table that overlap a cohort
+DEFAULT_WINDOW_SIZE = 1000000
+
+REFERENCE_TABLE_KEY = ["locus", "alleles"]
+
+
+def prepare_reference_table(ht, output_path, fields=None, n_partitions=None):
+    """Converts a large per-variant reference source (eg. gnomAD sites or CADD scores) to a hail table keyed by
+    locus and alleles, so that later joins against it don't need to re-key or shuffle it.
+
+    Args:
+        ht (Table): reference table with locus and alleles fields
+        output_path (str): where to write the prepared table
+        fields (list): fields to keep. Defaults to all. Dropping unused fields here makes every later read smaller.
+        n_partitions (int): (optional) number of partitions to write. More partitions means finer-grained
+            filter_intervals(..) reads.
+    Returns:
+        Table: the prepared table
+    """
+
+    if list(ht.key) != REFERENCE_TABLE_KEY:
+        ht = ht.key_by(*REFERENCE_TABLE_KEY)
+
+    if fields is not None:
+        ht = ht.select(*fields)
+
+    if n_partitions:
+        ht = ht.repartition(n_partitions)
+
+    ht.write(output_path, overwrite=True)
+
+    return hl.read_table(output_path)
+
+
+def get_covering_intervals(ht, window_size=DEFAULT_WINDOW_SIZE):
+    """Returns the window_size windows that contain at least one of the loci in ht, with adjacent windows merged.
+
+    Args:
+        ht (Table): table with a locus field
+        window_size (int): window size in base pairs
+    Returns:
+        list: hl.Interval objects of loci
+    """
+
+    reference_genome = ht.locus.dtype.reference_genome
+    windows = ht.aggregate(hl.agg.collect_as_set(hl.tuple([ht.locus.contig, ht.locus.position // window_size])))
+
+    intervals = []
+    for contig, window in sorted(windows, key=lambda w: (reference_genome.contigs.index(w[0]), w[1])):
+        start = window * window_size + 1
+        end = min((window + 1) * window_size, reference_genome.lengths[contig])
+        if intervals and intervals[-1][0] == contig and intervals[-1][2] == start - 1:
+            intervals[-1][2] = end
+        else:
+            intervals.append([contig, start, end])
+
+    return [
+        hl.Interval(hl.Locus(contig, start, reference_genome), hl.Locus(contig, end, reference_genome), includes_end=True)
+        for contig, start, end in intervals
+    ]
+
+
+def is_join_compatible(ht, ref_ht):
+    """Whether ref_ht can be joined to ht in key order, ie. both are keyed by the same locus and alleles types"""
+
+    return (
+        list(ht.key) == REFERENCE_TABLE_KEY
+        and list(ref_ht.key) == REFERENCE_TABLE_KEY
+        and ht.key.dtype == ref_ht.key.dtype
+    )
+
+
+def annotate_with_reference_score_table(ht, ref_ht, annotation_field, fields=None, window_size=DEFAULT_WINDOW_SIZE):
+    """Adds the fields of a large reference table (see prepare_reference_table(..)) to ht as a struct.
+
+    Only the given fields are read, and only the parts of ref_ht that overlap ht's windows (see
+    get_covering_intervals(..)), so a cohort on a few chromosomes doesn't pay for reading the whole reference. When
+    both tables are keyed by locus and alleles the join is an ordered merge join without a shuffle. Otherwise ref_ht
+    is re-keyed first, which shuffles it.
+
+    Args:
+        ht (Table): cohort variant table keyed by locus and alleles
+        ref_ht (Table): reference table
+        annotation_field (str): name of the struct field to add, eg. "gnomad" or "cadd"
+        fields (list): reference fields to add. Defaults to all.
+        window_size (int): window size for get_covering_intervals(..)
+    Returns:
+        Table: ht with annotation_field
+    """
+
+    if fields is not None:
+        ref_ht = ref_ht.select(*fields)
+
+    if not is_join_compatible(ht, ref_ht):
+        logger.warning("==> %s: reference table is keyed by %s, not %s. It will be re-keyed, which shuffles it",
+                       annotation_field, ", ".join(ref_ht.key), ", ".join(REFERENCE_TABLE_KEY))
+        ref_ht = ref_ht.key_by(*REFERENCE_TABLE_KEY)
+
+    intervals = get_covering_intervals(ht, window_size=window_size)
+    logger.info("==> %s: reading %d windows of the reference table", annotation_field, len(intervals))
+    ref_ht = hl.filter_intervals(ref_ht, intervals)
+
+    return ht.annotate(**{annotation_field: ref_ht[ht.key]})
@@ -0,0 +1,35 @@
+# Decoder for documents written with prepare_ht_for_es(.., sparse_frequencies=True). Doesn't depend on hail so it
+# can be used by anything that reads the documents back from elasticsearch.
+
+POPULATIONS_PRESENT_FIELD = "pops_present"
+
+SPARSE_FREQUENCY_FIELDS = ["AC_adj", "AF_adj", "AN_adj", "nhomalt_adj"]
+
+# AF is undefined for populations with no called samples
+UNDEFINED_FOR_ABSENT_POPULATIONS = set(["AF_adj"])
+
+
+def decode_sparse_frequencies(document, populations, fields=SPARSE_FREQUENCY_FIELDS):
+    """Rebuilds the dense per-population frequency structs of a sparse document.
+
+    Args:
+        document (dict): elasticsearch document source, as written by sparsify_freq_fields(..)
+        populations (list): all populations that the dense structs should contain, eg. ["afr", "amr", "eas", ..]
+        fields (list): names of the per-population frequency structs
+    Returns:
+        dict: a copy of the document with dense frequency structs, and without the pops_present field
+    """
+
+    dense_document = dict(document)
+    pops_present = set(dense_document.pop(POPULATIONS_PRESENT_FIELD, None) or [])
+
+    for field in fields:
+        values = document.get(field) or {}
+        dense_document[field] = {}
+        for pop in populations:
+            value = values.get(pop)
+            if value is None and pop not in pops_present and field not in UNDEFINED_FOR_ABSENT_POPULATIONS:
+                value = 0
+            dense_document[field][pop] = value
+
+    return dense_document
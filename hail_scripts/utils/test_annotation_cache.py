@@ -0,0 +1,114 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import hail as hl
+
+from .annotation_cache import AnnotationCache, get_config_hash
+
+
+def annotate_square(ht):
+    return ht.annotate(square=ht.idx * ht.idx)
+
+
+def get_squares(start, end):
+    ht = hl.utils.range_table(end)
+    return annotate_square(ht.filter(ht.idx >= start))
+
+
+class TestGetConfigHash(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _write_config(self, file_name, content):
+        path = os.path.join(self.temp_dir, file_name)
+        with open(path, "w") as f:
+            f.write(content)
+
+        return path
+
+    def test_get_config_hash(self):
+        config_path = self._write_config("a.json", json.dumps({"command": ["vep"], "env": {"PERL5LIB": "/vep"}}))
+        reordered_config_path = self._write_config(
+            "b.json", json.dumps({"env": {"PERL5LIB": "/vep"}, "command": ["vep"]}, indent=4))
+        changed_config_path = self._write_config("c.json", json.dumps({"command": ["vep", "--everything"]}))
+
+        self.assertEqual(len(get_config_hash(config_path)), 16)
+        self.assertEqual(get_config_hash(config_path), get_config_hash(reordered_config_path))
+        self.assertNotEqual(get_config_hash(config_path), get_config_hash(changed_config_path))
+
+
+class TestAnnotationCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = AnnotationCache(self.temp_dir, "square", "v1")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_add_part(self):
+        self.assertListEqual(self.cache.part_paths(), [])
+        self.assertIsNone(self.cache.read())
+
+        first_part_path = self.cache.add_part(get_squares(0, 2))
+        second_part_path = self.cache.add_part(get_squares(2, 4))
+
+        # parts are appended to the manifest, oldest first, even when they're written within the same second
+        self.assertNotEqual(first_part_path, second_part_path)
+        self.assertListEqual(self.cache.part_paths(), [first_part_path, second_part_path])
+        self.assertListEqual(self.cache.read().square.collect(), [0, 1, 4, 9])
+
+        # a different version is a separate cache
+        self.assertListEqual(AnnotationCache(self.temp_dir, "square", "v2").part_paths(), [])
+
+    def test_annotate_only_computes_new_keys(self):
+        annotated_keys = []
+
+        def annotate_func(ht):
+            annotated_keys.append(ht.idx.collect())
+            return annotate_square(ht)
+
+        ht = self.cache.annotate(hl.utils.range_table(3), "square", annotate_func)
+        self.assertListEqual(ht.square.collect(), [0, 1, 4])
+        self.assertListEqual(annotated_keys, [[0, 1, 2]])
+
+        ht = self.cache.annotate(hl.utils.range_table(5), "square", annotate_func)
+        self.assertListEqual(ht.square.collect(), [0, 1, 4, 9, 16])
+        self.assertListEqual(annotated_keys, [[0, 1, 2], [3, 4]])
+        self.assertEqual(len(self.cache.part_paths()), 2)
+
+        # everything is cached, so nothing is computed or written
+        ht = self.cache.annotate(hl.utils.range_table(4), "square", annotate_func)
+        self.assertListEqual(ht.square.collect(), [0, 1, 4, 9])
+        self.assertEqual(len(annotated_keys), 2)
+        self.assertEqual(len(self.cache.part_paths()), 2)
+
+    def test_annotate_empty_table(self):
+        ht = self.cache.annotate(hl.utils.range_table(0), "square", annotate_square)
+
+        self.assertEqual(ht.square.dtype, hl.tint32)
+        self.assertEqual(ht.count(), 0)
+        self.assertListEqual(self.cache.part_paths(), [])
+
+    def test_compact(self):
+        self.cache.add_part(get_squares(0, 2))
+        self.cache.compact()
+        self.assertEqual(len(self.cache.part_paths()), 1)
+
+        self.cache.add_part(get_squares(2, 4))
+        part_paths = self.cache.part_paths()
+        self.cache.compact()
+
+        compacted_part_paths = self.cache.part_paths()
+        self.assertEqual(len(compacted_part_paths), 1)
+        self.assertNotIn(compacted_part_paths[0], part_paths)
+        self.assertListEqual(self.cache.read().square.collect(), [0, 1, 4, 9])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+from .clinvar import CLINVAR_REFRESH_FULL, CLINVAR_REFRESH_INCREMENTAL, get_clinvar_refresh_mode
+
+
+class TestClinvarRefreshMode(unittest.TestCase):
+    def test_same_release(self):
+        self.assertIsNone(get_clinvar_refresh_mode(True, "2019-06-01", "2019-06-01", has_document_hashes=True))
+        self.assertIsNone(get_clinvar_refresh_mode(True, "2019-06-01", "2019-06-01", has_document_hashes=False))
+
+    def test_force(self):
+        self.assertEqual(
+            get_clinvar_refresh_mode(True, "2019-06-01", "2019-06-01", has_document_hashes=True, force=True),
+            CLINVAR_REFRESH_INCREMENTAL,
+        )
+        self.assertEqual(
+            get_clinvar_refresh_mode(True, "2019-06-01", "2019-06-01", has_document_hashes=False, force=True),
+            CLINVAR_REFRESH_FULL,
+        )
+
+    def test_new_release(self):
+        self.assertEqual(
+            get_clinvar_refresh_mode(True, "2019-06-01", "2019-07-01", has_document_hashes=True),
+            CLINVAR_REFRESH_INCREMENTAL,
+        )
+
+        # the index wasn't exported with document hashes, so dropped variants can only be removed by a full reload
+        self.assertEqual(
+            get_clinvar_refresh_mode(True, "2019-06-01", "2019-07-01", has_document_hashes=False),
+            CLINVAR_REFRESH_FULL,
+        )
+        self.assertEqual(
+            get_clinvar_refresh_mode(True, None, "2019-07-01", has_document_hashes=False),
+            CLINVAR_REFRESH_FULL,
+        )
+
+    def test_new_index(self):
+        # hashes of an index that no longer exists don't describe what's in elasticsearch
+        self.assertEqual(
+            get_clinvar_refresh_mode(False, None, "2019-07-01", has_document_hashes=True),
+            CLINVAR_REFRESH_FULL,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
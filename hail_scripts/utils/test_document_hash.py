@@ -0,0 +1,29 @@
+import unittest
+
+import hail as hl
+
+from .document_hash import get_expr_for_document_hash
+
+
+class TestDocumentHash(unittest.TestCase):
+    def test_same_content_same_hash(self):
+        self.assertEqual(
+            hl.eval(get_expr_for_document_hash(hl.struct(variant_id="1-55505463-C-T", AC=3))),
+            hl.eval(get_expr_for_document_hash(hl.struct(variant_id="1-55505463-C-T", AC=3))),
+        )
+
+    def test_changed_content_changes_hash(self):
+        self.assertNotEqual(
+            hl.eval(get_expr_for_document_hash(hl.struct(variant_id="1-55505463-C-T", AC=3))),
+            hl.eval(get_expr_for_document_hash(hl.struct(variant_id="1-55505463-C-T", AC=4))),
+        )
+
+    def test_missing_values(self):
+        self.assertNotEqual(
+            hl.eval(get_expr_for_document_hash(hl.struct(AF=hl.null(hl.tfloat64)))),
+            hl.eval(get_expr_for_document_hash(hl.struct(AF=0.0))),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
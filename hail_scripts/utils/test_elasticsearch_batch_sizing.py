@@ -0,0 +1,42 @@
+import unittest
+
+from .elasticsearch_batch_sizing import BulkBatchSizer
+
+
+class TestBulkBatchSizer(unittest.TestCase):
+    def test_batch_entries_follow_document_size(self):
+        small_documents = BulkBatchSizer(target_batch_bytes=2**20, min_batch_bytes=1)
+        small_documents.set_avg_document_bytes(100)
+        large_documents = BulkBatchSizer(target_batch_bytes=2**20, min_batch_bytes=1)
+        large_documents.set_avg_document_bytes(10000)
+
+        self.assertEqual(small_documents.batch_entries, 10485)
+        self.assertEqual(large_documents.batch_entries, 104)
+        self.assertEqual(small_documents.elasticsearch_config()["es.batch.size.entries"], "10485")
+
+    def test_rejections_shrink_batches_and_back_off(self):
+        sizer = BulkBatchSizer(target_batch_bytes=8*2**20, initial_retry_wait_seconds=10)
+        sizer.set_avg_document_bytes(1000)
+        sizer.update("chunk 1", num_partitions=1, num_documents=8000, elapsed_seconds=2, num_rejections=3)
+
+        self.assertEqual(sizer.batch_bytes, 4*2**20)
+        self.assertEqual(sizer.retry_wait_seconds, 20)
+        self.assertEqual(len(sizer.history), 1)
+
+    def test_fast_requests_grow_batches(self):
+        sizer = BulkBatchSizer(target_batch_bytes=8*2**20, target_request_seconds=2.0)
+        sizer.set_avg_document_bytes(1000)
+        sizer.update("chunk 1", num_partitions=1, num_documents=83880, elapsed_seconds=5, num_rejections=0)
+
+        self.assertEqual(sizer.batch_bytes, 10*2**20)
+
+    def test_limits(self):
+        sizer = BulkBatchSizer(target_batch_bytes=2**20, min_batch_bytes=2**20)
+        sizer.set_avg_document_bytes(1000)
+        sizer.update("chunk 1", num_partitions=1, num_documents=1000, elapsed_seconds=100, num_rejections=1)
+
+        self.assertEqual(sizer.batch_bytes, 2**20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import unittest
+from unittest import mock
+
+from . import elasticsearch_client_shared
+from .elasticsearch_client_shared import ElasticsearchClient, get_elasticsearch_connection
+
+
+class TestConnectionPooling(unittest.TestCase):
+    def setUp(self):
+        elasticsearch_client_shared._CONNECTION_POOLS.clear()
+
+        patcher = mock.patch.object(
+            elasticsearch_client_shared.elasticsearch, "Elasticsearch", side_effect=lambda *args, **kwargs: mock.MagicMock())
+        self.Elasticsearch = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(elasticsearch_client_shared._CONNECTION_POOLS.clear)
+
+    def test_same_settings_share_a_connection(self):
+        es = get_elasticsearch_connection(("es-1", "es-2"), port=9200)
+
+        self.assertIs(get_elasticsearch_connection(("es-1", "es-2"), port="9200"), es)
+        self.assertEqual(self.Elasticsearch.call_count, 1)
+
+    def test_different_settings_get_separate_connections(self):
+        es = get_elasticsearch_connection(("es-1",))
+
+        self.assertIsNot(get_elasticsearch_connection(("es-2",)), es)
+        self.assertIsNot(get_elasticsearch_connection(("es-1",), port=9201), es)
+        self.assertIsNot(get_elasticsearch_connection(("es-1",), maxsize=50), es)
+        self.assertIsNot(get_elasticsearch_connection(("es-1",), retry_on_timeout=False), es)
+        self.assertEqual(self.Elasticsearch.call_count, 5)
+
+    @mock.patch.object(elasticsearch_client_shared, "get_index_operations_journal")
+    def test_clients_share_connections(self, get_index_operations_journal):
+        client = ElasticsearchClient("es-1, es-2")
+
+        self.assertIs(ElasticsearchClient(["es-1", "es-2"]).es, client.es)
+        self.assertIsNot(ElasticsearchClient("es-1,es-2", timeout=60).es, client.es)
+        self.assertEqual(self.Elasticsearch.call_count, 2)
+
+
+class TestDeleteDocumentsByField(unittest.TestCase):
+    @mock.patch.object(elasticsearch_client_shared, "get_index_operations_journal")
+    @mock.patch.object(elasticsearch_client_shared, "get_elasticsearch_connection")
+    def test_delete_documents_by_field(self, get_elasticsearch_connection, get_index_operations_journal):
+        es = get_elasticsearch_connection.return_value
+        es.delete_by_query.return_value = {"deleted": 2, "failures": []}
+        client = ElasticsearchClient("es-1")
+
+        num_deleted = client.delete_documents_by_field(
+            "variants_transcript_consequence", "variant_id", ["1-100-A-G", "1-200-C-T", "1-300-G-A"], chunk_size=2)
+
+        self.assertEqual(num_deleted, 4)
+        self.assertListEqual(
+            [call[1]["body"] for call in es.delete_by_query.call_args_list],
+            [
+                {"query": {"terms": {"variant_id": ["1-100-A-G", "1-200-C-T"]}}},
+                {"query": {"terms": {"variant_id": ["1-300-G-A"]}}},
+            ],
+        )
+
+        es.delete_by_query.return_value = {"deleted": 0, "failures": [{"cause": "rejected"}]}
+        with self.assertRaises(ValueError):
+            client.delete_documents_by_field("variants_transcript_consequence", "variant_id", ["1-100-A-G"])
+
+
+class TestDeleteDocuments(unittest.TestCase):
+    @mock.patch.object(elasticsearch_client_shared, "get_index_operations_journal")
+    @mock.patch.object(elasticsearch_client_shared, "get_elasticsearch_connection")
+    def test_delete_documents_from_generator(self, get_elasticsearch_connection, get_index_operations_journal):
+        client = ElasticsearchClient("es-1")
+        read_ids = []
+
+        def doc_ids():
+            for doc_id in ["1-100-A-G", "1-200-C-T", "1-300-G-A"]:
+                read_ids.append(doc_id)
+                yield doc_id
+
+        def streaming_bulk(es, actions, chunk_size, **kwargs):
+            for action in actions:
+                # ids are read one at a time, as the bulk requests are sent
+                self.assertEqual(read_ids[-1], action["_id"])
+                status = 404 if action["_id"] == "1-300-G-A" else 200
+                yield status == 200, {"delete": {"_id": action["_id"], "status": status}}
+
+        with mock.patch.object(elasticsearch_client_shared.elasticsearch.helpers, "streaming_bulk", streaming_bulk):
+            self.assertEqual(client.delete_documents("variants", "variant", doc_ids()), 2)
+
+
+class TestApplyBulkLoadSettings(unittest.TestCase):
+    @mock.patch.object(elasticsearch_client_shared, "get_index_operations_journal")
+    @mock.patch.object(elasticsearch_client_shared, "get_elasticsearch_connection")
+    def test_apply_bulk_load_settings(self, get_elasticsearch_connection, get_index_operations_journal):
+        es = get_elasticsearch_connection.return_value
+        es.indices.get_settings.return_value = {
+            "variants": {"settings": {"index": {"refresh_interval": "30s", "number_of_replicas": "1"}}}}
+        client = ElasticsearchClient("es-1")
+
+        previous_settings = client.apply_bulk_load_settings("variants")
+        self.assertDictEqual(previous_settings, {"refresh_interval": "30s", "number_of_replicas": 1})
+        es.indices.put_settings.assert_called_with(index="variants", body={"index.refresh_interval": -1})
+
+        client.apply_bulk_load_settings("variants", drop_replicas=True)
+        es.indices.put_settings.assert_called_with(
+            index="variants", body={"index.refresh_interval": -1, "index.number_of_replicas": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
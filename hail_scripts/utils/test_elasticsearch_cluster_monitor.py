@@ -0,0 +1,68 @@
+import unittest
+
+from .elasticsearch_cluster_monitor import (
+    CLUSTER_OK,
+    CLUSTER_PAUSE,
+    CLUSTER_SLOW_DOWN,
+    ClusterHealthMonitor,
+    _parse_disk_watermark,
+    evaluate_node_stats,
+)
+
+
+def _node_stats(disk_used_percent=50, heap_used_percent=50, write_queue=0, rejected=0, current_merges=0):
+    return {
+        "nodes": {
+            "node1": {
+                "name": "es-data-1",
+                "fs": {"total": {"total_in_bytes": 100 * 2**30, "available_in_bytes": (100 - disk_used_percent) * 2**30}},
+                "jvm": {"mem": {"heap_used_percent": heap_used_percent}},
+                "thread_pool": {"write": {"queue": write_queue, "rejected": rejected}},
+                "indices": {"merges": {"current": current_merges}},
+            }
+        }
+    }
+
+
+class TestClusterMonitor(unittest.TestCase):
+    def test_parse_disk_watermark(self):
+        self.assertEqual(_parse_disk_watermark("90%"), ("percent", 90.0))
+        self.assertEqual(_parse_disk_watermark("0.85"), ("percent", 85.0))
+        self.assertEqual(_parse_disk_watermark("500gb"), ("bytes", 500.0 * 2**30))
+
+    def test_healthy(self):
+        self.assertEqual(evaluate_node_stats(_node_stats()), (CLUSTER_OK, []))
+
+    def test_disk_watermarks(self):
+        self.assertEqual(evaluate_node_stats(_node_stats(disk_used_percent=84))[0], CLUSTER_SLOW_DOWN)
+        self.assertEqual(evaluate_node_stats(_node_stats(disk_used_percent=89))[0], CLUSTER_PAUSE)
+
+    def test_heap(self):
+        self.assertEqual(evaluate_node_stats(_node_stats(heap_used_percent=90))[0], CLUSTER_SLOW_DOWN)
+        self.assertEqual(evaluate_node_stats(_node_stats(heap_used_percent=97))[0], CLUSTER_PAUSE)
+
+    def test_write_queue_rejections_and_merges(self):
+        self.assertEqual(evaluate_node_stats(_node_stats(write_queue=500))[0], CLUSTER_SLOW_DOWN)
+        self.assertEqual(evaluate_node_stats(_node_stats(current_merges=20))[0], CLUSTER_SLOW_DOWN)
+
+        status, reasons = evaluate_node_stats(_node_stats(rejected=15), previous_node_stats=_node_stats(rejected=10))
+        self.assertEqual(status, CLUSTER_SLOW_DOWN)
+        self.assertEqual(reasons, ["es-data-1: 5 new write rejections"])
+
+    def test_max_pause(self):
+        class FakeNodes:
+            def stats(self, **kwargs):
+                return _node_stats(disk_used_percent=89)
+
+        class FakeElasticsearch:
+            nodes = FakeNodes()
+
+        monitor = ClusterHealthMonitor(FakeElasticsearch(), disk_watermarks={"low": "85%", "high": "90%"})
+        monitor.sample()
+
+        with self.assertRaises(RuntimeError):
+            monitor.wait_until_healthy(poll_interval_seconds=0.01, max_pause_seconds=0.05)
+
+
+if __name__ == "__main__":
+    unittest.main()
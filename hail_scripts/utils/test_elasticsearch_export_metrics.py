@@ -0,0 +1,54 @@
+import json
+import os
+import tempfile
+import unittest
+
+from .elasticsearch_export_metrics import ElasticsearchExportMetrics, _percentile
+
+
+class TestElasticsearchExportMetrics(unittest.TestCase):
+    def setUp(self):
+        self.metrics = ElasticsearchExportMetrics("test_index", avg_document_bytes=100)
+        self.metrics.record_chunk("partitions 0-1", num_partitions=2, num_documents=2000, elapsed_seconds=10,
+                                  block_size=100, num_rejections=0)
+        self.metrics.record_chunk("partitions 2-3", num_partitions=2, num_documents=2000, elapsed_seconds=20,
+                                  block_size=100, num_rejections=5, num_retries=1)
+        self.metrics.finish()
+
+    def test_percentile(self):
+        self.assertEqual(_percentile([1, 2, 3, 4, 5], 50), 3)
+        self.assertEqual(_percentile([1, 2], 50), 1.5)
+        self.assertIsNone(_percentile([], 90))
+
+    def test_summary(self):
+        summary = self.metrics.summary()
+        self.assertEqual(summary["documents"], 4000)
+        self.assertEqual(summary["estimated_bytes"], 400000)
+        self.assertEqual(summary["estimated_bulk_requests"], 40)
+        self.assertDictEqual(
+            summary["avg_estimated_request_seconds_across_chunks"], {"min": 1.0, "median": 1.5, "max": 2.0})
+        self.assertEqual(summary["rejections"], 5)
+        self.assertEqual(summary["retries"], 1)
+        self.assertEqual(len(summary["chunks"]), 2)
+        self.assertEqual(summary["chunks"][0]["avg_partition_documents"], 1000)
+
+    def test_reports(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            json_path = os.path.join(temp_dir, "metrics.json")
+            self.metrics.write_json_report(json_path)
+            with open(json_path) as f:
+                self.assertEqual(json.load(f)["documents"], 4000)
+
+            prometheus_path = os.path.join(temp_dir, "metrics.prom")
+            self.metrics.write_prometheus_textfile(prometheus_path)
+            with open(prometheus_path) as f:
+                content = f.read()
+
+            self.assertIn('es_export_documents{index="test_index"} 4000', content)
+            self.assertIn(
+                'es_export_chunk_avg_estimated_request_seconds{index="test_index",chunk="partitions 0-1"} 1.0', content)
+            self.assertIn('es_export_chunk_seconds{index="test_index",chunk="partitions 2-3"} 20', content)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+
+from .elasticsearch_export_progress import ExportProgress
+
+
+class TestExportProgress(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "progress.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_chunks(self):
+        progress = ExportProgress(self.path, "test_index", num_partitions=10, partitions_per_chunk=4)
+        self.assertEqual(progress.num_chunks, 3)
+        self.assertListEqual(progress.chunk_partitions(0), [0, 1, 2, 3])
+        self.assertListEqual(progress.chunk_partitions(2), [8, 9])
+
+    def test_resume(self):
+        progress = ExportProgress(self.path, "test_index", num_partitions=10, partitions_per_chunk=4)
+        progress.mark_done(0)
+        progress.mark_done(2)
+
+        resumed = ExportProgress(self.path, "test_index", num_partitions=10, partitions_per_chunk=4, resume=True)
+        self.assertListEqual(resumed.remaining_chunks(), [1])
+        self.assertFalse(resumed.is_done())
+
+        restarted = ExportProgress(self.path, "test_index", num_partitions=10, partitions_per_chunk=4)
+        self.assertListEqual(restarted.remaining_chunks(), [0, 1, 2])
+
+    def test_index_settings(self):
+        progress = ExportProgress(self.path, "test_index", num_partitions=10, partitions_per_chunk=4)
+        self.assertIsNone(progress.index_settings)
+        progress.set_index_settings({"refresh_interval": "30s", "number_of_replicas": 1})
+        progress.mark_done(0)
+
+        resumed = ExportProgress(self.path, "test_index", num_partitions=10, partitions_per_chunk=4, resume=True)
+        self.assertDictEqual(resumed.index_settings, {"refresh_interval": "30s", "number_of_replicas": 1})
+
+        restarted = ExportProgress(self.path, "test_index", num_partitions=10, partitions_per_chunk=4)
+        self.assertIsNone(restarted.index_settings)
+
+    def test_resume_with_different_table(self):
+        ExportProgress(self.path, "test_index", num_partitions=10, partitions_per_chunk=4).mark_done(0)
+
+        with self.assertRaises(ValueError):
+            ExportProgress(self.path, "test_index", num_partitions=12, partitions_per_chunk=4, resume=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
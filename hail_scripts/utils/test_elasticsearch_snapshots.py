@@ -0,0 +1,69 @@
+import unittest
+from unittest import mock
+
+from .elasticsearch_snapshots import (
+    SnapshotManager,
+    _estimate_seconds_remaining,
+    _select_snapshots_to_prune,
+    _snapshot_status_bytes,
+)
+
+DAY_MILLIS = 24 * 60 * 60 * 1000
+
+
+class TestSnapshots(unittest.TestCase):
+    def setUp(self):
+        self.snapshots = [
+            {"snapshot": "snapshot_variants_%d" % day, "state": "SUCCESS", "start_time_in_millis": day * DAY_MILLIS}
+            for day in range(1, 6)
+        ]
+        self.snapshots.append({"snapshot": "snapshot_clinvar_1", "state": "SUCCESS", "start_time_in_millis": DAY_MILLIS})
+
+    def test_estimate_seconds_remaining(self):
+        self.assertEqual(_estimate_seconds_remaining(25, 100, 10), 30)
+        self.assertIsNone(_estimate_seconds_remaining(0, 100, 10))
+
+    def test_snapshot_status_bytes(self):
+        self.assertEqual(
+            _snapshot_status_bytes({"stats": {"processed": {"size_in_bytes": 5}, "total": {"size_in_bytes": 10}}}),
+            (5, 10),
+        )
+        self.assertEqual(
+            _snapshot_status_bytes({"stats": {"processed_size_in_bytes": 5, "total_size_in_bytes": 10}}),
+            (5, 10),
+        )
+
+    def test_prune_keep_last(self):
+        self.assertListEqual(
+            _select_snapshots_to_prune(self.snapshots, keep_last=3, name_prefix="snapshot_variants"),
+            ["snapshot_variants_2", "snapshot_variants_1"],
+        )
+
+    def test_prune_max_age(self):
+        self.assertListEqual(
+            _select_snapshots_to_prune(
+                self.snapshots, keep_last=1, max_age_days=2.5, name_prefix="snapshot_variants", now_millis=5 * DAY_MILLIS),
+            ["snapshot_variants_2", "snapshot_variants_1"],
+        )
+
+    def test_prune_without_policy(self):
+        self.assertListEqual(_select_snapshots_to_prune(self.snapshots), [])
+
+    def test_restore_rename_args_given_together(self):
+        es = mock.MagicMock()
+        snapshot_manager = SnapshotManager(es)
+
+        with self.assertRaises(ValueError):
+            snapshot_manager.restore_snapshot("backups", "snapshot_variants_5", rename_pattern="(.+)")
+        with self.assertRaises(ValueError):
+            snapshot_manager.restore_snapshot("backups", "snapshot_variants_5", rename_replacement="restored_$1")
+        es.snapshot.restore.assert_not_called()
+
+        es.snapshot.get.return_value = {"snapshots": [{"indices": ["variants", "clinvar"]}]}
+        restored_indices = snapshot_manager.restore_snapshot(
+            "backups", "snapshot_variants_5", rename_pattern="(.+)", rename_replacement="restored_$1", wait=False)
+        self.assertListEqual(restored_indices, ["restored_variants", "restored_clinvar"])
+
+
+if __name__ == "__main__":
+    unittest.main()
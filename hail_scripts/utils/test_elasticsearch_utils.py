@@ -0,0 +1,82 @@
+import unittest
+
+import hail as hl
+
+from .elasticsearch_utils import (
+    CHILD_DOCUMENT_ID_FIELD,
+    _elasticsearch_mapping_for_type,
+    child_table_for_array_field,
+    get_expr_for_elasticsearch_export,
+    get_table_for_contig,
+)
+
+
+class TestChildTableForArrayField(unittest.TestCase):
+    def test_child_table_for_array_field(self):
+        table = hl.Table.parallelize(
+            [
+                {"variant_id": "1-100-A-G", "csqs": [{"transcript_id": "ENST1"}, {"transcript_id": "ENST2"}]},
+                {"variant_id": "1-200-C-T", "csqs": []},
+            ],
+            hl.tstruct(variant_id=hl.tstr, csqs=hl.tarray(hl.tstruct(transcript_id=hl.tstr))),
+        )
+
+        children = child_table_for_array_field(table, "csqs", "transcript_id")
+
+        self.assertListEqual(
+            sorted((row[CHILD_DOCUMENT_ID_FIELD], row.variant_id, row.transcript_id) for row in children.collect()),
+            [("1-100-A-G-ENST1", "1-100-A-G", "ENST1"), ("1-100-A-G-ENST2", "1-100-A-G", "ENST2")],
+        )
+
+        # child ids don't change when the array is reordered
+        reordered_children = child_table_for_array_field(table.annotate(csqs=table.csqs[::-1]), "csqs", "transcript_id")
+        self.assertListEqual(
+            sorted(row[CHILD_DOCUMENT_ID_FIELD] for row in reordered_children.collect()),
+            ["1-100-A-G-ENST1", "1-100-A-G-ENST2"],
+        )
+
+
+class TestGetTableForContig(unittest.TestCase):
+    def test_get_table_for_contig(self):
+        table = hl.Table.parallelize(
+            [{"chrom": "1", "pos": 100}, {"chrom": "2", "pos": 200}, {"chrom": "1", "pos": 300}],
+            hl.tstruct(chrom=hl.tstr, pos=hl.tint32),
+        )
+
+        by_contig = table.key_by("chrom")
+        self.assertListEqual(sorted(row.pos for row in get_table_for_contig(by_contig, "1").collect()), [100, 300])
+        self.assertEqual(get_table_for_contig(by_contig, "X").count(), 0)
+
+        by_locus = table.key_by(locus=hl.locus(table.chrom, table.pos))
+        self.assertListEqual([row.pos for row in get_table_for_contig(by_locus, "2").collect()], [200])
+
+
+class TestRangeAndDictTypes(unittest.TestCase):
+    def test_mapping(self):
+        self.assertDictEqual(_elasticsearch_mapping_for_type(hl.tlocus("GRCh37")), {"type": "long"})
+        self.assertDictEqual(_elasticsearch_mapping_for_type(hl.tinterval(hl.tlocus("GRCh37"))), {"type": "long_range"})
+        self.assertDictEqual(_elasticsearch_mapping_for_type(hl.tinterval(hl.tint32)), {"type": "integer_range"})
+        self.assertDictEqual(
+            _elasticsearch_mapping_for_type(hl.tdict(hl.tstr, hl.tfloat64)),
+            {"type": "nested", "properties": {"key": {"type": "keyword"}, "value": {"type": "double"}}},
+        )
+
+    def test_export_conversion(self):
+        self.assertEqual(hl.eval(get_expr_for_elasticsearch_export(hl.locus("X", 100, "GRCh37"))), 23000000100)
+        self.assertEqual(
+            hl.eval(get_expr_for_elasticsearch_export(hl.interval(1, 10, includes_start=False, includes_end=False))),
+            hl.Struct(gte=2, lte=9),
+        )
+        self.assertEqual(
+            hl.eval(get_expr_for_elasticsearch_export(
+                hl.locus_interval("1", 100, 200, includes_end=True, reference_genome="GRCh37"))),
+            hl.Struct(gte=1000000100, lte=1000000200),
+        )
+        self.assertListEqual(
+            hl.eval(get_expr_for_elasticsearch_export(hl.dict({"afr": 0.5}))),
+            [hl.Struct(key="afr", value=0.5)],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
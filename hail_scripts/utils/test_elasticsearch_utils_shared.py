@@ -0,0 +1,88 @@
+import unittest
+
+from .elasticsearch_utils_shared import AF_SCALING_FACTOR, get_new_elasticsearch_fields, optimize_elasticsearch_schema
+
+
+class TestOptimizeElasticsearchSchema(unittest.TestCase):
+    def setUp(self):
+        self.properties = {
+            "AF": {"type": "double"},
+            "AF_adj": {"properties": {"afr": {"type": "double"}}},
+            "AC_adj": {"properties": {"afr": {"type": "long"}}},
+            "xpos": {"type": "long"},
+            "cadd": {"type": "double"},
+            "geneIdToConsequenceJson": {"type": "keyword"},
+            "rsid": {"type": "keyword"},
+            "sortedTranscriptConsequences": {"type": "nested", "properties": {"hgvs": {"type": "keyword"}}},
+            "regions": {"type": "nested", "properties": {"start": {"type": "integer"}}},
+            "gene_id_to_consequence": {"type": "nested", "properties": {
+                "key": {"type": "keyword"}, "value": {"type": "keyword"}}},
+        }
+
+    def test_inferred_types(self):
+        properties = optimize_elasticsearch_schema(self.properties, nested_fields=["sortedTranscriptConsequences"])
+
+        self.assertDictEqual(properties["AF"], {"type": "scaled_float", "scaling_factor": AF_SCALING_FACTOR})
+        self.assertEqual(properties["AF_adj"]["properties"]["afr"]["type"], "scaled_float")
+        self.assertEqual(properties["AC_adj"]["properties"]["afr"]["type"], "integer")
+        self.assertEqual(properties["xpos"]["type"], "long")
+        self.assertEqual(properties["cadd"]["type"], "float")
+        self.assertDictEqual(properties["geneIdToConsequenceJson"], {"type": "keyword", "index": False})
+        self.assertDictEqual(properties["rsid"], {"type": "keyword"})
+        self.assertEqual(properties["sortedTranscriptConsequences"]["type"], "nested")
+        self.assertNotIn("type", properties["regions"])
+        self.assertEqual(properties["gene_id_to_consequence"]["type"], "nested")
+
+        # the input isn't modified
+        self.assertEqual(self.properties["AF"]["type"], "double")
+
+    def test_hints(self):
+        properties = optimize_elasticsearch_schema(
+            self.properties,
+            field_hints={"cadd": "half_float", "rsid": "display", "AF": "keep", "sortedTranscriptConsequences\\.hgvs": {"type": "text"}},
+            infer_hints=False,
+        )
+
+        self.assertEqual(properties["cadd"]["type"], "half_float")
+        self.assertDictEqual(properties["rsid"], {"type": "keyword", "index": False})
+        self.assertEqual(properties["AF"]["type"], "double")
+        self.assertEqual(properties["AF_adj"]["properties"]["afr"]["type"], "double")
+        self.assertEqual(properties["regions"]["type"], "nested")
+        self.assertDictEqual(properties["sortedTranscriptConsequences"]["properties"]["hgvs"], {"type": "text"})
+
+    def test_unknown_hint(self):
+        with self.assertRaises(ValueError):
+            optimize_elasticsearch_schema(self.properties, field_hints={"cadd": "tiny_float"})
+
+    def test_dict_mappings_stay_nested(self):
+        properties = optimize_elasticsearch_schema(self.properties, field_hints={"gene_id_to_consequence": "object"})
+
+        self.assertEqual(properties["gene_id_to_consequence"]["type"], "nested")
+
+
+class TestGetNewElasticsearchFields(unittest.TestCase):
+    def test_get_new_elasticsearch_fields(self):
+        existing_properties = {
+            "variant_id": {"type": "keyword"},
+            "clinvar": {"properties": {"allele_id": {"type": "integer"}}},
+            "sortedTranscriptConsequences": {"type": "nested", "properties": {"gene_id": {"type": "keyword"}}},
+        }
+        properties = {
+            "variant_id": {"type": "keyword"},
+            "cadd": {"type": "float"},
+            "clinvar": {"properties": {"allele_id": {"type": "integer"}, "clinical_significance": {"type": "keyword"}}},
+            "sortedTranscriptConsequences": {"type": "nested", "properties": {"gene_id": {"type": "keyword"}}},
+        }
+
+        self.assertDictEqual(
+            get_new_elasticsearch_fields(existing_properties, properties),
+            {
+                "cadd": {"type": "float"},
+                "clinvar": {"properties": {"clinical_significance": {"type": "keyword"}}},
+            },
+        )
+        self.assertDictEqual(get_new_elasticsearch_fields(properties, properties), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
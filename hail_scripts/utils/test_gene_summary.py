@@ -0,0 +1,45 @@
+import unittest
+
+import hail as hl
+
+from .gene_summary import get_gene_summary_table
+
+
+def _csq(gene_id, category, lof="", lof_flags=""):
+    return hl.Struct(
+        gene_id=gene_id, gene_symbol=gene_id.replace("ENSG", "GENE"), category=category,
+        major_consequence=category, lof=lof, lof_flags=lof_flags)
+
+
+class TestGeneSummary(unittest.TestCase):
+    def test_gene_summary(self):
+        ht = hl.Table.parallelize([
+            # ENSG1's worst consequence for this variant is the first one, so it's counted as lof
+            {"variant_id": "1-200-A-T", "xpos": 1000000200, "AF_adj": hl.Struct(afr=0.1, eur=None),
+             "sortedTranscriptConsequences": [_csq("ENSG1", "lof", lof="HC"), _csq("ENSG1", "missense")]},
+            {"variant_id": "1-100-A-G", "xpos": 1000000100, "AF_adj": hl.Struct(afr=0.2, eur=0.3),
+             "sortedTranscriptConsequences": [_csq("ENSG1", "lof", lof="LC"), _csq("ENSG2", "synonymous")]},
+        ], hl.tstruct(
+            variant_id=hl.tstr, xpos=hl.tint64, AF_adj=hl.tstruct(afr=hl.tfloat64, eur=hl.tfloat64),
+            sortedTranscriptConsequences=hl.tarray(hl.tstruct(
+                gene_id=hl.tstr, gene_symbol=hl.tstr, category=hl.tstr, major_consequence=hl.tstr, lof=hl.tstr,
+                lof_flags=hl.tstr)),
+        ))
+
+        genes = {row.gene_id: row for row in get_gene_summary_table(ht, ["afr", "eur", "sas"]).collect()}
+
+        self.assertListEqual(sorted(genes), ["ENSG1", "ENSG2"])
+
+        self.assertEqual(genes["ENSG1"].gene_symbol, "GENE1")
+        self.assertEqual(genes["ENSG1"].n_variants, 2)
+        self.assertEqual(genes["ENSG1"].n_variants_by_category, hl.Struct(lof=2, missense=0, synonymous=0, other=0))
+        self.assertEqual(genes["ENSG1"].n_lof_variants_by_flag, hl.Struct(plof=1, lc_lof=1, lof_flag=0))
+        self.assertEqual(genes["ENSG1"].plof_caf, hl.Struct(afr=0.1, eur=0.0))
+        self.assertListEqual(genes["ENSG1"].variant_ids, ["1-100-A-G", "1-200-A-T"])
+
+        self.assertEqual(genes["ENSG2"].n_variants_by_category.synonymous, 1)
+        self.assertListEqual(genes["ENSG2"].variant_ids, ["1-100-A-G"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from .index_operations_journal import IndexOperationsJournal
+
+
+class TestIndexOperationsJournal(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "journal.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_record_and_query(self):
+        journal = IndexOperationsJournal(self.path)
+        journal.record("export_table", "gnomad_exomes", start_time=time.time() - 5, block_size=1000)
+        journal.record("update_alias", "gnomad", actions=[{"add": {"index": "gnomad_exomes", "alias": "gnomad"}}])
+        journal.record("export_table", "clinvar_grch37", status="failed")
+
+        # entries can be read back by a new journal, eg. in another process
+        entries = IndexOperationsJournal(self.path).entries(operation="export_table")
+        self.assertListEqual([e["index_name"] for e in entries], ["gnomad_exomes", "clinvar_grch37"])
+        self.assertEqual(entries[0]["params"], {"block_size": 1000})
+        self.assertGreaterEqual(entries[0]["duration_seconds"], 5)
+        self.assertIsNone(entries[1]["duration_seconds"])
+
+        self.assertEqual(len(journal.entries(status="failed")), 1)
+        self.assertEqual(len(journal.entries(index_name="gnomad")), 1)
+
+    def test_unflushed_entries(self):
+        journal = IndexOperationsJournal(self.path, flush_batch_size=10)
+        journal.record("create_snapshot", "snapshot_1")
+        journal.record("create_snapshot", "snapshot_2")
+        self.assertEqual(journal.num_unflushed, 2)
+
+        # flushing below the batch size is a no-op, so the cluster isn't contacted
+        self.assertEqual(journal.flush(es=None), 0)
+
+        entries, offset = journal._read_unflushed_entries()
+        self.assertEqual(len(entries), 2)
+        journal._mark_flushed(offset)
+
+        journal.record("create_snapshot", "snapshot_3")
+        reopened_journal = IndexOperationsJournal(self.path)
+        self.assertEqual(reopened_journal.num_unflushed, 1)
+        self.assertEqual(reopened_journal._read_unflushed_entries()[0][0]["index_name"], "snapshot_3")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+
+import hail as hl
+
+from .reference_annotations import (
+    annotate_with_reference_tables,
+    annotate_with_transcript_reference_table,
+    get_expr_for_variant_reference_annotation,
+)
+
+
+class TestReferenceAnnotations(unittest.TestCase):
+    def setUp(self):
+        self.variants = hl.Table.parallelize([
+            {"locus": hl.Locus("1", 100), "alleles": ["A", "G"], "transcript_ids": {"ENST1", "ENST2"}},
+            {"locus": hl.Locus("1", 200), "alleles": ["C", "T"], "transcript_ids": {"ENST3"}},
+        ], hl.tstruct(locus=hl.tlocus("GRCh37"), alleles=hl.tarray(hl.tstr), transcript_ids=hl.tset(hl.tstr)),
+            key=["locus", "alleles"])
+
+        self.constraint = hl.Table.parallelize([
+            {"transcript": "ENST1", "pLI": 0.9, "oe_lof": 0.1, "gene": "GENE1"},
+            {"transcript": "ENST2", "pLI": 0.1, "oe_lof": 0.8, "gene": "GENE1"},
+        ], hl.tstruct(transcript=hl.tstr, pLI=hl.tfloat64, oe_lof=hl.tfloat64, gene=hl.tstr), key="transcript")
+
+    def test_transcript_annotation(self):
+        # the broadcast and the join give the same results
+        for broadcast_max_rows in [100, 0]:
+            ht = annotate_with_transcript_reference_table(
+                self.variants, "transcript_constraint", self.variants.transcript_ids, self.constraint,
+                fields=["pLI", "oe_lof"], broadcast_max_rows=broadcast_max_rows)
+
+            rows = {row.locus.position: row.transcript_constraint for row in ht.collect()}
+            self.assertListEqual(
+                sorted(rows[100], key=lambda r: r.transcript_id),
+                [
+                    hl.Struct(pLI=0.9, oe_lof=0.1, transcript_id="ENST1"),
+                    hl.Struct(pLI=0.1, oe_lof=0.8, transcript_id="ENST2"),
+                ],
+            )
+            self.assertListEqual(rows[200], [])
+
+    def test_variant_annotation(self):
+        clinvar = hl.Table.parallelize([
+            {"locus": hl.Locus("1", 200), "alleles": ["C", "T"], "allele_id": 5, "gold_stars": 2},
+        ], hl.tstruct(locus=hl.tlocus("GRCh37"), alleles=hl.tarray(hl.tstr), allele_id=hl.tint32, gold_stars=hl.tint32),
+            key=["locus", "alleles"])
+
+        ht = self.variants.annotate(clinvar=get_expr_for_variant_reference_annotation(
+            self.variants, clinvar, fields=["allele_id", "review_status"]))
+
+        rows = {row.locus.position: row.clinvar for row in ht.collect()}
+        self.assertIsNone(rows[100])
+        self.assertEqual(rows[200], hl.Struct(allele_id=5))
+
+
+    def test_transcript_annotations_need_vep_config(self):
+        variants = self.variants.annotate(vep=hl.struct(transcript_consequences=hl.array(
+            self.variants.transcript_ids).map(lambda transcript_id: hl.struct(transcript_id=transcript_id))))
+
+        # the cached annotations would be keyed to the transcripts of whichever VEP config ran first
+        with self.assertRaises(ValueError):
+            annotate_with_reference_tables(variants, "reference_cache", constraint_path="gnomad_constraint.ht")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import hail as hl
+
+from .reference_datasets import GTEX_DATA_DIR_VARIABLE, ReferenceDataset, get_data_dir, get_reference_dataset
+
+
+class TestReferenceDatasets(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+        self.tpms_path = os.path.join(self.temp_dir, "tpms.tsv")
+        with open(self.tpms_path, "w") as f:
+            f.write("transcript_id\tgene_id\tlung\tliver\n")
+            f.write("ENST1\tENSG1\t1.5\t0\n")
+            f.write("ENST2\tENSG1\tNA\t2.25\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_import_with_schema(self):
+        dataset = ReferenceDataset(
+            "tpms", self.tpms_path, types={"transcript_id": hl.tstr, "gene_id": hl.tstr}, key=["transcript_id"],
+            version="v1", default_type=hl.tfloat64)
+
+        self.assertDictEqual(
+            dataset.get_types(),
+            {"transcript_id": hl.tstr, "gene_id": hl.tstr, "lung": hl.tfloat64, "liver": hl.tfloat64},
+        )
+
+        ht = dataset.import_table()
+        self.assertEqual(hl.eval(ht.version), "v1")
+        self.assertListEqual(
+            ht.collect(),
+            [
+                hl.Struct(transcript_id="ENST1", gene_id="ENSG1", lung=1.5, liver=0.0),
+                hl.Struct(transcript_id="ENST2", gene_id="ENSG1", lung=None, liver=2.25),
+            ],
+        )
+
+    def test_cached_conversion(self):
+        cache_root = os.path.join(self.temp_dir, "cache")
+
+        ht = get_reference_dataset("gtex_transcript_tpms", path=self.tpms_path, cache_root=cache_root)
+        self.assertEqual(ht.count(), 2)
+
+        converted_paths = os.listdir(os.path.join(cache_root, "gtex_transcript_tpms"))
+        self.assertEqual(len(converted_paths), 1)
+
+        # the source hasn't changed, so the same table is read again
+        get_reference_dataset("gtex_transcript_tpms", path=self.tpms_path, cache_root=cache_root)
+        self.assertListEqual(os.listdir(os.path.join(cache_root, "gtex_transcript_tpms")), converted_paths)
+
+        # a changed source is converted again
+        with open(self.tpms_path, "a") as f:
+            f.write("ENST3\tENSG2\t3\t4\n")
+
+        ht = get_reference_dataset("gtex_transcript_tpms", path=self.tpms_path, cache_root=cache_root)
+        self.assertEqual(ht.count(), 3)
+        self.assertEqual(len(os.listdir(os.path.join(cache_root, "gtex_transcript_tpms"))), 2)
+
+    def test_data_dir(self):
+        with mock.patch.dict(os.environ, {GTEX_DATA_DIR_VARIABLE: "/gtex"}):
+            self.assertEqual(get_data_dir(GTEX_DATA_DIR_VARIABLE), "/gtex")
+            self.assertEqual(get_data_dir(GTEX_DATA_DIR_VARIABLE, "/other"), "/other")
+
+        with mock.patch.dict(os.environ, clear=True):
+            self.assertEqual(get_data_dir(GTEX_DATA_DIR_VARIABLE, "/other"), "/other")
+            with self.assertRaises(ValueError):
+                get_data_dir(GTEX_DATA_DIR_VARIABLE)
+            with self.assertRaises(ValueError):
+                get_reference_dataset("gtex_sample_attributes", cache_root=os.path.join(self.temp_dir, "cache"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+
+import hail as hl
+
+from .reference_score_tables import annotate_with_reference_score_table, get_covering_intervals, is_join_compatible
+
+
+def _variants_table(rows, **fields):
+    return hl.Table.parallelize(
+        [dict(locus=hl.Locus(contig, pos), alleles=alleles, **values) for contig, pos, alleles, values in rows],
+        hl.tstruct(locus=hl.tlocus("GRCh37"), alleles=hl.tarray(hl.tstr), **fields),
+        key=["locus", "alleles"],
+    )
+
+
+class TestReferenceScoreTables(unittest.TestCase):
+    def setUp(self):
+        self.cohort = _variants_table([
+            ("1", 150, ["A", "G"], {}),
+            ("1", 1050, ["C", "T"], {}),
+            ("2", 5500, ["G", "A"], {}),
+        ])
+
+        self.cadd = _variants_table([
+            ("1", 150, ["A", "G"], {"PHRED": 12.5, "RawScore": 1.1}),
+            ("1", 150, ["A", "T"], {"PHRED": 20.0, "RawScore": 2.2}),
+            ("2", 5500, ["G", "A"], {"PHRED": 1.0, "RawScore": 0.1}),
+            ("3", 100, ["T", "C"], {"PHRED": 30.0, "RawScore": 3.3}),
+        ], PHRED=hl.tfloat64, RawScore=hl.tfloat64)
+
+    def test_covering_intervals(self):
+        intervals = get_covering_intervals(self.cohort, window_size=1000)
+
+        self.assertListEqual(
+            [(i.start.contig, i.start.position, i.end.position) for i in intervals],
+            [("1", 1, 2000), ("2", 5001, 6000)],
+        )
+
+    def test_annotate(self):
+        self.assertTrue(is_join_compatible(self.cohort, self.cadd))
+
+        ht = annotate_with_reference_score_table(self.cohort, self.cadd, "cadd", fields=["PHRED"], window_size=1000)
+        rows = {(row.locus.contig, row.locus.position): row.cadd for row in ht.collect()}
+
+        self.assertDictEqual(rows, {
+            ("1", 150): hl.Struct(PHRED=12.5),
+            ("1", 1050): None,
+            ("2", 5500): hl.Struct(PHRED=1.0),
+        })
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+
+from .sparse_frequencies import decode_sparse_frequencies
+
+POPULATIONS = ["afr", "amr", "eas"]
+
+
+class TestSparseFrequencies(unittest.TestCase):
+    def test_decode_singleton(self):
+        document = {
+            "variant_id": "1-100-A-G",
+            "pops_present": ["afr", "eas"],
+            "AC_adj": {"afr": 1, "eas": 0},
+            "AF_adj": {"afr": 0.01, "eas": 0.0},
+            "AN_adj": {"afr": 100, "eas": 50},
+            "nhomalt_adj": {"afr": 0, "eas": 0},
+        }
+
+        dense_document = decode_sparse_frequencies(document, POPULATIONS)
+
+        self.assertNotIn("pops_present", dense_document)
+        self.assertEqual(dense_document["variant_id"], "1-100-A-G")
+        self.assertDictEqual(dense_document["AC_adj"], {"afr": 1, "amr": 0, "eas": 0})
+        self.assertDictEqual(dense_document["AF_adj"], {"afr": 0.01, "amr": None, "eas": 0})
+        self.assertDictEqual(dense_document["AN_adj"], {"afr": 100, "amr": 0, "eas": 50})
+        self.assertDictEqual(dense_document["nhomalt_adj"], {"afr": 0, "amr": 0, "eas": 0})
+
+    def test_decode_dense_document(self):
+        document = {"AC_adj": {"afr": 2, "amr": 0, "eas": 0}}
+
+        self.assertDictEqual(decode_sparse_frequencies(document, POPULATIONS, fields=["AC_adj"]), document)
+
+
+if __name__ == "__main__":
+    unittest.main()
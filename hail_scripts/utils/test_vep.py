@@ -0,0 +1,139 @@
+import json
+import os
+import unittest
+
+import hail as hl
+
+from .vep import (
+    get_expr_for_consequence_category,
+    get_expr_for_consequence_term_codes,
+    get_expr_for_consequence_terms_from_codes,
+    get_expr_for_vep_consequence_dicts,
+    get_expr_for_vep_sorted_transcript_consequences_array,
+    get_slim_vep_command,
+    get_slim_vep_json_schema,
+    select_vep_fields,
+    CONSEQUENCE_TERMS,
+    VEP_TRANSCRIPT_CONSEQUENCE_FIELDS,
+)
+from .vep_runner import parse_vep_json_schema
+
+
+class TestSlimVepConfig(unittest.TestCase):
+    def test_slim_command(self):
+        with open(os.path.join(os.path.dirname(__file__), "..", "..", "vep85-loftee-cyan.json")) as f:
+            command = json.load(f)["command"]
+
+        slim_command = get_slim_vep_command(command)
+
+        self.assertNotIn("--everything", slim_command)
+        self.assertEqual(slim_command[-2:], ["-o", "STDOUT"])
+        for flag in ["--json", "--minimal", "--allele_number", "--plugin", "--symbol", "--hgvs", "--canonical"]:
+            self.assertIn(flag, slim_command)
+        self.assertEqual(slim_command[slim_command.index("--sift") + 1], "p")
+
+    def test_slim_schema(self):
+        fields = dict(parse_vep_json_schema(get_slim_vep_json_schema())[1])
+
+        self.assertListEqual(sorted(fields), ["input", "most_severe_consequence", "transcript_consequences"])
+        self.assertListEqual(
+            [field for field, _ in fields["transcript_consequences"][1][1]], sorted(VEP_TRANSCRIPT_CONSEQUENCE_FIELDS))
+
+    def test_select_vep_fields(self):
+        vep = hl.struct(
+            input="1\t100\t.\tA\tT",
+            most_severe_consequence="missense_variant",
+            colocated_variants=hl.empty_array(hl.tstruct(id=hl.tstr)),
+            transcript_consequences=[hl.struct(
+                gene_id="ENSG1", transcript_id="ENST1", consequence_terms=["missense_variant", "not_a_term"],
+                motif_name="x")],
+        )
+
+        # consequence terms are cached as they are, including ones that aren't in CONSEQUENCE_TERMS
+        self.assertEqual(
+            hl.eval(select_vep_fields(vep)),
+            hl.Struct(
+                most_severe_consequence="missense_variant",
+                transcript_consequences=[hl.Struct(
+                    gene_id="ENSG1", transcript_id="ENST1", consequence_terms=["missense_variant", "not_a_term"])],
+            ),
+        )
+
+
+
+class TestConsequenceCodes(unittest.TestCase):
+    def test_codes(self):
+        codes = get_expr_for_consequence_term_codes(hl.literal(["intron_variant", "not_a_term", "stop_gained"]))
+
+        self.assertListEqual(
+            hl.eval(codes), [CONSEQUENCE_TERMS.index("intron_variant"), CONSEQUENCE_TERMS.index("stop_gained")])
+        self.assertListEqual(hl.eval(get_expr_for_consequence_terms_from_codes(codes)), ["intron_variant", "stop_gained"])
+
+    def test_category(self):
+        for term, category in [
+            ("stop_gained", "lof"),
+            ("frameshift_variant", "lof"),
+            ("missense_variant", "missense"),
+            ("synonymous_variant", "synonymous"),
+            ("intron_variant", "other"),
+        ]:
+            self.assertEqual(hl.eval(get_expr_for_consequence_category(CONSEQUENCE_TERMS.index(term))), category)
+
+    def test_sorted_transcript_consequences(self):
+        def transcript_consequence(transcript_id, consequence_terms, biotype="protein_coding", canonical=0):
+            return hl.struct(
+                biotype=biotype, canonical=canonical, cdna_start=hl.null(hl.tint32), cdna_end=hl.null(hl.tint32),
+                codons=hl.null(hl.tstr), gene_id="ENSG1", gene_symbol="GENE1", hgvsc="ENST:c.1A>G",
+                hgvsp=hl.null(hl.tstr), transcript_id=transcript_id, consequence_terms=consequence_terms,
+                domains=hl.empty_array(hl.tstruct(db=hl.tstr, name=hl.tstr)),
+                **{field: hl.null(hl.tstr) for field in [
+                    "amino_acids", "lof", "lof_filter", "lof_flags", "lof_info", "polyphen_prediction", "protein_id",
+                    "sift_prediction",
+                ]},
+                protein_start=hl.null(hl.tint32),
+            )
+
+        vep = hl.struct(
+            input="1\t100\t.\tA\tT",
+            most_severe_consequence="missense_variant",
+            transcript_consequences=[
+                transcript_consequence("ENST1", ["intron_variant"]),
+                transcript_consequence("ENST2", ["upstream_gene_variant"]),
+                transcript_consequence("ENST3", ["splice_region_variant", "missense_variant"], canonical=1),
+                transcript_consequence("ENST4", ["missense_variant"], biotype="processed_transcript"),
+            ],
+        )
+
+        # the result is the same for cached VEP results
+        for vep_root in [vep, select_vep_fields(vep)]:
+            result = hl.eval(get_expr_for_vep_sorted_transcript_consequences_array(vep_root))
+
+            self.assertListEqual([c.transcript_id for c in result], ["ENST3", "ENST1", "ENST4"])
+            self.assertListEqual(result[0].consequence_terms, ["splice_region_variant", "missense_variant"])
+            self.assertEqual(result[0].major_consequence, "missense_variant")
+            self.assertEqual(result[0].category, "missense")
+            self.assertEqual(result[1].category, "other")
+
+
+
+class TestConsequenceDicts(unittest.TestCase):
+    def test_consequence_dicts(self):
+        sorted_transcript_consequences = hl.literal([
+            hl.Struct(gene_id="ENSG1", transcript_id="ENST1", major_consequence="missense_variant"),
+            hl.Struct(gene_id="ENSG2", transcript_id="ENST2", major_consequence="intron_variant"),
+            hl.Struct(gene_id="ENSG1", transcript_id="ENST3", major_consequence="synonymous_variant"),
+        ])
+
+        result = hl.eval(hl.struct(**get_expr_for_vep_consequence_dicts(sorted_transcript_consequences, include_json=True)))
+
+        self.assertDictEqual(result.gene_id_to_consequence, {"ENSG1": "missense_variant", "ENSG2": "intron_variant"})
+        self.assertDictEqual(
+            result.transcript_id_to_consequence,
+            {"ENST1": "missense_variant", "ENST2": "intron_variant", "ENST3": "synonymous_variant"},
+        )
+        self.assertDictEqual(json.loads(result.gene_id_to_consequence_json), result.gene_id_to_consequence)
+        self.assertDictEqual(json.loads(result.transcript_id_to_consequence_json), result.transcript_id_to_consequence)
+
+
+if __name__ == "__main__":
+    unittest.main()
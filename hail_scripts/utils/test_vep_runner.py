@@ -0,0 +1,176 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import hail as hl
+from pyspark.sql import types as spark_types
+
+from .vep_runner import (
+    VepRunner,
+    conform_to_vep_schema,
+    export_sites_for_vep,
+    parse_vep_json_schema,
+    vep_schema_to_hail_type_string,
+    vep_schema_to_spark_type,
+)
+
+VEP_JSON_SCHEMA = (
+    "Struct{input:String,most_severe_consequence:String,start:Int32,"
+    "transcript_consequences:Array[Struct{gene_id:String,consequence_terms:Array[String],sift_score:Float64}]}"
+)
+
+# echoes canned json for every variant it reads from stdin. Fails on its first run if FAIL_ONCE_FILE doesn't exist.
+FAKE_VEP_SCRIPT = """
+import json, os, sys
+
+fail_once_file = os.environ.get("FAIL_ONCE_FILE")
+if fail_once_file and not os.path.exists(fail_once_file):
+    open(fail_once_file, "w").close()
+    sys.exit(1)
+
+for line in sys.stdin:
+    if line.startswith("#"):
+        continue
+    fields = line.rstrip("\\n").split("\\t")
+    print(json.dumps({
+        "input": line.rstrip("\\n"),
+        "most_severe_consequence": "missense_variant",
+        "start": fields[1],
+        "id": ".",
+        "transcript_consequences": [
+            {"gene_id": "ENSG1", "consequence_terms": ["missense_variant"], "sift_score": 0.01, "extra": 1},
+        ],
+    }))
+"""
+
+
+class TestVepRunner(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+        fake_vep_path = os.path.join(self.temp_dir, "fake_vep.py")
+        with open(fake_vep_path, "w") as f:
+            f.write(FAKE_VEP_SCRIPT)
+
+        self.config = {
+            "command": [sys.executable, fake_vep_path, "--format", "vcf", "--json", "-o", "STDOUT"],
+            "env": {"FAIL_ONCE_FILE": os.path.join(self.temp_dir, "failed_once")},
+            "vep_json_schema": VEP_JSON_SCHEMA,
+        }
+
+        self.input_paths = []
+        for i, lines in enumerate([["1\t100\t.\tA\tG,T"], ["2\t200\t.\tC\tCA", "X\t300\t.\tG\tA"]]):
+            input_path = os.path.join(self.temp_dir, "part-%d" % i)
+            with open(input_path, "w") as f:
+                f.write("".join("%s\t.\t.\t.\n" % line for line in lines))
+            self.input_paths.append(input_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_schema(self):
+        parsed_schema = parse_vep_json_schema(VEP_JSON_SCHEMA)
+
+        self.assertEqual(
+            vep_schema_to_hail_type_string(parsed_schema),
+            "struct{`input`: str, `most_severe_consequence`: str, `start`: int32, `transcript_consequences`: "
+            "array<struct{`gene_id`: str, `consequence_terms`: array<str>, `sift_score`: float64}>}",
+        )
+        self.assertEqual(
+            vep_schema_to_spark_type(parse_vep_json_schema("Struct{start:Int32,terms:Set[String]}")),
+            spark_types.StructType([
+                spark_types.StructField("start", spark_types.IntegerType()),
+                spark_types.StructField("terms", spark_types.ArrayType(spark_types.StringType())),
+            ]),
+        )
+        self.assertDictEqual(
+            conform_to_vep_schema({"start": "5", "transcript_consequences": [{"sift_score": "x"}], "id": "."}, parsed_schema),
+            {
+                "input": None,
+                "most_severe_consequence": None,
+                "start": 5,
+                "transcript_consequences": [{"gene_id": None, "consequence_terms": None, "sift_score": None}],
+            },
+        )
+
+    def test_run_with_retry(self):
+        runner = VepRunner(self.config, num_workers=2, max_retries=1)
+        output_paths = runner.run(self.input_paths, os.path.join(self.temp_dir, "results"))
+
+        rows = []
+        for output_path in output_paths:
+            with open(output_path) as f:
+                rows.extend(json.loads(line) for line in f)
+
+        self.assertListEqual(
+            [(row["contig"], row["position"], row["alleles"]) for row in rows],
+            [("1", 100, ["A", "G", "T"]), ("2", 200, ["C", "CA"]), ("X", 300, ["G", "A"])],
+        )
+        self.assertEqual(rows[0]["vep"]["start"], 100)
+        self.assertDictEqual(
+            rows[0]["vep"]["transcript_consequences"][0],
+            {"gene_id": "ENSG1", "consequence_terms": ["missense_variant"], "sift_score": 0.01},
+        )
+
+    def test_rerun_stale_results(self):
+        runner = VepRunner(self.config, max_retries=1)
+        results_dir = os.path.join(self.temp_dir, "results")
+        output_path = runner.run(self.input_paths[:1], results_dir)[0]
+
+        # a chunk that's newer than its results is from a different export
+        with open(self.input_paths[0], "w") as f:
+            f.write("3\t400\t.\tT\tC\t.\t.\t.\n")
+        os.utime(self.input_paths[0], (os.path.getmtime(output_path) + 10,) * 2)
+
+        runner.run(self.input_paths[:1], results_dir)
+        with open(output_path) as f:
+            self.assertEqual(json.loads(f.readline())["contig"], "3")
+
+    def test_run_failure(self):
+        runner = VepRunner(self.config, max_retries=0)
+        with self.assertRaises(RuntimeError):
+            runner.run(self.input_paths[:1], os.path.join(self.temp_dir, "results"))
+
+
+class TestExportSitesForVep(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _get_sites(self, alt_alleles):
+        ht = hl.Table.parallelize(
+            [{"locus": hl.Locus("1", 100 * (i + 1)), "alleles": ["A", alt]} for i, alt in enumerate(alt_alleles)],
+            hl.tstruct(locus=hl.tlocus("GRCh37"), alleles=hl.tarray(hl.tstr)),
+        )
+        return ht.key_by("locus", "alleles")
+
+    def _read_sites(self, chunk_paths):
+        lines = []
+        for chunk_path in chunk_paths:
+            with open(chunk_path) as f:
+                lines.extend(line.rstrip("\n") for line in f)
+        return sorted(lines)
+
+    def test_reexport_different_sites(self):
+        chunk_paths = export_sites_for_vep(self._get_sites(["G", "T"]), self.temp_dir, 1)
+        self.assertListEqual(
+            self._read_sites(chunk_paths), ["1\t100\t.\tA\tG\t.\t.\t.", "1\t200\t.\tA\tT\t.\t.\t."])
+        modification_time = os.path.getmtime(chunk_paths[0])
+
+        # the same sites re-use the exported chunks
+        self.assertListEqual(export_sites_for_vep(self._get_sites(["G", "T"]), self.temp_dir, 1), chunk_paths)
+        self.assertEqual(os.path.getmtime(chunk_paths[0]), modification_time)
+
+        # different sites are exported again, even if there are as many of them
+        chunk_paths = export_sites_for_vep(self._get_sites(["G", "C"]), self.temp_dir, 1)
+        self.assertListEqual(
+            self._read_sites(chunk_paths), ["1\t100\t.\tA\tG\t.\t.\t.", "1\t200\t.\tA\tC\t.\t.\t."])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,10 @@
+import os
+
 import hail as hl
 
+from utils.annotation_cache import AnnotationCache, get_config_hash, get_dict_hash
+from utils.vep_runner import run_vep
+
 
 # Consequence terms in order of severity (more severe to less severe) as estimated by Ensembl.
 # See https://ensembl.org/info/genome/variation/prediction/predicted_data.html
@@ -48,6 +53,38 @@ CONSEQUENCE_TERMS = [
 # hail DictExpression that maps each CONSEQUENCE_TERM to it's rank in the list
 CONSEQUENCE_TERM_RANK_LOOKUP = hl.dict({term: rank for rank, term in enumerate(CONSEQUENCE_TERMS)})
 
+# Consequence terms are handled as their rank (their "code") while sorting transcript consequences, so that finding the
+# most severe consequence is a min over small ints, and categories are range checks. Codes are decoded with this array.
+# They depend on the order of CONSEQUENCE_TERMS, so they're never stored - the VEP cache keeps the terms as strings.
+CONSEQUENCE_TERMS_BY_CODE = hl.literal(CONSEQUENCE_TERMS)
+
+# a major consequence code <= one of these is in the corresponding category
+LOF_MAX_CONSEQUENCE_CODE = CONSEQUENCE_TERMS.index("frameshift_variant")
+MISSENSE_MAX_CONSEQUENCE_CODE = CONSEQUENCE_TERMS.index("missense_variant")
+SYNONYMOUS_MAX_CONSEQUENCE_CODE = CONSEQUENCE_TERMS.index("synonymous_variant")
+
+
+def get_expr_for_consequence_term_codes(consequence_terms):
+    """Encodes an array of consequence terms as their codes. Terms that aren't in CONSEQUENCE_TERMS are dropped."""
+
+    return consequence_terms.map(lambda t: CONSEQUENCE_TERM_RANK_LOOKUP.get(t)).filter(lambda code: hl.is_defined(code))
+
+
+def get_expr_for_consequence_terms_from_codes(consequence_term_codes):
+    return consequence_term_codes.map(lambda code: CONSEQUENCE_TERMS_BY_CODE[code])
+
+
+def get_expr_for_consequence_category(consequence_code):
+    """Returns "lof", "missense", "synonymous" or "other" for a major consequence code"""
+
+    return (
+        hl.case()
+        .when(consequence_code <= LOF_MAX_CONSEQUENCE_CODE, "lof")
+        .when(consequence_code <= MISSENSE_MAX_CONSEQUENCE_CODE, "missense")
+        .when(consequence_code <= SYNONYMOUS_MAX_CONSEQUENCE_CODE, "synonymous")
+        .default("other")
+    )
+
 
 OMIT_CONSEQUENCE_TERMS = [
     "upstream_gene_variant",
@@ -152,6 +189,9 @@ def get_expr_for_vep_sorted_transcript_consequences_array(vep_root,
             (see http://www.ensembl.org/info/genome/variation/predicted_data.html)
         category: set to one of: "lof", "missense", "synonymous", "other" based on the value of major_consequence.
 
+    Consequence terms are compared as codes (see get_expr_for_consequence_term_codes(..)) and decoded back to
+    strings in the returned array.
+
     Args:
         vep_root (StructExpression): root path of the VEP struct in the MT
         include_coding_annotations (bool): if True, fields relevant to protein-coding variants will be included
@@ -185,61 +225,54 @@ def get_expr_for_vep_sorted_transcript_consequences_array(vep_root,
             ]
         )
 
-    omit_consequence_terms = hl.set(omit_consequences) if omit_consequences else hl.empty_set(hl.tstr)
-
-    result = hl.sorted(
-        vep_root.transcript_consequences.map(
-            lambda c: c.select(
-                *selected_annotations,
-                consequence_terms=c.consequence_terms.filter(lambda t: ~omit_consequence_terms.contains(t)),
-                domains=c.domains.map(lambda domain: domain.db + ":" + domain.name),
-                major_consequence=hl.cond(
-                    c.consequence_terms.size() > 0,
-                    hl.sorted(c.consequence_terms, key=lambda t: CONSEQUENCE_TERM_RANK_LOOKUP.get(t))[0],
-                    hl.null(hl.tstr),
+    omit_consequence_codes = hl.literal(
+        {CONSEQUENCE_TERMS.index(t) for t in (omit_consequences or [])}, dtype=hl.tset(hl.tint32))
+
+    result = hl.bind(
+        lambda most_severe_consequence_code: hl.sorted(
+            vep_root.transcript_consequences.map(
+                lambda c: hl.bind(
+                    lambda codes: c.select(
+                        *selected_annotations,
+                        consequence_term_codes=codes.filter(lambda code: ~omit_consequence_codes.contains(code)),
+                        domains=c.domains.map(lambda domain: domain.db + ":" + domain.name),
+                        major_consequence_rank=hl.min(codes),
+                    ),
+                    get_expr_for_consequence_term_codes(c.consequence_terms),
                 )
             )
-        )
-        .filter(lambda c: c.consequence_terms.size() > 0)
-        .map(
-            lambda c: c.annotate(
-                category=(
-                    hl.case()
-                    .when(
-                        CONSEQUENCE_TERM_RANK_LOOKUP.get(c.major_consequence)
-                        <= CONSEQUENCE_TERM_RANK_LOOKUP.get("frameshift_variant"),
-                        "lof",
-                    )
-                    .when(
-                        CONSEQUENCE_TERM_RANK_LOOKUP.get(c.major_consequence)
-                        <= CONSEQUENCE_TERM_RANK_LOOKUP.get("missense_variant"),
-                        "missense",
-                    )
-                    .when(
-                        CONSEQUENCE_TERM_RANK_LOOKUP.get(c.major_consequence)
-                        <= CONSEQUENCE_TERM_RANK_LOOKUP.get("synonymous_variant"),
-                        "synonymous",
-                    )
-                    .default("other")
-                ),
-                hgvs=get_expr_for_formatted_hgvs(c),
-                major_consequence_rank=CONSEQUENCE_TERM_RANK_LOOKUP.get(c.major_consequence),
-            )
-        ),
-        lambda c: (
-            hl.bind(
-                lambda is_coding, is_most_severe, is_canonical: (
-                    hl.cond(
-                        is_coding,
-                        hl.cond(is_most_severe, hl.cond(is_canonical, 1, 2), hl.cond(is_canonical, 3, 4)),
-                        hl.cond(is_most_severe, hl.cond(is_canonical, 5, 6), hl.cond(is_canonical, 7, 8)),
-                    )
-                ),
-                hl.or_else(c.biotype, "") == "protein_coding",
-                hl.set(c.consequence_terms).contains(vep_root.most_severe_consequence),
-                hl.or_else(c.canonical, 0) == 1,
-            )
+            .filter(lambda c: c.consequence_term_codes.size() > 0),
+            lambda c: (
+                hl.bind(
+                    lambda is_coding, is_most_severe, is_canonical: (
+                        hl.cond(
+                            is_coding,
+                            hl.cond(is_most_severe, hl.cond(is_canonical, 1, 2), hl.cond(is_canonical, 3, 4)),
+                            hl.cond(is_most_severe, hl.cond(is_canonical, 5, 6), hl.cond(is_canonical, 7, 8)),
+                        )
+                    ),
+                    hl.or_else(c.biotype, "") == "protein_coding",
+                    c.consequence_term_codes.contains(most_severe_consequence_code),
+                    hl.or_else(c.canonical, 0) == 1,
+                )
+            ),
         ),
+        CONSEQUENCE_TERM_RANK_LOOKUP.get(vep_root.most_severe_consequence),
+    )
+
+    # decode consequence strings only for the sorted output
+    result = result.map(
+        lambda c: c.annotate(
+            consequence_terms=get_expr_for_consequence_terms_from_codes(c.consequence_term_codes),
+            major_consequence=CONSEQUENCE_TERMS_BY_CODE[c.major_consequence_rank],
+        ).drop("consequence_term_codes")
+    )
+
+    result = result.map(
+        lambda c: c.annotate(
+            category=get_expr_for_consequence_category(c.major_consequence_rank),
+            hgvs=get_expr_for_formatted_hgvs(c),
+        )
     )
 
     if not include_coding_annotations:
@@ -257,33 +290,90 @@ def get_expr_for_vep_protein_domains_set_from_sorted(vep_sorted_transcript_conse
     )
 
 
-def get_expr_for_vep_gene_id_to_consequence_map(vep_sorted_transcript_consequences_root, gene_ids):
-    # Manually build string because hl.json encodes a dictionary as [{ key: ..., value: ... }, ...]
-    return (
-        "{"
-        + hl.delimit(
-            gene_ids.map(
-                lambda gene_id: hl.bind(
-                    lambda worst_consequence_in_gene: '"' + gene_id + '":"' + worst_consequence_in_gene.major_consequence + '"',
-                    vep_sorted_transcript_consequences_root.find(lambda c: c.gene_id == gene_id)
-                )
-            )
-        )
-        + "}"
+def get_expr_for_vep_worst_consequence_per_gene(vep_sorted_transcript_consequences_root):
+    """Returns the first (ie. worst) transcript consequence for each gene in the array returned by
+    get_expr_for_vep_sorted_transcript_consequences_array(..). The transcripts are grouped by gene in one pass.
+
+    Args:
+        vep_sorted_transcript_consequences_root (ArrayExpression): sorted transcript consequences
+    Returns:
+        ArrayExpression: one transcript consequence per gene
+    """
+
+    return hl.group_by(
+        lambda index_and_csq: index_and_csq[1].gene_id, hl.zip_with_index(vep_sorted_transcript_consequences_root)
+    ).values().map(
+        lambda gene_csqs: hl.sorted(gene_csqs, key=lambda index_and_csq: index_and_csq[0])[0][1]
     )
 
 
-def get_expr_for_vep_transcript_id_to_consequence_map(vep_transcript_consequences_root):
-    # Manually build string because hl.json encodes a dictionary as [{ key: ..., value: ... }, ...]
-    return (
-        "{"
-        + hl.delimit(
-            vep_transcript_consequences_root.map(lambda c: '"' + c.transcript_id + '": "' + c.major_consequence + '"')
-        )
-        + "}"
+def get_expr_for_vep_gene_id_to_consequence_dict(vep_sorted_transcript_consequences_root):
+    """Maps each gene id to the major consequence of its worst transcript consequence.
+
+    Args:
+        vep_sorted_transcript_consequences_root (ArrayExpression): sorted transcript consequences
+    Returns:
+        DictExpression: gene id to major consequence
+    """
+
+    return hl.dict(
+        get_expr_for_vep_worst_consequence_per_gene(vep_sorted_transcript_consequences_root).map(
+            lambda c: (c.gene_id, c.major_consequence))
     )
 
 
+def get_expr_for_vep_transcript_id_to_consequence_dict(vep_transcript_consequences_root):
+    return hl.dict(vep_transcript_consequences_root.map(lambda c: (c.transcript_id, c.major_consequence)))
+
+
+def get_expr_for_consequence_dict_json(consequence_dict):
+    # Manually build string because hl.json encodes a dictionary as [{ key: ..., value: ... }, ...]
+    return "{" + hl.delimit(hl.array(consequence_dict).map(lambda item: '"' + item[0] + '":"' + item[1] + '"')) + "}"
+
+
+def get_expr_for_vep_gene_id_to_consequence_map(vep_sorted_transcript_consequences_root, gene_ids):
+    """JSON string form of get_expr_for_vep_gene_id_to_consequence_dict(..), limited to gene_ids. Kept for
+    consumers of gene_id_to_consequence_json."""
+
+    return get_expr_for_consequence_dict_json(hl.dict(
+        hl.array(get_expr_for_vep_gene_id_to_consequence_dict(vep_sorted_transcript_consequences_root)).filter(
+            lambda item: gene_ids.contains(item[0]))
+    ))
+
+
+def get_expr_for_vep_transcript_id_to_consequence_map(vep_transcript_consequences_root):
+    """JSON string form of get_expr_for_vep_transcript_id_to_consequence_dict(..). Kept for consumers of
+    transcript_id_to_consequence_json."""
+
+    return get_expr_for_consequence_dict_json(
+        get_expr_for_vep_transcript_id_to_consequence_dict(vep_transcript_consequences_root))
+
+
+def get_expr_for_vep_consequence_dicts(vep_sorted_transcript_consequences_root, include_json=False):
+    """Returns the gene_id_to_consequence and transcript_id_to_consequence fields for a variant, and optionally
+    their JSON string forms (gene_id_to_consequence_json and transcript_id_to_consequence_json) for consumers
+    that still parse those.
+
+    Args:
+        vep_sorted_transcript_consequences_root (ArrayExpression): sorted transcript consequences
+        include_json (bool): whether to also return the JSON string fields
+    Returns:
+        dict: field name to expression
+    """
+
+    fields = {
+        "gene_id_to_consequence": get_expr_for_vep_gene_id_to_consequence_dict(
+            vep_sorted_transcript_consequences_root),
+        "transcript_id_to_consequence": get_expr_for_vep_transcript_id_to_consequence_dict(
+            vep_sorted_transcript_consequences_root),
+    }
+
+    if include_json:
+        fields.update({"%s_json" % field: get_expr_for_consequence_dict_json(expr) for field, expr in fields.items()})
+
+    return fields
+
+
 def get_expr_for_vep_transcript_ids_set(vep_transcript_consequences_root):
     return hl.set(vep_transcript_consequences_root.map(lambda c: c.transcript_id))
 
@@ -343,3 +433,180 @@ def get_expr_for_worst_transcript_consequence_annotations_struct(
             vep_sorted_transcript_consequences_root[0],
         ),
     )
+
+
+# The parts of the VEP output that the functions above use, with their types in vep_json_schema syntax. The slim
+# VEP configs only ask VEP for these, and select_vep_fields(..) drops everything else right after annotation.
+VEP_TRANSCRIPT_CONSEQUENCE_FIELDS = {
+    "amino_acids": "String",
+    "biotype": "String",
+    "canonical": "Int32",
+    "cdna_start": "Int32",
+    "cdna_end": "Int32",
+    "codons": "String",
+    "consequence_terms": "Array[String]",
+    "domains": "Array[Struct{db:String,name:String}]",
+    "gene_id": "String",
+    "gene_symbol": "String",
+    "hgvsc": "String",
+    "hgvsp": "String",
+    "lof": "String",
+    "lof_filter": "String",
+    "lof_flags": "String",
+    "lof_info": "String",
+    "polyphen_prediction": "String",
+    "protein_id": "String",
+    "protein_start": "Int32",
+    "sift_prediction": "String",
+    "transcript_id": "String",
+}
+
+VEP_TOP_LEVEL_FIELDS = {
+    # hl.vep(..) matches each result back to its variant by its input line, so the schema has to keep it
+    "input": "String",
+    "most_severe_consequence": "String",
+}
+
+# VEP flags needed to get each of the fields above. Fields that aren't listed here are always in the json output.
+VEP_FIELD_FLAGS = {
+    "biotype": ["--biotype"],
+    "canonical": ["--canonical"],
+    "domains": ["--domains"],
+    "gene_symbol": ["--symbol"],
+    "hgvsc": ["--hgvs"],
+    "hgvsp": ["--hgvs"],
+    "polyphen_prediction": ["--polyphen", "p"],
+    "protein_id": ["--protein"],
+    "sift_prediction": ["--sift", "p"],
+}
+
+# flags that only add output fields. These are replaced by the flags for the fields we use.
+VEP_OUTPUT_FLAGS = {
+    "--everything", "--sift", "--polyphen", "--ccds", "--uniprot", "--hgvs", "--symbol", "--numbers", "--domains",
+    "--regulatory", "--canonical", "--protein", "--biotype", "--af", "--af_1kg", "--af_esp", "--af_gnomad", "--af_exac",
+    "--max_af", "--pubmed", "--variant_class", "--gene_phenotype", "--mirna", "--tsl", "--appris", "--check_existing",
+}
+
+# flags from VEP_OUTPUT_FLAGS that take a value
+VEP_OUTPUT_FLAGS_WITH_VALUES = {"--sift", "--polyphen"}
+
+
+def get_slim_vep_json_schema():
+    """Returns a vep_json_schema with only VEP_TOP_LEVEL_FIELDS and VEP_TRANSCRIPT_CONSEQUENCE_FIELDS"""
+
+    transcript_consequence_schema = ",".join(
+        "%s:%s" % (field, field_type) for field, field_type in sorted(VEP_TRANSCRIPT_CONSEQUENCE_FIELDS.items()))
+
+    fields = dict(VEP_TOP_LEVEL_FIELDS, transcript_consequences="Array[Struct{%s}]" % transcript_consequence_schema)
+
+    return "Struct{%s}" % ",".join("%s:%s" % (field, field_type) for field, field_type in sorted(fields.items()))
+
+
+def get_slim_vep_command(command):
+    """Replaces the output flags in a VEP command (eg. --everything) with only the flags needed for the fields in
+    VEP_TRANSCRIPT_CONSEQUENCE_FIELDS. Other options such as --plugin, --cache, --minimal or --allele_number are
+    kept as they are.
+
+    Args:
+        command (list): VEP command from a VEP config json
+    Returns:
+        list: the new command
+    """
+
+    slim_command = []
+    args = iter(command)
+    for arg in args:
+        if arg in VEP_OUTPUT_FLAGS_WITH_VALUES:
+            next(args, None)
+        elif arg not in VEP_OUTPUT_FLAGS:
+            slim_command.append(arg)
+
+    flags = []
+    for field in sorted(VEP_TRANSCRIPT_CONSEQUENCE_FIELDS):
+        field_flags = VEP_FIELD_FLAGS.get(field, [])
+        if field_flags and field_flags[0] not in flags:
+            flags.extend(field_flags)
+
+    # insert the flags before "-o" so the output arguments stay at the end
+    insert_index = slim_command.index("-o") if "-o" in slim_command else len(slim_command)
+
+    return slim_command[:insert_index] + flags + slim_command[insert_index:]
+
+
+def get_slim_vep_config(config):
+    """Returns a copy of a VEP config dict with a slim command and vep_json_schema"""
+
+    return dict(config, command=get_slim_vep_command(config["command"]), vep_json_schema=get_slim_vep_json_schema())
+
+
+def select_vep_fields(vep_root):
+    """Drops the parts of a VEP struct that aren't used downstream, so they don't take up space in every row.
+
+    Args:
+        vep_root (StructExpression): VEP struct, as added by hl.vep(..)
+    Returns:
+        StructExpression: VEP struct with only the VEP_TOP_LEVEL_FIELDS (except input, which is only needed to match
+            VEP results to variants) and VEP_TRANSCRIPT_CONSEQUENCE_FIELDS that it has. Consequence terms stay
+            strings, so cached results don't depend on CONSEQUENCE_TERMS.
+    """
+
+    transcript_consequence_fields = [
+        field for field in VEP_TRANSCRIPT_CONSEQUENCE_FIELDS
+        if field in vep_root.transcript_consequences.dtype.element_type.fields
+    ]
+
+    return vep_root.select(
+        *[field for field in VEP_TOP_LEVEL_FIELDS if field in vep_root.dtype.fields and field != "input"],
+        transcript_consequences=vep_root.transcript_consequences.map(lambda c: c.select(*transcript_consequence_fields)),
+    )
+
+
+# bump this when select_vep_fields(..) changes what's cached, so that old cache parts aren't mixed with new ones.
+# Version 1 stored consequence terms as codes.
+VEP_CACHE_FORMAT_VERSION = 2
+
+
+def vep_with_cache(ht, vep_config_path, cache_root, block_size=1000, num_workers=None, work_dir="vep_work"):
+    """Runs VEP on the variants in ht that it hasn't seen before with this VEP config, and takes the rest from
+    the cache.
+
+    The cache is versioned by a hash of the VEP config json (command, cache version, LOFTEE plugin args, ..) and by
+    VEP_CACHE_FORMAT_VERSION, so changing either starts a new cache instead of mixing in results from the old one.
+
+    Args:
+        ht (Table): table keyed by locus and alleles
+        vep_config_path (str): VEP config json, as passed to hl.vep(..)
+        cache_root (str): directory where VEP caches are kept
+        block_size (int): number of variants to send to one VEP process
+        num_workers (int): if set, VEP runs outside of spark with this many local processes (see run_vep(..))
+            instead of through hl.vep(..)
+        work_dir (str): local directory for run_vep(..) inputs and outputs
+    Returns:
+        Table: ht with a "vep" field
+    """
+
+    if list(ht.key) != ["locus", "alleles"]:
+        raise ValueError("vep_with_cache(..) needs a table keyed by locus and alleles, not: %s" % ", ".join(ht.key))
+
+    cache_version = get_dict_hash({
+        "vep_config": get_config_hash(vep_config_path), "cache_format": VEP_CACHE_FORMAT_VERSION})
+    cache = AnnotationCache(cache_root, "vep", cache_version)
+
+    # keep a copy of the config next to the results it was used for
+    cached_config_path = "%s/config.json" % cache.path
+    if not hl.hadoop_exists(cached_config_path):
+        hl.hadoop_copy(vep_config_path, cached_config_path)
+
+    # a failed run is resumed by the next call, and each new cache part gets a fresh directory
+    run_work_dir = os.path.join(work_dir, os.path.basename(cache.path), "part-%d" % len(cache.part_paths()))
+
+    def annotate_func(new_variants):
+        if num_workers:
+            new_variants = run_vep(new_variants, vep_config_path, run_work_dir, num_workers=num_workers)
+        else:
+            new_variants = hl.vep(new_variants, vep_config_path, block_size=block_size)
+
+        # only cache the parts of the VEP output that are used downstream
+        return new_variants.annotate(vep=select_vep_fields(new_variants.vep))
+
+    return cache.annotate(ht, "vep", annotate_func)
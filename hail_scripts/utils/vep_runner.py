@@ -0,0 +1,479 @@
+import concurrent.futures
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+
+import hail as hl
+from hail.utils.java import Env
+from pyspark.sql import types as spark_types
+
+from utils.document_hash import get_expr_for_document_hash
+
+logger = logging.getLogger()
+
+
+# VEP only needs the first 5 columns, but it checks that the input looks like a VCF
+VCF_HEADER = "##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+
+# old-style hail type names used in vep_json_schema -> current hail type names
+VEP_SCHEMA_PRIMITIVE_TYPES = {
+    "String": "str",
+    "Int32": "int32",
+    "Int64": "int64",
+    "Float32": "float32",
+    "Float64": "float64",
+    "Boolean": "bool",
+}
+
+VEP_SCHEMA_SPARK_TYPES = {
+    "String": spark_types.StringType,
+    "Int32": spark_types.IntegerType,
+    "Int64": spark_types.LongType,
+    "Float32": spark_types.FloatType,
+    "Float64": spark_types.DoubleType,
+    "Boolean": spark_types.BooleanType,
+}
+
+# written next to the exported VEP input chunks, to tell whether they're from the same variants
+SITES_MANIFEST_FILE_NAME = "_manifest.json"
+
+
+def parse_vep_json_schema(schema):
+    """Parses the old-style hail type string in a VEP config's vep_json_schema.
+
+    Args:
+        schema (str): eg. "Struct{allele_string:String,transcript_consequences:Array[Struct{gene_id:String}]}"
+    Returns:
+        A tree of tuples: ("struct", [(field name, type), ..]), ("array", element type), ("set", element type), or
+        the name of a primitive type (eg. "String")
+    """
+
+    tokens = re.findall(r"[A-Za-z0-9_]+|`[^`]*`|[{}\[\],:]", schema)
+    position = [0]
+
+    def next_token():
+        token = tokens[position[0]]
+        position[0] += 1
+        return token
+
+    def expect(expected):
+        token = next_token()
+        if token != expected:
+            raise ValueError("Unexpected '%s' in vep_json_schema, expected '%s'" % (token, expected))
+
+    def parse_type():
+        token = next_token()
+        if token == "Struct":
+            expect("{")
+            fields = []
+            if tokens[position[0]] == "}":
+                next_token()
+                return ("struct", fields)
+            while True:
+                field_name = next_token().strip("`")
+                expect(":")
+                fields.append((field_name, parse_type()))
+                token = next_token()
+                if token == "}":
+                    return ("struct", fields)
+                if token != ",":
+                    raise ValueError("Unexpected '%s' in vep_json_schema struct" % token)
+        if token in ("Array", "Set"):
+            expect("[")
+            element_type = parse_type()
+            expect("]")
+            return (token.lower(), element_type)
+        if token in VEP_SCHEMA_PRIMITIVE_TYPES:
+            return token
+
+        raise ValueError("Unsupported type in vep_json_schema: %s" % token)
+
+    parsed_schema = parse_type()
+    if position[0] != len(tokens):
+        raise ValueError("Unexpected trailing characters in vep_json_schema: %s" % "".join(tokens[position[0]:]))
+
+    return parsed_schema
+
+
+def vep_schema_to_hail_type_string(parsed_schema):
+    """Converts the output of parse_vep_json_schema(..) to a type string that hl.dtype(..) accepts"""
+
+    if isinstance(parsed_schema, str):
+        return VEP_SCHEMA_PRIMITIVE_TYPES[parsed_schema]
+
+    kind, content = parsed_schema
+    if kind == "struct":
+        return "struct{%s}" % ", ".join(
+            "`%s`: %s" % (name, vep_schema_to_hail_type_string(t)) for name, t in content)
+
+    return "%s<%s>" % (kind, vep_schema_to_hail_type_string(content))
+
+
+def vep_schema_to_spark_type(parsed_schema):
+    """Converts the output of parse_vep_json_schema(..) to a spark sql type for reading VepRunner output.
+    Sets become arrays, since that's how VepRunner writes them.
+    """
+
+    if isinstance(parsed_schema, str):
+        return VEP_SCHEMA_SPARK_TYPES[parsed_schema]()
+
+    kind, content = parsed_schema
+    if kind == "struct":
+        return spark_types.StructType([
+            spark_types.StructField(name, vep_schema_to_spark_type(t)) for name, t in content])
+
+    return spark_types.ArrayType(vep_schema_to_spark_type(content))
+
+
+def _get_expr_for_sets(expr, parsed_schema):
+    """Converts the arrays in expr that are sets in parsed_schema back to sets"""
+
+    if isinstance(parsed_schema, str):
+        return expr
+
+    kind, content = parsed_schema
+    if kind == "struct":
+        return hl.struct(**{name: _get_expr_for_sets(expr[name], t) for name, t in content})
+
+    elements = expr.map(lambda element: _get_expr_for_sets(element, content))
+
+    return hl.set(elements) if kind == "set" else elements
+
+
+def conform_to_vep_schema(value, parsed_schema, sets_as_lists=False):
+    """Converts a value parsed from VEP json output to match the schema: unknown fields are dropped, missing fields
+    are set to None, and numbers and strings are coerced to the schema's primitive types (or None if they can't be).
+
+    Args:
+        value: parsed json value
+        parsed_schema: output of parse_vep_json_schema(..)
+        sets_as_lists (bool): return Set values as lists, so the result can be serialized to json
+    """
+
+    if value is None:
+        return None
+
+    if isinstance(parsed_schema, str):
+        try:
+            if parsed_schema == "String":
+                return value if isinstance(value, str) else json.dumps(value)
+            if parsed_schema in ("Int32", "Int64"):
+                return int(value)
+            if parsed_schema in ("Float32", "Float64"):
+                return float(value)
+            return bool(value)
+        except (TypeError, ValueError):
+            return None
+
+    kind, content = parsed_schema
+    if kind == "struct":
+        if not isinstance(value, dict):
+            return None
+        return {name: conform_to_vep_schema(value.get(name), t, sets_as_lists) for name, t in content}
+
+    if not isinstance(value, list):
+        value = [value]
+    elements = [conform_to_vep_schema(v, content, sets_as_lists) for v in value]
+
+    return elements if kind == "array" or sets_as_lists else set(elements)
+
+
+def parse_vcf_input_line(line):
+    """Returns the (contig, position, alleles) of a VCF line, as echoed in the "input" field of VEP json output"""
+
+    fields = line.rstrip("\n").split("\t")
+
+    return fields[0], int(fields[1]), [fields[3]] + fields[4].split(",")
+
+
+class VepRunner:
+    """Runs VEP on chunked VCFs in separate worker processes, outside of spark.
+
+    Each chunk is run with the command and env from a hail VEP config (eg. vep85-loftee-cyan.json). VEP's --json
+    output is parsed line by line as it's produced, conformed to the config's vep_json_schema, and written to a
+    "<chunk>.json" file with one {"contig", "position", "alleles", "vep"} object per line. Chunks that fail are
+    retried on their own, and chunks that already have newer results are skipped, so a run can be restarted.
+    """
+
+    def __init__(self, config, num_workers=4, max_retries=2, timeout=None):
+        """Constructor.
+
+        Args:
+            config (str or dict): VEP config json path, or the parsed config. Needs "command" and "vep_json_schema",
+                and optionally "env".
+            num_workers (int): number of VEP processes to run at the same time
+            max_retries (int): how many times to re-run a chunk that failed
+            timeout (int): (optional) seconds after which a VEP process is killed and its chunk retried
+        """
+
+        if isinstance(config, str):
+            with open(config) as f:
+                config = json.load(f)
+
+        self.command = [arg for arg in config["command"] if arg != "__OUTPUT_FORMAT_FLAG__"]
+        if "--json" not in self.command:
+            self.command.append("--json")
+
+        self.env = dict(os.environ)
+        self.env.update(config.get("env", {}))
+
+        self.vep_json_schema = config["vep_json_schema"]
+        self.parsed_schema = parse_vep_json_schema(self.vep_json_schema)
+        self.num_workers = num_workers
+        self.max_retries = max_retries
+        self.timeout = timeout
+
+    def run_chunk(self, input_path, output_path):
+        """Runs VEP on one chunk of variants and writes the parsed results to output_path.
+
+        Args:
+            input_path (str): local file with VCF lines. Header lines are replaced with a minimal VCF header.
+            output_path (str): local path for the parsed results
+        Returns:
+            int: number of variants annotated
+        """
+
+        temp_output_path = output_path + ".tmp"
+        with open(output_path + ".log", "w") as log_file:
+            process = subprocess.Popen(
+                self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=log_file, env=self.env,
+                universal_newlines=True)
+
+            def write_input():
+                try:
+                    process.stdin.write(VCF_HEADER)
+                    with open(input_path) as f:
+                        for line in f:
+                            if not line.startswith("#"):
+                                process.stdin.write(line)
+                    process.stdin.close()
+                except (BrokenPipeError, ValueError):
+                    pass  # VEP exited early - reported through its exit code below
+
+            # write the input from another thread so VEP's output can be read while it's still running
+            writer = threading.Thread(target=write_input)
+            writer.start()
+
+            timer = None
+            if self.timeout:
+                timer = threading.Timer(self.timeout, process.kill)
+                timer.start()
+
+            num_variants = 0
+            try:
+                with open(temp_output_path, "w") as output_file:
+                    for line in process.stdout:
+                        if not line.strip():
+                            continue
+
+                        result = json.loads(line)
+                        contig, position, alleles = parse_vcf_input_line(result["input"])
+                        output_file.write(json.dumps({
+                            "contig": contig,
+                            "position": position,
+                            "alleles": alleles,
+                            "vep": conform_to_vep_schema(result, self.parsed_schema, sets_as_lists=True),
+                        }) + "\n")
+                        num_variants += 1
+
+                return_code = process.wait()
+            except Exception:
+                process.kill()
+                raise
+            finally:
+                if timer is not None:
+                    timer.cancel()
+                writer.join()
+                process.stdout.close()
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+
+        if return_code != 0:
+            raise RuntimeError("VEP exited with code %d on %s. See %s.log" % (return_code, input_path, output_path))
+
+        os.replace(temp_output_path, output_path)
+
+        return num_variants
+
+    def _run_chunk_with_retries(self, input_path, output_path):
+        for attempt in range(self.max_retries + 1):
+            try:
+                num_variants = self.run_chunk(input_path, output_path)
+                logger.info("==> VEP annotated %d variants in %s", num_variants, input_path)
+                return output_path
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning("VEP failed on %s, retrying (attempt %d of %d): %s",
+                               input_path, attempt + 1, self.max_retries, e)
+
+    def run(self, input_paths, output_dir):
+        """Runs VEP on all chunks, num_workers at a time.
+
+        Args:
+            input_paths (list): local VCF chunk paths
+            output_dir (str): local directory for the results
+        Returns:
+            list: result paths, in the same order as input_paths
+        """
+
+        os.makedirs(output_dir, exist_ok=True)
+        output_paths = [
+            os.path.join(output_dir, "%s.json" % os.path.basename(input_path)) for input_path in input_paths
+        ]
+
+        # results that are older than their chunk are from a previous export of different variants
+        def has_results(input_path, output_path):
+            return os.path.isfile(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            futures = [
+                executor.submit(self._run_chunk_with_retries, input_path, output_path)
+                for input_path, output_path in zip(input_paths, output_paths)
+                if not has_results(input_path, output_path)
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+
+        return output_paths
+
+
+def export_sites_for_vep(ht, output_dir, num_chunks):
+    """Exports the (locus, alleles) of a table as num_chunks local files of VCF lines.
+
+    Chunks from a previous call are re-used if they were exported from the same variants in the same number of
+    chunks, according to the manifest written next to them. Otherwise they're deleted and exported again. Variants
+    are compared by their count and the sum of a hash of each (locus, alleles), so the order of rows doesn't matter.
+
+    Args:
+        ht (Table): table keyed by locus and alleles
+        output_dir (str): local directory to export to
+        num_chunks (int): number of chunks to split the sites into
+    Returns:
+        list: paths of the chunk files
+    """
+
+    sites_path = os.path.join(output_dir, "sites")
+    manifest_path = os.path.join(sites_path, SITES_MANIFEST_FILE_NAME)
+    sites_summary = ht.aggregate(hl.struct(
+        num_sites=hl.agg.count(),
+        sites_fingerprint=hl.agg.sum(get_expr_for_document_hash(hl.struct(locus=ht.locus, alleles=ht.alleles))),
+    ))
+    manifest = {
+        "num_sites": sites_summary.num_sites,
+        "sites_fingerprint": sites_summary.sites_fingerprint,
+        "num_chunks": num_chunks,
+    }
+
+    previous_manifest = None
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as f:
+            previous_manifest = json.load(f)
+
+    if previous_manifest == manifest:
+        logger.info("==> re-using VEP input chunks in %s", sites_path)
+    else:
+        if os.path.isdir(sites_path):
+            logger.info("==> VEP input chunks in %s don't match %s (%s). Exporting them again",
+                        sites_path, manifest, previous_manifest)
+            shutil.rmtree(sites_path)
+
+        sites = ht.select().repartition(num_chunks).key_by()
+        sites = sites.select(line=hl.delimit([
+            sites.locus.contig,
+            hl.str(sites.locus.position),
+            ".",
+            sites.alleles[0],
+            hl.delimit(sites.alleles[1:], ","),
+            ".",
+            ".",
+            ".",
+        ], "\t"))
+
+        sites.export("file://" + os.path.abspath(sites_path), header=False, parallel="header_per_shard")
+
+        # written last, so an interrupted export is redone
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f)
+
+    return sorted(
+        os.path.join(sites_path, file_name) for file_name in os.listdir(sites_path) if file_name.startswith("part-"))
+
+
+def read_vep_results(result_paths, vep_json_schema, reference_genome="GRCh37"):
+    """Loads the output of VepRunner.run(..) into a hail table with the same schema as hl.vep(..).
+
+    The json lines are read by spark with an explicit schema, so the results are never collected on the driver.
+
+    Args:
+        result_paths (list): local paths written by VepRunner. They have to be readable by the spark workers, eg.
+            in local mode or on a shared filesystem.
+        vep_json_schema (str): vep_json_schema from the VEP config
+        reference_genome (str): reference genome of the loci
+    Returns:
+        Table: keyed by locus and alleles, with a "vep" field
+    """
+
+    if not result_paths:
+        raise ValueError("No VEP results to read")
+
+    parsed_schema = parse_vep_json_schema(vep_json_schema)
+    spark_schema = spark_types.StructType([
+        spark_types.StructField("contig", spark_types.StringType()),
+        spark_types.StructField("position", spark_types.IntegerType()),
+        spark_types.StructField("alleles", spark_types.ArrayType(spark_types.StringType())),
+        spark_types.StructField("vep", vep_schema_to_spark_type(parsed_schema)),
+    ])
+
+    df = Env.spark_session().read.json(
+        ["file://" + os.path.abspath(result_path) for result_path in result_paths], schema=spark_schema)
+
+    ht = hl.Table.from_spark(df)
+    ht = ht.select(
+        locus=hl.locus(ht.contig, ht.position, reference_genome),
+        alleles=ht.alleles,
+        vep=_get_expr_for_sets(ht.vep, parsed_schema) if "Set[" in vep_json_schema else ht.vep,
+    )
+
+    return ht.key_by("locus", "alleles")
+
+
+def run_vep(ht, config_path, work_dir, num_workers=4, num_chunks=None, max_retries=2, timeout=None):
+    """Out-of-spark replacement for hl.vep(..): annotates a table keyed by locus and alleles with a "vep" field.
+
+    Args:
+        ht (Table): table keyed by locus and alleles
+        config_path (str): local path of the VEP config json
+        work_dir (str): local directory for chunk inputs, VEP output and logs. Re-using it resumes a run.
+        num_workers (int): number of VEP processes to run at the same time
+        num_chunks (int): number of chunks to split the variants into. Defaults to 10 chunks per worker, so a slow
+            chunk doesn't hold up the others for long.
+        max_retries (int): how many times to re-run a chunk that failed
+        timeout (int): (optional) seconds after which a VEP process is killed and its chunk retried
+    Returns:
+        Table: ht with a "vep" field
+    Raises:
+        RuntimeError: if there are no VEP results for some of the variants in ht
+    """
+
+    runner = VepRunner(config_path, num_workers=num_workers, max_retries=max_retries, timeout=timeout)
+
+    input_paths = export_sites_for_vep(ht, work_dir, num_chunks or 10 * num_workers)
+    result_paths = runner.run(input_paths, os.path.join(work_dir, "results"))
+
+    reference_genome = ht.locus.dtype.reference_genome.name
+    vep_ht = read_vep_results(result_paths, runner.vep_json_schema, reference_genome=reference_genome)
+
+    # a variant without results would otherwise just get a missing vep field
+    num_missing_results = ht.select().anti_join(vep_ht).count()
+    if num_missing_results:
+        raise RuntimeError("%d variants have no VEP results in %s. Delete it to run VEP on all variants again" % (
+            num_missing_results, work_dir))
+
+    return ht.annotate(vep=vep_ht[ht.key].vep)